@@ -0,0 +1,321 @@
+"""
+Балансы карт в файле записей фиксированной длины, отображенном
+в память. Запись номер slot лежит по смещению slot * RECORD.size,
+поэтому баланс читается и меняется на месте: без запроса к базе
+и без копирования строк. Карты остаются в таблице card, номер записи
+с балансом карты хранит ее колонка slot.
+"""
+import mmap
+import os
+import struct
+import threading
+
+from banking import (CardNumberAllocator, SchemaError, TransactionError,
+                     check_transfer_amount, close_card, execute,
+                     executemany, immediate_transaction)
+
+# Номер карты числом (0 - свободная запись) и баланс
+RECORD = struct.Struct('<qq')
+BALANCE = struct.Struct('<q')
+BALANCE_OFFSET = 8
+
+
+class BalanceFile:
+    """Файл записей баланса, отображенный в память; растет вдвое."""
+
+    def __init__(self, path: str, capacity: int = 1024) -> None:
+        self.path = path
+        self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        # Недописанный хвост меньше записи отбрасывается
+        self.capacity = os.fstat(self.__fd).st_size // RECORD.size
+        self.__map = None
+        self.grow(max(capacity, self.capacity))
+
+    def grow(self, capacity: int) -> None:
+        """Увеличивает файл до capacity записей и отображает его заново."""
+        if self.__map is not None:
+            self.__map.close()
+        os.ftruncate(self.__fd, capacity * RECORD.size)
+        self.__map = mmap.mmap(self.__fd, capacity * RECORD.size)
+        self.capacity = capacity
+
+    def read(self, slot: int) -> tuple:
+        """Возвращает (номер карты, баланс) записи."""
+        return RECORD.unpack_from(self.__map, slot * RECORD.size)
+
+    def write(self, slot: int, number: int, balance: int) -> None:
+        RECORD.pack_into(self.__map, slot * RECORD.size, number, balance)
+
+    def balance(self, slot: int) -> int:
+        return BALANCE.unpack_from(self.__map,
+                                   slot * RECORD.size + BALANCE_OFFSET)[0]
+
+    def set_balance(self, slot: int, balance: int) -> None:
+        BALANCE.pack_into(self.__map, slot * RECORD.size + BALANCE_OFFSET,
+                          balance)
+
+    def flush(self) -> None:
+        """Записывает измененные страницы на диск."""
+        self.__map.flush()
+
+    def close(self) -> None:
+        if self.__map is None:
+            return
+        self.__map.flush()
+        self.__map.close()
+        self.__map = None
+        os.close(self.__fd)
+
+
+class MappedStorage:
+    """
+    Хранилище карт с балансами в BalanceFile, подходит вместо
+    соединения для Card. При открытии балансы карт таблицы card, у
+    которых еще нет записи в файле, переносятся в файл; detach
+    возвращает их обратно. Колонка balance у карт в файле хранит
+    баланс на момент переноса, с ним сходится журнал ledger.
+
+    Соответствие номера карты записи файла загружается при открытии,
+    поэтому изменение баланса и перевод не обращаются к базе вовсе,
+    а чтение карты запрашивает из базы только PIN. Изменения балансов
+    в ledger не пишутся: detach записывает разницу за все время
+    одной записью mapped на карту.
+
+    Изменения балансов попадают в кэш страниц ОС сразу и переживают
+    падение процесса, но на диск их записывают только flush, close
+    или сама ОС. При сбое системы последние изменения теряются, а
+    перевод может остаться выполненным наполовину: гарантии атомарности
+    перевода SQLiteStorage здесь нет. Файл и базу должен открывать
+    только один процесс.
+    """
+
+    in_transaction = False
+
+    def __init__(self, connect, path: str, capacity: int = 1024) -> None:
+        self.connect = connect
+        self.balances = BalanceFile(path, capacity)
+        self.card_cache = getattr(connect, 'card_cache', None)
+        self.card_filter = getattr(connect, 'card_filter', None)
+        self.pin_hasher = getattr(connect, 'pin_hasher', None)
+        self.__cursor = connect.cursor()
+        self.__lock = threading.Lock()
+        self.__slots = dict(
+            execute(self.__cursor, 'card_slot_scan').fetchall())
+        self.__check_file()
+        self.__free = []
+        self.__collect_free(0)
+        self.attached = self.__attach()
+
+    def __check_file(self) -> None:
+        """Каждой карте с номером записи нужна ее запись в файле."""
+        for number, slot in self.__slots.items():
+            if (slot >= self.balances.capacity
+                    or self.balances.read(slot)[0] != int(number)):
+                raise SchemaError(
+                    f"Balance file {self.balances.path} does not match the "
+                    f"database: it has no record for card {number}.")
+
+    def __collect_free(self, start: int) -> None:
+        """
+        Отмечает свободными записи с номера start, на которые не
+        ссылается таблица card: и новые, и оставшиеся от прерванного
+        выпуска или удаления.
+        """
+        used = set(self.__slots.values())
+        free = [slot for slot in range(start, self.balances.capacity)
+                if slot not in used]
+        for slot in free:
+            if self.balances.read(slot) != (0, 0):
+                self.balances.write(slot, 0, 0)
+        # Свободные записи берутся с конца списка, начиная с младших
+        self.__free.extend(reversed(free))
+
+    def __take_slot(self) -> int:
+        if not self.__free:
+            start = self.balances.capacity
+            self.balances.grow(start * 2)
+            self.__collect_free(start)
+        return self.__free.pop()
+
+    def __write_records(self, rows) -> list:
+        """
+        Записывает балансы (номер, баланс) в свободные записи файла
+        и возвращает их номера. Записи доходят до диска раньше, чем
+        на них сошлется таблица card: после сбоя запись без карты
+        снова станет свободной, а карта без записи невозможна.
+        """
+        slots = [self.__take_slot() for _ in rows]
+        for slot, (number, balance) in zip(slots, rows):
+            self.balances.write(slot, int(number), balance)
+        self.balances.flush()
+        return slots
+
+    def __release_records(self, slots: list) -> None:
+        for slot in slots:
+            self.balances.write(slot, 0, 0)
+        self.__free.extend(slots)
+
+    def __attach(self) -> int:
+        """Переносит в файл балансы карт без записи, возвращает их число."""
+        with self.__lock:
+            rows = execute(self.__cursor, 'card_unslotted').fetchall()
+            if not rows:
+                return 0
+            slots = self.__write_records(rows)
+            try:
+                with immediate_transaction(self.connect):
+                    executemany(self.__cursor, 'card_slot_set',
+                                [(slot, number) for slot, (number, _)
+                                 in zip(slots, rows)])
+            except BaseException:
+                self.__release_records(slots)
+                raise
+            for slot, (number, _) in zip(slots, rows):
+                self.__slots[number] = slot
+            return len(rows)
+
+    def detach(self) -> int:
+        """
+        Возвращает балансы из файла в таблицу card, записывая разницу
+        в ledger, и возвращает число карт. После detach хранилищем
+        пользоваться нельзя, а файл больше не нужен.
+        """
+        with self.__lock:
+            rows = execute(self.__cursor, 'card_slot_state').fetchall()
+            with immediate_transaction(self.connect):
+                for number, stored in rows:
+                    balance = self.balances.balance(self.__slots[number])
+                    execute(self.__cursor, 'card_slot_release',
+                            (balance, number))
+                    if balance != stored:
+                        execute(self.__cursor, 'ledger_append',
+                                (number, 'mapped', balance - stored,
+                                 balance, None))
+            self.__slots.clear()
+            return len(rows)
+
+    def accounts(self, count: int) -> list:
+        with self.__lock:
+            return CardNumberAllocator.for_connection(
+                self.connect).accounts(count)
+
+    def get(self, number: str):
+        with self.__lock:
+            slot = self.__slots.get(number)
+            if slot is None:
+                return None
+            row = execute(self.__cursor, 'card_by_number',
+                          (number,)).fetchone()
+            return row[1], self.balances.balance(slot)
+
+    def balance(self, number: str):
+        """Баланс карты или None, без обращения к базе."""
+        with self.__lock:
+            slot = self.__slots.get(number)
+            return None if slot is None else self.balances.balance(slot)
+
+    def get_many(self, numbers) -> dict:
+        result = {}
+        for number in numbers:
+            entry = self.get(number)
+            if entry is not None:
+                result[number] = entry
+        return result
+
+    def verify_pin(self, number: str, code: str):
+        entry = self.get(number)
+        return entry if entry is not None and entry[0] == code else None
+
+    def insert(self, number: str, code: str, balance: int) -> bool:
+        return bool(self.insert_many([(number, code, balance)]))
+
+    def insert_many(self, rows) -> list:
+        with self.__lock:
+            inserted = []
+            taken = set()
+            for number, code, balance in rows:
+                if number in self.__slots or number in taken:
+                    continue
+                taken.add(number)
+                inserted.append((number, code, balance))
+            if not inserted:
+                return inserted
+            slots = self.__write_records(
+                [(number, balance) for number, _, balance in inserted])
+            try:
+                with immediate_transaction(self.connect):
+                    executemany(self.__cursor, 'card_slot_insert',
+                                [(number, code, balance, slot)
+                                 for slot, (number, code, balance)
+                                 in zip(slots, inserted)])
+                    executemany(self.__cursor, 'ledger_append',
+                                [(number, 'open', balance, balance, None)
+                                 for number, _, balance in inserted])
+            except BaseException:
+                self.__release_records(slots)
+                raise
+            for slot, (number, _, _) in zip(slots, inserted):
+                self.__slots[number] = slot
+            return inserted
+
+    def __apply(self, number: str, money: int, check_funds: bool):
+        slot = self.__slots.get(number)
+        if slot is None:
+            return None
+        balance = self.balances.balance(slot) + money
+        if check_funds and balance < 0:
+            return None
+        self.balances.set_balance(slot, balance)
+        return balance
+
+    def apply_delta(self, number: str, money: int,
+                    check_funds: bool = False):
+        with self.__lock:
+            return self.__apply(number, money, check_funds)
+
+    def apply_many(self, changes) -> list:
+        with self.__lock:
+            return [self.__apply(number, money, check_funds)
+                    for number, money, check_funds in changes]
+
+    def transfer(self, source: str, target: str, money: int) -> tuple:
+        check_transfer_amount(money)
+        with self.__lock:
+            slot = self.__slots.get(source)
+            if slot is None or self.balances.balance(slot) < money:
+                raise TransactionError("Not enough money!")
+            if target not in self.__slots:
+                raise TransactionError("Such a card does not exist.")
+            return (self.__apply(source, -money, False),
+                    self.__apply(target, money, False))
+
+    def delete(self, number: str):
+        with self.__lock:
+            slot = self.__slots.get(number)
+            if slot is None:
+                return None
+            # Карта удаляется раньше записи файла, в порядке, обратном
+            # выпуску. close_card списывает в ledger баланс колонки,
+            # с которым журнал и сходится.
+            with immediate_transaction(self.connect):
+                close_card(self.__cursor, number)
+            balance = self.balances.balance(slot)
+            del self.__slots[number]
+            self.__release_records([slot])
+            return balance
+
+    def replace_pin(self, number: str, old: str, new: str) -> bool:
+        with self.__lock:
+            with immediate_transaction(self.connect):
+                return execute(self.__cursor, 'card_pin_update',
+                               (new, number, old)).rowcount == 1
+
+    def flush(self) -> None:
+        with self.__lock:
+            self.balances.flush()
+
+    def close(self) -> None:
+        """Записывает балансы на диск; соединение закрывает владелец."""
+        with self.__lock:
+            self.balances.close()
+            self.__cursor.close()
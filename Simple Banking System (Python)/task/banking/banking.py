@@ -1,41 +1,1038 @@
+import argparse
+import json
+import logging
 import sqlite3
+import sys
+import time
+from contextlib import contextmanager, nullcontext
 from random import randint
+from secrets import randbits
+from typing import Protocol
+
+from bloom import CardFilter
+from cache import DELETED, CardCache
+from pins import PinHasher, pin_matches
+
+logger = logging.getLogger(__name__)
+
+# UPDATE ... RETURNING поддерживается начиная с SQLite 3.35
+SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+_RETURNING_BALANCE = ' RETURNING balance' if SQLITE_RETURNING else ''
+# json_each встроена в SQLite начиная с 3.38
+SQLITE_JSON = sqlite3.sqlite_version_info >= (3, 38, 0)
+
+# Все запросы к картам. Каждый запрос - одна и та же строка, поэтому
+# кэш подготовленных выражений sqlite3 переиспользует его везде.
+QUERIES = {
+    'card_insert':
+        'INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)',
+    'card_insert_new':
+        'INSERT OR IGNORE INTO card (number, pin, balance) VALUES (?, ?, ?)',
+    'card_by_number':
+        'SELECT number, pin, balance FROM card WHERE number = ?',
+    'card_by_number_pin':
+        'SELECT number, pin, balance FROM card WHERE number = ? AND pin = ?',
+    'card_by_numbers':
+        'SELECT number, pin, balance FROM card '
+        'WHERE number IN (SELECT value FROM json_each(?))',
+    'card_balance':
+        'SELECT balance FROM card WHERE number = ?',
+    'card_scan':
+        'SELECT number, pin, balance FROM card ORDER BY number',
+    'card_range_scan':
+        'SELECT number, balance FROM card '
+        'WHERE number >= ? AND number < ? ORDER BY number',
+    'card_balance_add':
+        'UPDATE card SET balance = balance + ? WHERE number = ?'
+        + _RETURNING_BALANCE,
+    'card_balance_add_checked':
+        'UPDATE card SET balance = balance + ? '
+        'WHERE number = ? AND balance + ? >= 0' + _RETURNING_BALANCE,
+    'card_balance_set':
+        'UPDATE card SET balance = ? WHERE number = ?',
+    'card_delete':
+        'DELETE FROM card WHERE number = ?' + _RETURNING_BALANCE,
+    'card_pin_update':
+        'UPDATE card SET pin = ? WHERE number = ? AND pin = ?',
+    'ledger_append':
+        'INSERT INTO ledger (number, kind, amount, balance, counterparty) '
+        'VALUES (?, ?, ?, ?, ?)',
+    'ledger_append_ref':
+        'INSERT INTO ledger (number, kind, amount, balance, counterparty, '
+        'ref) VALUES (?, ?, ?, ?, ?, ?)',
+    'ledger_by_ref':
+        'SELECT amount FROM ledger WHERE ref = ? AND kind = ? AND number = ?',
+    'transfer_log_insert':
+        "INSERT INTO transfer_log (source, target, amount, state) "
+        "VALUES (?, ?, ?, 'prepared')",
+    'transfer_log_state':
+        'UPDATE transfer_log SET state = ? WHERE id = ?',
+    'transfer_log_pending':
+        'SELECT id, CAST(source AS TEXT), CAST(target AS TEXT), amount, '
+        "state FROM transfer_log WHERE state IN ('prepared', 'refunding') "
+        'ORDER BY id',
+    'ledger_first_page':
+        'SELECT id, kind, amount, balance, CAST(counterparty AS TEXT), '
+        'created FROM ledger WHERE number = ? ORDER BY id DESC LIMIT ?',
+    'ledger_page':
+        'SELECT id, kind, amount, balance, CAST(counterparty AS TEXT), '
+        'created FROM ledger WHERE number = ? AND id < ? '
+        'ORDER BY id DESC LIMIT ?',
+    'ledger_range_scan':
+        'SELECT number, amount FROM ledger '
+        'WHERE number >= ? AND number < ? ORDER BY number',
+    'sequence_reserve':
+        'UPDATE card_sequence SET next_value = next_value + ? WHERE id = 1',
+    'sequence_state':
+        'SELECT next_value, key FROM card_sequence WHERE id = 1',
+    'card_slot_insert':
+        'INSERT INTO card (number, pin, balance, slot) VALUES (?, ?, ?, ?)',
+    'card_slot_scan':
+        'SELECT number, slot FROM card WHERE slot IS NOT NULL',
+    'card_slot_state':
+        'SELECT number, balance FROM card WHERE slot IS NOT NULL',
+    'card_slot_count':
+        'SELECT count(*) FROM card WHERE slot IS NOT NULL',
+    'card_unslotted':
+        'SELECT number, balance FROM card WHERE slot IS NULL',
+    'card_slot_set':
+        'UPDATE card SET slot = ? WHERE number = ?',
+    'card_slot_release':
+        'UPDATE card SET balance = ?, slot = NULL WHERE number = ?',
+}
+
+# Раскладка integer: номер карты хранится 64-битным числом и служит
+# ключом таблицы вместо id. Строковые параметры SQLite сам приводит
+# к числу по типу колонки, а номер возвращается строкой, как в text.
+INTEGER_QUERIES = {
+    **QUERIES,
+    'card_by_number':
+        'SELECT CAST(number AS TEXT), pin, balance FROM card '
+        'WHERE number = ?',
+    'card_by_number_pin':
+        'SELECT CAST(number AS TEXT), pin, balance FROM card '
+        'WHERE number = ? AND pin = ?',
+    'card_by_numbers':
+        'SELECT CAST(number AS TEXT), pin, balance FROM card '
+        'WHERE number IN (SELECT value FROM json_each(?))',
+    'card_scan':
+        'SELECT CAST(number AS TEXT), pin, balance FROM card ORDER BY number',
+    'card_slot_scan':
+        'SELECT CAST(number AS TEXT), slot FROM card WHERE slot IS NOT NULL',
+    'card_slot_state':
+        'SELECT CAST(number AS TEXT), balance FROM card '
+        'WHERE slot IS NOT NULL',
+    'card_unslotted':
+        'SELECT CAST(number AS TEXT), balance FROM card WHERE slot IS NULL',
+}
+
+QUERY_LAYOUTS = {'text': QUERIES, 'integer': INTEGER_QUERIES}
+
+# Размер кэша подготовленных выражений на соединение: с запасом
+# вмещает весь реестр, служебные запросы и PRAGMA
+STATEMENT_CACHE_SIZE = 256
+
+
+class StatementStats:
+    """
+    Счетчики выполнений запросов из реестра на одном соединении.
+    Сколько раз sqlite3 подготовил запрос, модуль не сообщает: пользу
+    кэша выражений показывает benchmark.py statements, сравнивая
+    скорость с кэшем и без него.
+    """
+
+    def __init__(self) -> None:
+        self.executions = dict.fromkeys(QUERIES, 0)
+
+    def record(self, query: str, count: int = 1) -> None:
+        self.executions[query] += count
+
+    def summary(self) -> dict:
+        return {'executions': sum(self.executions.values()),
+                'distinct_queries': sum(1 for count in
+                                        self.executions.values() if count)}
+
+
+def execute(cursor, query: str, parameters=()):
+    """
+    Выполняет запрос из реестра раскладки базы, для обычного
+    sqlite3.Connection - из QUERIES.
+    """
+    connect = cursor.connection
+    stats = getattr(connect, 'statement_stats', None)
+    if stats is not None:
+        stats.record(query)
+    return cursor.execute(getattr(connect, 'queries', QUERIES)[query],
+                          parameters)
+
+
+def executemany(cursor, query: str, rows: list):
+    """Выполняет запрос из реестра раскладки базы для каждой строки."""
+    connect = cursor.connection
+    stats = getattr(connect, 'statement_stats', None)
+    if stats is not None:
+        stats.record(query, len(rows))
+    return cursor.executemany(getattr(connect, 'queries', QUERIES)[query],
+                              rows)
 
 
 class TransactionError(Exception):
     pass
 
 
+def check_transfer_amount(money: int) -> None:
+    """
+    Перевод проверяет средства только у отправителя, поэтому сумма
+    не больше нуля увела бы в минус получателя.
+    """
+    if money <= 0:
+        raise TransactionError("Transfer amount must be positive.")
+
+
+class SchemaError(Exception):
+    pass
+
+
+@contextmanager
+def immediate_transaction(connect):
+    """
+    Открывает транзакцию с блокировкой записи и фиксирует ее на выходе.
+    Внутри уже открытой транзакции работает как точка сохранения:
+    при ошибке откатываются только ее изменения, а фиксирует их
+    внешняя транзакция.
+    """
+    if connect.in_transaction:
+        connect.execute('SAVEPOINT nested')
+        try:
+            yield
+        except BaseException:
+            connect.execute('ROLLBACK TO nested')
+            connect.execute('RELEASE nested')
+            raise
+        connect.execute('RELEASE nested')
+        return
+
+    connect.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connect.rollback()
+        raise
+    connect.commit()
+
+
+@contextmanager
+def checkout(connect, cursor, write: bool = False):
+    """
+    Выдает пару соединение-курсор для операции. Если вместо соединения
+    передан пул, соединение берется из пула на время блока.
+    """
+    if not hasattr(connect, 'writer'):
+        yield connect, cursor if cursor is not None else connect.cursor()
+        return
+
+    with connect.writer() if write else connect.reader() as pooled:
+        cursor = pooled.cursor()
+        try:
+            yield pooled, cursor
+        finally:
+            cursor.close()
+
+
+def _create_card_table(cursor) -> None:
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS card (
+        id INTEGER PRIMARY KEY,
+        number TEXT,
+        pin TEXT,
+        balance INTEGER DEFAULT 0
+        );
+        """)
+
+
+def _create_card_number_index(cursor) -> None:
+    try:
+        cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS card_number_idx
+        ON card (number)
+        """)
+    except sqlite3.IntegrityError as e:
+        raise SchemaError("Table card contains duplicate card numbers, "
+                          "remove them before upgrading the database.") from e
+
+
+def _create_card_sequence(cursor) -> None:
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS card_sequence (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    next_value INTEGER NOT NULL,
+    key INTEGER NOT NULL
+    );
+    """)
+    cursor.execute("""
+    INSERT OR IGNORE INTO card_sequence (id, next_value, key)
+    VALUES (1, 0, ?)
+    """, (randbits(62),))
+
+
+def _create_ledger(cursor) -> None:
+    # Номер карты хранится числом в обеих раскладках card. Журнал
+    # только дополняется: изменять и удалять записи запрещают триггеры.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    number INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    balance INTEGER NOT NULL,
+    counterparty INTEGER,
+    created INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS ledger_number_idx ON ledger (number, id)
+    """)
+    for action in ('UPDATE', 'DELETE'):
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS ledger_no_{action.lower()}
+        BEFORE {action} ON ledger
+        BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+        """)
+    # Открывающие записи для уже выпущенных карт, чтобы сумма
+    # изменений по каждой карте совпадала с ее балансом
+    cursor.execute("""
+    INSERT INTO ledger (number, kind, amount, balance)
+    SELECT number, 'open', balance, balance FROM card ORDER BY number
+    """)
+
+
+def _create_transfer_log(cursor) -> None:
+    # ref связывает записи журнала с переводом между файлами базы:
+    # по нему восстановление узнает, какие шаги перевода выполнены
+    cursor.execute('ALTER TABLE ledger ADD COLUMN ref INTEGER')
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS ledger_ref_idx
+    ON ledger (ref, kind, number) WHERE ref IS NOT NULL
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS transfer_log (
+    id INTEGER PRIMARY KEY,
+    source INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    created INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+    );
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS transfer_log_prepared_idx
+    ON transfer_log (id) WHERE state = 'prepared'
+    """)
+
+
+def _create_card_slot(cursor) -> None:
+    # Карты с балансами в отображенном в память файле: таблица хранит
+    # только PIN и номер записи баланса в файле. Следующая миграция
+    # переносит их в card и удаляет таблицу.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS card_slot (
+    number TEXT PRIMARY KEY,
+    pin TEXT NOT NULL,
+    slot INTEGER NOT NULL UNIQUE
+    ) WITHOUT ROWID;
+    """)
+
+
+def _move_card_slots(cursor) -> None:
+    # Номер записи баланса в файле MappedStorage хранится в самой
+    # таблице card, чтобы обе раскладки балансов видели одни карты.
+    # Колонку могла уже добавить convert_layout.
+    columns = [column[1]
+               for column in cursor.execute('PRAGMA table_info(card)')]
+    if 'slot' not in columns:
+        cursor.execute('ALTER TABLE card ADD COLUMN slot INTEGER')
+    _create_card_slot_index(cursor)
+    # Баланс этих карт уже в файле, а записей ledger у них нет
+    cursor.execute("""
+    INSERT OR IGNORE INTO card (number, pin, balance, slot)
+    SELECT number, pin, 0, slot FROM card_slot
+    """)
+    cursor.execute('DROP TABLE card_slot')
+
+
+def _index_unfinished_transfers(cursor) -> None:
+    # Незавершенный перевод бывает и в состоянии refunding: деньги
+    # возвращаются отправителю. Условие индекса совпадает с условием
+    # запроса transfer_log_pending, иначе SQLite его не использует.
+    cursor.execute('DROP INDEX IF EXISTS transfer_log_prepared_idx')
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS transfer_log_pending_idx
+    ON transfer_log (id) WHERE state IN ('prepared', 'refunding')
+    """)
+
+
+def _create_card_slot_index(cursor) -> None:
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS card_slot_idx
+    ON card (slot) WHERE slot IS NOT NULL
+    """)
+
+
+# Миграции схемы по порядку: номер версии базы равен количеству
+# примененных миграций и хранится в PRAGMA user_version.
+MIGRATIONS = (
+    _create_card_table,
+    _create_card_number_index,
+    _create_card_sequence,
+    _create_ledger,
+    _create_transfer_log,
+    _create_card_slot,
+    _move_card_slots,
+    _index_unfinished_transfers,
+)
+
+
+def migrate(connect) -> int:
+    """Обновляет схему базы до последней версии, возвращает номер версии."""
+    cursor = connect.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    if version > len(MIGRATIONS):
+        raise SchemaError(f"Database schema version {version} is newer "
+                          f"than supported {len(MIGRATIONS)}.")
+
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        # Каждая миграция применяется в своей транзакции вместе
+        # с номером версии, чтобы сбой не оставил схему наполовину.
+        with immediate_transaction(connect):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+
+    cursor.close()
+    return len(MIGRATIONS)
+
+
+def storage_layout(connect):
+    """Раскладка таблицы card: 'text', 'integer' или None, если таблицы нет."""
+    for column in connect.execute('PRAGMA table_info(card)'):
+        if column[1] == 'number':
+            return 'integer' if column[2].upper() == 'INTEGER' else 'text'
+    return None
+
+
+def convert_layout(connect, layout: str) -> int:
+    """
+    Перестраивает таблицу card в раскладку layout и возвращает число
+    перенесенных карт. Базу не должны использовать другие соединения:
+    они продолжат работать с запросами старой раскладки.
+    """
+    if layout not in QUERY_LAYOUTS:
+        raise ValueError(f"unknown storage layout: {layout!r}")
+    current = storage_layout(connect)
+    if current is None:
+        raise SchemaError("Table card does not exist, migrate the database "
+                          "before converting it.")
+    if current == layout:
+        return 0
+
+    cursor = connect.cursor()
+    # Колонку slot добавляет миграция, в старой базе ее может не быть
+    slot = ('slot' if any(column[1] == 'slot' for column in
+                          cursor.execute('PRAGMA table_info(card)'))
+            else 'NULL')
+    with immediate_transaction(connect):
+        if layout == 'integer':
+            # Номер без ведущего нуля и не длиннее 18 цифр переводится
+            # в 64-битное число и обратно без потерь
+            invalid = cursor.execute("""
+            SELECT count(*) FROM card
+            WHERE number IS NULL OR number = '' OR number GLOB '0*'
+            OR number GLOB '*[^0-9]*' OR length(number) > 18
+            """).fetchone()[0]
+            if invalid:
+                raise SchemaError(f"Table card contains {invalid} numbers "
+                                  f"that are not valid integers.")
+            cursor.execute("""
+            CREATE TABLE card_new (
+            number INTEGER PRIMARY KEY,
+            pin TEXT,
+            balance INTEGER DEFAULT 0,
+            slot INTEGER
+            )
+            """)
+            cursor.execute(f"""
+            INSERT INTO card_new (number, pin, balance, slot)
+            SELECT CAST(number AS INTEGER), pin, balance, {slot} FROM card
+            ORDER BY CAST(number AS INTEGER)
+            """)
+        else:
+            cursor.execute("""
+            CREATE TABLE card_new (
+            id INTEGER PRIMARY KEY,
+            number TEXT,
+            pin TEXT,
+            balance INTEGER DEFAULT 0,
+            slot INTEGER
+            )
+            """)
+            cursor.execute(f"""
+            INSERT INTO card_new (number, pin, balance, slot)
+            SELECT CAST(number AS TEXT), pin, balance, {slot} FROM card
+            ORDER BY number
+            """)
+        count = cursor.rowcount
+        cursor.execute('DROP TABLE card')
+        cursor.execute('ALTER TABLE card_new RENAME TO card')
+        if layout == 'text':
+            _create_card_number_index(cursor)
+        _create_card_slot_index(cursor)
+    cursor.close()
+
+    # Освобождает страницы старой таблицы
+    connect.execute('VACUUM')
+    if isinstance(connect, BankConnection):
+        connect.reset_layout()
+    return count
+
+
+# Цифры после удвоения по алгоритму Луна
+LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def _luhn_block_sums(double_last: bool) -> tuple:
+    """
+    Суммы Луна для всех блоков из четырех цифр. Блоки четной длины,
+    поэтому удваиваются одни и те же позиции в каждом блоке числа.
+    """
+    sums = []
+    for block in range(10000):
+        total = 0
+        for position in range(4):
+            block, digit = divmod(block, 10)
+            if (position % 2 == 0) == double_last:
+                digit = LUHN_DOUBLED[digit]
+            total += digit
+        sums.append(total)
+    return tuple(sums)
+
+
+# Для номера счета без контрольной цифры удваивается последняя цифра,
+# для полного номера карты - предпоследняя.
+LUHN_ACCOUNT_SUMS = _luhn_block_sums(double_last=True)
+LUHN_CARD_SUMS = _luhn_block_sums(double_last=False)
+
+
+def change_balance(cursor, number: str, money: int,
+                   check_funds: bool = False, kind: str = 'income',
+                   counterparty: str = None, ref: int = None):
+    """
+    Изменяет баланс карты в текущей транзакции и записывает изменение
+    в журнал ledger, ref - номер перевода между файлами базы.
+    Возвращает новый баланс, или None, если карты нет или на ней
+    не хватает денег.
+    """
+    if check_funds:
+        execute(cursor, 'card_balance_add_checked', (money, number, money))
+    else:
+        execute(cursor, 'card_balance_add', (money, number))
+
+    if SQLITE_RETURNING:
+        result = cursor.fetchall()
+    elif cursor.rowcount:
+        result = execute(cursor, 'card_balance', (number,)).fetchall()
+    else:
+        result = None
+    if not result:
+        return None
+    balance = result[0][0]
+    if ref is None:
+        execute(cursor, 'ledger_append',
+                (number, kind, money, balance, counterparty))
+    else:
+        execute(cursor, 'ledger_append_ref',
+                (number, kind, money, balance, counterparty, ref))
+    return balance
+
+
+def close_card(cursor, number: str):
+    """
+    Удаляет карту в текущей транзакции и записывает в журнал списание
+    остатка. Возвращает остаток или None, если карты нет.
+    """
+    if SQLITE_RETURNING:
+        result = execute(cursor, 'card_delete', (number,)).fetchall()
+    else:
+        result = execute(cursor, 'card_balance', (number,)).fetchall()
+        execute(cursor, 'card_delete', (number,))
+    if not result:
+        return None
+    balance = result[0][0]
+    execute(cursor, 'ledger_append', (number, 'close', -balance, 0, None))
+    return balance
+
+
+class AccountPermutation:
+    """
+    Перестановка номеров счетов (сеть Фейстеля): переводит значение
+    счетчика в номер счета, разным значениям соответствуют разные номера.
+    """
+
+    # Номера счетов 1..999999999 кодируются значениями 0..999999998
+    SIZE = 999999999
+    # Половина сети, HALF ** 2 покрывает SIZE
+    HALF = 31623
+    ROUNDS = 4
+    MASK = (1 << 64) - 1
+
+    def __init__(self, key: int) -> None:
+        self.keys = tuple((key * (i + 1) + i) & self.MASK
+                          for i in range(self.ROUNDS))
+
+    def __round(self, value: int, key: int) -> int:
+        value = (value + key) * 0x9E3779B97F4A7C15 & self.MASK
+        return (value ^ value >> 29) % self.HALF
+
+    def __permute(self, value: int) -> int:
+        left, right = divmod(value, self.HALF)
+        for key in self.keys:
+            left, right = right, (left + self.__round(right, key)) % self.HALF
+        return left * self.HALF + right
+
+    def account(self, counter: int) -> int:
+        """Возвращает номер счета для значения счетчика."""
+        if not 0 <= counter < self.SIZE:
+            raise TransactionError("No free card numbers left.")
+        # Перестановка определена на HALF ** 2 значениях, лишние
+        # пропускаются повторным применением (cycle walking).
+        value = self.__permute(counter)
+        while value >= self.SIZE:
+            value = self.__permute(value)
+        return value + 1
+
+
+class CardNumberAllocator:
+    """
+    Выдает уникальные номера счетов без проверки каждого в базе:
+    резервирует в таблице card_sequence блок значений счетчика и
+    переставляет их с помощью AccountPermutation. account_range
+    (начало, конец) оставляет только номера из этого диапазона,
+    остальные значения счетчика пропускаются.
+    """
+
+    def __init__(self, connect, block_size: int = 1000,
+                 account_range: tuple = None) -> None:
+        self.connect = connect
+        self.block_size = block_size
+        self.account_range = account_range
+        # Сколько значений счетчика в среднем уходит на один номер
+        self.spread = 1
+        if account_range is not None:
+            low, high = account_range
+            self.spread = -(-AccountPermutation.SIZE // (high - low))
+        self.permutation = None
+        self.next_value = 0
+        self.end_value = 0
+
+    @classmethod
+    def for_connection(cls, connect) -> 'CardNumberAllocator':
+        """Возвращает распределитель, привязанный к соединению."""
+        allocator = getattr(connect, 'number_allocator', None)
+        if allocator is None:
+            # К обычному sqlite3.Connection нечего привязать, поэтому
+            # резервируется ровно столько номеров, сколько запрошено.
+            allocator = cls(connect, block_size=1)
+        return allocator
+
+    def __reserve(self, count: int) -> None:
+        cursor = self.connect.cursor()
+        # Резерв фиксируется отдельной транзакцией: если откатится
+        # вставка карт, номера блока все равно не выдадутся повторно.
+        # Внутри внешней транзакции резерв фиксируется вместе с ней,
+        # а при ее откате повторный номер отсечет уникальный индекс.
+        with immediate_transaction(self.connect):
+            execute(cursor, 'sequence_reserve', (count,))
+            end_value, key = execute(cursor, 'sequence_state').fetchone()
+        cursor.close()
+
+        self.next_value, self.end_value = end_value - count, end_value
+        if self.permutation is None:
+            self.permutation = AccountPermutation(key)
+
+    def accounts(self, count: int) -> list:
+        """Возвращает count новых номеров счетов."""
+        result = []
+        while len(result) < count:
+            if self.next_value == self.end_value:
+                self.__reserve(max((count - len(result)) * self.spread,
+                                   self.block_size))
+            if self.account_range is None:
+                take = min(count - len(result),
+                           self.end_value - self.next_value)
+                result.extend(map(self.permutation.account,
+                                  range(self.next_value,
+                                        self.next_value + take)))
+                self.next_value += take
+                continue
+
+            low, high = self.account_range
+            while self.next_value < self.end_value and len(result) < count:
+                account = self.permutation.account(self.next_value)
+                self.next_value += 1
+                if low <= account < high:
+                    result.append(account)
+        return result
+
+
+class BankConnection(sqlite3.Connection):
+    """
+    Соединение с базой карт, хранящее распределитель номеров,
+    счетчики запросов, кэш и фильтр карт и хешер PIN, если они
+    подключены.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.number_allocator = CardNumberAllocator(self)
+        self.statement_stats = StatementStats()
+        self.card_cache = None
+        self.card_filter = None
+        self.pin_hasher = None
+        self.__queries = None
+
+    @property
+    def queries(self) -> dict:
+        """Реестр запросов для раскладки таблицы card в этой базе."""
+        if self.__queries is None:
+            layout = storage_layout(self)
+            if layout is None:
+                # Таблицу еще создаст миграция, в раскладке text
+                return QUERIES
+            self.__queries = QUERY_LAYOUTS[layout]
+        return self.__queries
+
+    def reset_layout(self) -> None:
+        """Забывает раскладку, она определится заново при следующем запросе."""
+        self.__queries = None
+
+
+# Наборы PRAGMA для соединения: safe - надежность по умолчанию,
+# wal - параллельное чтение при записи, bench - скорость без fsync.
+# Режим журнала хранится в самом файле базы, поэтому safe его не
+# трогает: иначе он вернул бы файл WAL в DELETE или, пока файл открыт
+# сервером, упал бы с database is locked.
+CONNECTION_PROFILES = {
+    'safe': {
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+    },
+    'wal': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    'bench': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,
+        'mmap_size': 1073741824,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
+
+def connect_db(path: str = 'card.s3db', profile: str = 'safe',
+               **kwargs) -> BankConnection:
+    """Открывает базу карт с настройками выбранного профиля."""
+    if profile not in CONNECTION_PROFILES:
+        raise ValueError(f"unknown connection profile: {profile!r}")
+    kwargs.setdefault('cached_statements', STATEMENT_CACHE_SIZE)
+    connect = sqlite3.connect(path, factory=BankConnection, **kwargs)
+    for pragma, value in CONNECTION_PROFILES[profile].items():
+        connect.execute(f'PRAGMA {pragma} = {value}')
+    return connect
+
+
+class CardStorage(Protocol):
+    """
+    Хранилище карт, с которым работает Card. Номер и PIN - строки,
+    PIN хранится в том виде, в каком его передал Card. Методы изменения
+    возвращают новый баланс или None, если карты нет или на ней
+    не хватает денег; пакетные методы выполняют все изменения
+    одной транзакцией.
+    """
+
+    # Изменения еще не зафиксированы: идет внешняя транзакция
+    in_transaction: bool
+
+    def accounts(self, count: int) -> list:
+        """Резервирует count новых номеров счетов."""
+
+    def get(self, number: str):
+        """Возвращает (PIN, баланс) или None."""
+
+    def get_many(self, numbers) -> dict:
+        """Возвращает {номер: (PIN, баланс)} для найденных карт."""
+
+    def verify_pin(self, number: str, code: str):
+        """Возвращает (PIN, баланс), если PIN карты равен code."""
+
+    def insert(self, number: str, code: str, balance: int) -> bool:
+        """Добавляет карту, False - номер уже занят."""
+
+    def insert_many(self, rows) -> list:
+        """Добавляет карты (номер, PIN, баланс), возвращает добавленные."""
+
+    def apply_delta(self, number: str, money: int,
+                    check_funds: bool = False):
+        """Изменяет баланс карты на money."""
+
+    def apply_many(self, changes) -> list:
+        """Изменения (номер, сумма, check_funds), балансы по порядку."""
+
+    def transfer(self, source: str, target: str, money: int) -> tuple:
+        """
+        Переводит money > 0, возвращает балансы обеих карт или бросает
+        TransactionError, ничего не изменив.
+        """
+
+    def delete(self, number: str):
+        """Удаляет карту, возвращает ее остаток или None."""
+
+    def replace_pin(self, number: str, old: str, new: str) -> bool:
+        """Заменяет PIN, если он все еще равен old."""
+
+
+class SQLiteStorage:
+    """
+    Хранилище карт в базе SQLite: в соединении с курсором или в пуле
+    соединений. Изменения балансов записываются в журнал ledger.
+    """
+
+    __slots__ = ('connect', 'cursor')
+
+    def __init__(self, connect, cursor=None) -> None:
+        self.connect = connect
+        self.cursor = cursor
+
+    @property
+    def in_transaction(self) -> bool:
+        # Пул выдает соединение только на одну операцию
+        return (not hasattr(self.connect, 'writer')
+                and self.connect.in_transaction)
+
+    @contextmanager
+    def __write(self):
+        """Курсор соединения для записи внутри транзакции."""
+        with checkout(self.connect, self.cursor, write=True) as (connect,
+                                                                  cursor):
+            with immediate_transaction(connect):
+                yield cursor
+
+    def __read(self, query: str, parameters: tuple):
+        with checkout(self.connect, self.cursor) as (_, cursor):
+            return execute(cursor, query, parameters).fetchone()
+
+    def accounts(self, count: int) -> list:
+        with checkout(self.connect, self.cursor, write=True) as (connect, _):
+            return CardNumberAllocator.for_connection(connect).accounts(count)
+
+    @staticmethod
+    def __entry(row, number: str):
+        """
+        (PIN, баланс) из строки карты, если номер в строке совпадает
+        с запрошенным. В раскладке integer SQLite приводит к числу и
+        '0' + номер, и номер с пробелом или '.0', такая запись номера
+        карту не находит.
+        """
+        return row[1:] if row and row[0] == number else None
+
+    def get(self, number: str):
+        return self.__entry(self.__read('card_by_number', (number,)), number)
+
+    def get_many(self, numbers) -> dict:
+        if SQLITE_JSON:
+            # Один запрос на все номера; номер, записанный иначе, чем
+            # в строке карты, как и в get, карту не находит
+            numbers = set(numbers)
+            with checkout(self.connect, self.cursor) as (_, cursor):
+                return {row[0]: row[1:] for row in execute(
+                    cursor, 'card_by_numbers', (json.dumps(list(numbers)),))
+                    if row[0] in numbers}
+        result = {}
+        with checkout(self.connect, self.cursor) as (_, cursor):
+            for number in numbers:
+                entry = self.__entry(execute(cursor, 'card_by_number',
+                                             (number,)).fetchone(), number)
+                if entry:
+                    result[number] = entry
+        return result
+
+    def verify_pin(self, number: str, code: str):
+        return self.__entry(self.__read('card_by_number_pin', (number, code)),
+                            number)
+
+    @staticmethod
+    def __insert_new(cursor, row) -> bool:
+        """Вставляет карту, если ее номера еще нет в базе."""
+        inserted = execute(cursor, 'card_insert_new', row).rowcount == 1
+        if inserted:
+            number, _, balance = row
+            execute(cursor, 'ledger_append',
+                    (number, 'open', balance, balance, None))
+        return inserted
+
+    def insert(self, number: str, code: str, balance: int) -> bool:
+        with self.__write() as cursor:
+            return self.__insert_new(cursor, (number, code, balance))
+
+    def insert_many(self, rows) -> list:
+        rows = list(rows)
+        try:
+            with self.__write() as cursor:
+                executemany(cursor, 'card_insert', rows)
+                executemany(cursor, 'ledger_append',
+                            [(number, 'open', balance, balance, None)
+                             for number, _, balance in rows])
+        except sqlite3.IntegrityError:
+            # Номер совпал с картой, выпущенной до появления
+            # распределителя: карты вставляются построчно,
+            # совпавшие номера пропускаются.
+            with self.__write() as cursor:
+                rows = [row for row in rows
+                        if self.__insert_new(cursor, row)]
+        return rows
+
+    def apply_delta(self, number: str, money: int,
+                    check_funds: bool = False):
+        with self.__write() as cursor:
+            return change_balance(cursor, number, money, check_funds)
+
+    def apply_many(self, changes) -> list:
+        with self.__write() as cursor:
+            return [change_balance(cursor, number, money, check_funds)
+                    for number, money, check_funds in changes]
+
+    def transfer(self, source: str, target: str, money: int) -> tuple:
+        check_transfer_amount(money)
+        with self.__write() as cursor:
+            # Списание проходит только при достаточном балансе,
+            # поэтому параллельный перевод не уведет счет в минус.
+            balance = change_balance(cursor, source, -money,
+                                     check_funds=True, kind='transfer',
+                                     counterparty=target)
+            if balance is None:
+                raise TransactionError("Not enough money!")
+
+            other_balance = change_balance(cursor, target, money,
+                                           kind='transfer',
+                                           counterparty=source)
+            if other_balance is None:
+                raise TransactionError("Such a card does not exist.")
+        return balance, other_balance
+
+    def delete(self, number: str):
+        with self.__write() as cursor:
+            return close_card(cursor, number)
+
+    def replace_pin(self, number: str, old: str, new: str) -> bool:
+        with self.__write() as cursor:
+            return execute(cursor, 'card_pin_update',
+                           (new, number, old)).rowcount == 1
+
+
+def storage_for(connect, cursor=None) -> CardStorage:
+    """Хранилище карт: connect, если это уже хранилище, иначе база SQLite."""
+    if hasattr(connect, 'apply_delta'):
+        return connect
+    return SQLiteStorage(connect, cursor)
+
+
 class Card:
-    """Класс с пользователями."""
+    """
+    Класс с пользователями. code - PIN в том виде, в каком он хранится
+    в базе; только у новой карты это сам PIN, а его хеш, если
+    подключен хешер, лежит в stored_code.
+    """
 
     def __init__(self, connect, cursor, card=None, code=None, balance=0) -> None:
         self.connect = connect
         self.cursor = cursor
         if card is None or code is None:
-            self.number = self.__create_card()
             self.code = self.__create_code()
             self.balance = balance
             self.__save_to_db()
         else:
             self.number = card
             self.code = code
+            self.stored_code = code
             self.balance = balance
 
+    @property
+    def storage(self) -> CardStorage:
+        # Хранилище не хранится в карте, чтобы не увеличивать ее размер
+        return storage_for(self.connect, self.cursor)
+
+    def __cache_writing(self, *numbers: str):
+        """
+        Блокировка изменений карт в кэше на время записи в базу и в кэш,
+        если кэш подключен.
+        """
+        cache = getattr(self.connect, 'card_cache', None)
+        return nullcontext() if cache is None else cache.writing(*numbers)
+
+    def __cache_write(self, number: str, code, balance) -> None:
+        """Передает изменение карты в кэш карт, если он подключен."""
+        cache = getattr(self.connect, 'card_cache', None)
+        if cache is None:
+            return
+        if self.storage.in_transaction:
+            # Изменение зафиксирует внешняя транзакция, и она же
+            # может его откатить, поэтому карта просто забывается
+            cache.invalidate(number)
+        elif balance is None:
+            cache.delete(number)
+        else:
+            cache.write(number, code or None, balance)
+
+    @staticmethod
+    def __filter_update(owner, storage, numbers, added: bool) -> None:
+        """Передает выпуск или удаление карт в фильтр карт owner."""
+        card_filter = getattr(owner, 'card_filter', None)
+        if card_filter is None:
+            return
+        if added:
+            for number in numbers:
+                card_filter.add(number)
+        elif not storage.in_transaction:
+            # Удаление внутри внешней транзакции может откатиться,
+            # лишняя карта в фильтре безопаснее пропущенной
+            for number in numbers:
+                card_filter.remove(number)
+
     def __save_to_db(self):
-        self.cursor.execute("""
-        INSERT INTO card (number, pin, balance)
-        VALUES (?, ?, ?)
-         """, (self.number, self.code, self.balance))
-        self.connect.commit()
+        hasher = getattr(self.connect, 'pin_hasher', None)
+        self.stored_code = (self.code if hasher is None
+                            else hasher.hash(self.code))
+        inserted = False
+        while not inserted:
+            # Номер может совпасть только с картой, выпущенной
+            # до появления распределителя, тогда берется следующий.
+            self.number = self.__create_card(self.storage.accounts(1)[0])
+            inserted = self.storage.insert(self.number, self.stored_code,
+                                           self.balance)
+        self.__cache_write(self.number, self.stored_code, self.balance)
+        self.__filter_update(self.connect, self.storage, (self.number,), True)
 
     @staticmethod
-    def __create_card() -> str:
+    def __create_card(account: int) -> str:
         """Генерирует карту, соответствующую алгоритму Луна."""
         inn = '400000'
         # Сокращаем на одну цифру для добавления контрольной суммы
         # Вычисляем контрольную цифру
-        account_number = f'{inn}{randint(1, 999999999):09d}'
+        account_number = f'{inn}{account:09d}'
         checksum = Card.calculate_luhn_checksum(account_number)
         # Возвращаем полный номер карты с контрольной цифрой
         return f'{account_number}{checksum}'
@@ -43,17 +1040,17 @@ class Card:
     @staticmethod
     def calculate_luhn_checksum(account_number: str) -> int:
         """Вычисляет контрольную цифру для номера счета по алгоритму Луна."""
-        digits = [int(digit) for digit in account_number]
-        # Применяем шаги алгоритма Луна к каждому второму числу, начиная с предпоследнего
-        for i in range(len(digits) - 1, -1, -2):
-            digits[i] = digits[i] * 2
-            if digits[i] > 9:
-                digits[i] -= 9
-        # Суммируем все цифры
-        total_sum = sum(digits)
+        if not account_number.isdecimal() and account_number:
+            raise ValueError(f"invalid account number: {account_number!r}")
+        # Номер разбирается блоками по четыре цифры, сумма каждого
+        # блока с удвоенными цифрами берется из готовой таблицы
+        value = int(account_number or 0)
+        total_sum = 0
+        while value:
+            value, block = divmod(value, 10000)
+            total_sum += LUHN_ACCOUNT_SUMS[block]
         # Вычисляем контрольную цифру так, чтобы сумма была кратна 10
-        checksum = (10 - total_sum % 10) % 10
-        return checksum
+        return -total_sum % 10
 
     @staticmethod
     def is_valid_card_number(number: str) -> bool:
@@ -62,61 +1059,217 @@ class Card:
         checksum = Card.calculate_luhn_checksum(card_number_without_checksum)
         return str(checksum) == number[-1]
 
+    @staticmethod
+    def luhn_checksums(account_numbers) -> list:
+        """
+        Вычисляет контрольные цифры для набора номеров счетов,
+        складывая готовые суммы блоков по четыре цифры.
+        """
+        sums = LUHN_ACCOUNT_SUMS
+        checksums = []
+        for account_number in account_numbers:
+            if not account_number.isdecimal() and account_number:
+                raise ValueError(
+                    f"invalid account number: {account_number!r}")
+            value = int(account_number or 0)
+            total = 0
+            while value:
+                value, block = divmod(value, 10000)
+                total += sums[block]
+            checksums.append(-total % 10)
+        return checksums
+
+    @staticmethod
+    def validate_many(numbers) -> list:
+        """
+        Проверяет набор номеров карт по алгоритму Луна. Номера
+        не из одних цифр считаются невалидными.
+        """
+        sums = LUHN_CARD_SUMS
+        result = []
+        for number in numbers:
+            if not number.isdecimal():
+                result.append(False)
+                continue
+            value = int(number)
+            total = 0
+            while value:
+                value, block = divmod(value, 10000)
+                total += sums[block]
+            result.append(total % 10 == 0)
+        return result
+
     @staticmethod
     def __create_code() -> str:
         """Генерирует код."""
         return f"{randint(1, 9999):04d}"
 
+    @classmethod
+    def issue_many(cls, connect, cursor, count: int,
+                   chunk_size: int = 10000) -> list:
+        """
+        Выпускает count карт пачками по chunk_size в одной
+        транзакции на пачку, возвращает список пар (номер, PIN).
+        """
+        storage = storage_for(connect, cursor)
+        hasher = getattr(connect, 'pin_hasher', None)
+        issued = []
+        while len(issued) < count:
+            size = min(chunk_size, count - len(issued))
+            codes = [cls.__create_code() for _ in range(size)]
+            stored_codes = (codes if hasher is None
+                            else hasher.hash_many(codes))
+            chunk = storage.insert_many(
+                (cls.__create_card(account), stored_code, 0)
+                for account, stored_code
+                in zip(storage.accounts(size), stored_codes))
+            cls.__filter_update(connect, storage,
+                                [row[0] for row in chunk], True)
+            codes = dict(zip(stored_codes, codes))
+            issued.extend((number, codes[stored_code])
+                          for number, stored_code, _ in chunk)
+        return issued
+
     @classmethod
     def check_card(cls, connect, cursor, number: str, code=None):
         """Проверяет наличие пользователя в базе."""
+        hasher = getattr(connect, 'pin_hasher', None)
+        if hasher is not None and code:
+            # Хеш сверяется в Python, поэтому карта ищется по номеру
+            card = cls.check_card(connect, cursor, number)
+            if card is None or not card.verify_pin(code):
+                return None
+            return card
+
+        card_filter = getattr(connect, 'card_filter', None)
+        if card_filter is not None:
+            if not card_filter.might_contain(number):
+                return None
+            card = cls.__check_loaded(connect, cursor, number, code)
+            # Неверный PIN существующей карты - не ошибка фильтра
+            if card is None and (not code or storage_for(
+                    connect, cursor).get(number) is None):
+                card_filter.false_positive()
+            return card
+        return cls.__check_loaded(connect, cursor, number, code)
 
+    def verify_pin(self, code: str) -> bool:
+        """
+        Сверяет PIN с хешем подключенного хешера. PIN без хеша
+        или с устаревшей стоимостью после входа хешируется заново.
+        """
+        hasher = getattr(self.connect, 'pin_hasher', None)
+        if hasher is None:
+            return pin_matches(code, self.stored_code)
+        if not hasher.verify(code, self.stored_code):
+            return False
+        if hasher.needs_rehash(self.stored_code):
+            self.store_pin(hasher.hash(code))
+        return True
+
+    def store_pin(self, stored_code: str) -> None:
+        """
+        Заменяет хранимый PIN или его хеш, если его никто
+        не изменил после чтения карты.
+        """
+        updated = self.storage.replace_pin(self.number, self.stored_code,
+                                           stored_code)
+        cache = getattr(self.connect, 'card_cache', None)
+        if cache is not None:
+            cache.invalidate(self.number)
+        if updated:
+            if self.code == self.stored_code:
+                self.code = stored_code
+            self.stored_code = stored_code
+
+    @classmethod
+    def __check_loaded(cls, connect, cursor, number: str, code):
+        """check_card без фильтра: из кэша, если он подключен, или из базы."""
+        cache = getattr(connect, 'card_cache', None)
+        if cache is not None:
+            return cls.__check_cached(cache, connect, cursor, number, code)
+
+        storage = storage_for(connect, cursor)
         if code:
-            cursor.execute("""
-            SELECT number, pin, balance 
-            FROM card 
-            WHERE number = ? AND pin = ?
-            """, (number, code))
+            result = storage.verify_pin(number, code)
+            if result and PinHasher.is_hashed(result[0]):
+                # Совпал сам хеш, а не PIN
+                result = None
+            if not result:
+                # PIN мог захешировать запуск с --pin-iterations: хеш
+                # проверяется и без хешера
+                entry = storage.get(number)
+                if (entry and PinHasher.is_hashed(entry[0])
+                        and pin_matches(code, entry[0])):
+                    result = entry
         else:
-            cursor.execute("""
-            SELECT number, pin, balance 
-            FROM card 
-            WHERE number = ? 
-            """, (number,))
+            result = storage.get(number)
 
-        result = cursor.fetchone()
         if result:
             return cls(connect, cursor,
-                       card=result[0], code=result[1], balance=result[2])
+                       card=number, code=result[0], balance=result[1])
         else:
             return None
 
+    @classmethod
+    def __check_cached(cls, cache, connect, cursor, number: str, code):
+        """check_card с кэшем: PIN сверяется с записью кэша."""
+        entry = cache.get(number)
+        if entry is DELETED:
+            return None
+        if entry is None or (code and entry[0] is None):
+            entry = storage_for(connect, cursor).get(number)
+            if entry is None:
+                return None
+            cache.fill(number, *entry)
+
+        stored_code, balance = entry[:2]
+        if code and not pin_matches(code, stored_code):
+            return None
+        return cls(connect, cursor, card=number, code=stored_code,
+                   balance=balance)
+
     def update_balance(self, money: int) -> None:
         """Обновить баланс карты."""
-        print(f"Updating balance for card number: {type(self.number)}")
-        self.cursor.execute("""
-                UPDATE card
-                SET balance = balance + ?
-                WHERE number = ?
-                """, (money, self.number))
-        self.connect.commit()
-
-        self.cursor.execute("""
-                SELECT balance 
-                FROM card 
-                WHERE number = ? 
-                """, (self.number,))
-        result = self.cursor.fetchone()
-        self.balance = result[0]
+        logger.debug('Updating balance for card %s by %s', self.number, money)
+        with self.__cache_writing(self.number):
+            balance = self.storage.apply_delta(self.number, money)
+            if balance is None:
+                raise TransactionError("Such a card does not exist.")
+            self.__cache_write(self.number, self.stored_code, balance)
+        self.balance = balance
+
+    def transfer_to(self, other: 'Card', money: int) -> None:
+        """
+        Переводит деньги на другую карту одной транзакцией. Перевод
+        на карту из другого файла ShardRouter выполняет маршрутизатор.
+        """
+        router = getattr(self.connect, 'transfer_router', None)
+        if (router is not None
+                and router.shard_for(other.number) is not self.connect):
+            router.transfer(self, other, money)
+            return
+        logger.debug('Transferring %s from card %s to card %s',
+                     money, self.number, other.number)
+        with self.__cache_writing(self.number, other.number):
+            balance, other_balance = self.storage.transfer(
+                self.number, other.number, money)
+            self.__cache_write(self.number, self.stored_code, balance)
+            self.__cache_write(other.number, other.stored_code,
+                               other_balance)
+        self.balance = balance
+        other.balance = other_balance
 
     def delete_card(self) -> None:
         """Удаление карты из базы данных."""
-        self.cursor.execute("""
-        DELETE FROM card
-        WHERE number = ?
-        """, (self.number,))
-
-        self.connect.commit()
+        with self.__cache_writing(self.number):
+            balance = self.storage.delete(self.number)
+            self.__cache_write(self.number, self.stored_code, None)
+        if balance is not None:
+            # Карту уже удалила другая сессия: повторное удаление
+            # из фильтра задело бы счетчики других карт
+            self.__filter_update(self.connect, self.storage, (self.number,),
+                                 False)
 
 
 class SimpleBankingSystem:
@@ -225,8 +1378,7 @@ class SimpleBankingSystem:
             if transfer_money > self.card.balance:
                 raise TransactionError("Not enough money!")
 
-            self.card.update_balance(transfer_money * -1)
-            transfer_card.update_balance(transfer_money)
+            self.card.transfer_to(transfer_card, transfer_money)
         except TransactionError as e:
             print(e)
 
@@ -236,25 +1388,227 @@ class SimpleBankingSystem:
         self.card = None
 
 
-def main():
-    connect = sqlite3.connect('card.s3db')
+def issue_cards(connect, cursor, args) -> None:
+    """Выпускает карты пачкой и печатает их в формате CSV."""
+    start = time.perf_counter()
+    issued = Card.issue_many(connect, cursor, args.count, args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    sys.stdout.writelines(f'{number},{code}\n' for number, code in issued)
+    print(f'Issued {len(issued)} cards in {elapsed:.2f}s '
+          f'({len(issued) / elapsed:.0f} cards/sec)', file=sys.stderr)
+
+
+def process_batch(connect, cursor, args) -> None:
+    """Выполняет поток операций и сообщает скорость обработки."""
+    # batch импортирует этот модуль, поэтому подключается по требованию
+    from batch import run_batch
+
+    start = time.perf_counter()
+    count = run_batch(connect, cursor, args.input, args.output,
+                      args.format, args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f'Processed {count} operations in {elapsed:.2f}s '
+          f'({count / elapsed:.0f} ops/sec)', file=sys.stderr)
+
+
+def print_history(connect, cursor, args) -> None:
+    """Печатает страницу журнала карты в формате CSV."""
+    # records импортирует этот модуль, поэтому подключается по требованию
+    from records import LedgerEntry
+
+    entries = LedgerEntry.page(connect, args.number, args.before,
+                               args.limit, cursor)
+    print(','.join(LedgerEntry._fields))
+    for entry in entries:
+        print(','.join('' if value is None else str(value)
+                       for value in entry))
+    if len(entries) == args.limit:
+        print(f'More entries: --before {entries[-1].id}', file=sys.stderr)
+
+
+def reconcile_balances(args) -> None:
+    """Сверяет балансы с журналом и печатает расхождения в формате CSV."""
+    # reconcile импортирует этот модуль, поэтому подключается по требованию
+    from reconcile import reconcile
+
+    print('path,number,balance,ledger_total')
+    for path in args.paths or [args.db]:
+        start = time.perf_counter()
+        report = reconcile(path, args.workers, args.parts, args.chunk_size,
+                           args.limit)
+        elapsed = time.perf_counter() - start
+        for number, balance, total in report['examples']:
+            print(f"{path},{number},{'' if balance is None else balance},"
+                  f"{total}")
+        print(f"{path}: {report['cards']} cards, "
+              f"{report['mismatches']} mismatches in {elapsed:.2f}s",
+              file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Simple Banking System')
+    parser.add_argument('--db', default='card.s3db')
+    parser.add_argument('--profile', choices=CONNECTION_PROFILES,
+                        default='safe')
+    parser.add_argument('--cache-size', type=int, default=0,
+                        help='card cache capacity, 0 disables the cache')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help='card cache entry lifetime in seconds')
+    parser.add_argument('--card-filter', action='store_true',
+                        help='reject unknown card numbers with a Bloom '
+                             'filter, only when no other process writes')
+    parser.add_argument('--pin-iterations', type=int, default=0,
+                        help='PBKDF2 iterations for new PINs, 0 stores '
+                             'PINs as is')
+    parser.add_argument('--pin-workers', type=int, default=None,
+                        help='threads for PIN hashing, one per CPU '
+                             'by default')
+    parser.add_argument('--balances', default=None,
+                        help='keep balances in this memory-mapped file, '
+                             'for the interactive session, issue and '
+                             'detach; balances of existing cards are moved '
+                             'into it. Changes reach the disk only on exit '
+                             'or when the OS writes them back: a system '
+                             'crash can lose recent changes and leave a '
+                             'transfer half applied')
+    parser.add_argument('--engine', default=None, metavar='DIR',
+                        help='keep cards in memory with a log and snapshots '
+                             'in DIR instead of the database, for the '
+                             'interactive session and issue. These cards '
+                             'are separate from the cards in --db')
+    commands = parser.add_subparsers(dest='command')
+
+    issue = commands.add_parser('issue', help='issue cards in bulk')
+    issue.add_argument('count', type=int)
+    issue.add_argument('--chunk-size', type=int, default=10000)
+
+    batch = commands.add_parser('batch', help='process an operation stream')
+    batch.add_argument('--input', type=argparse.FileType('r'),
+                       default=sys.stdin)
+    batch.add_argument('--output', type=argparse.FileType('w'),
+                       default=sys.stdout)
+    batch.add_argument('--format', choices=('csv', 'jsonl'), default='jsonl')
+    batch.add_argument('--batch-size', type=int, default=10000)
+
+    history = commands.add_parser('history',
+                                  help="print a card's ledger entries")
+    history.add_argument('number')
+    history.add_argument('--limit', type=int, default=20)
+    history.add_argument('--before', type=int, default=None,
+                         help='show entries older than this ledger id')
+
+    check = commands.add_parser('reconcile',
+                                help='check balances against the ledger')
+    check.add_argument('paths', nargs='*',
+                       help='database files, --db by default')
+    check.add_argument('--workers', type=int, default=1)
+    check.add_argument('--parts', type=int, default=None,
+                       help='card number ranges, --workers by default')
+    check.add_argument('--chunk-size', type=int, default=10000)
+    check.add_argument('--limit', type=int, default=100,
+                       help='mismatches to print per database')
+
+    convert = commands.add_parser('convert',
+                                  help='change the card table storage layout')
+    convert.add_argument('--layout', choices=QUERY_LAYOUTS, required=True)
+
+    commands.add_parser('detach', help='move balances from the --balances '
+                                       'file back into the database')
+
+    serve = commands.add_parser('serve', help='run the network server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--workers', type=int, default=8)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    connect = connect_db(args.db, args.profile)
+    migrate(connect)
     cursor = connect.cursor()
-    cursor.execute(""" 
-        CREATE TABLE IF NOT EXISTS card (
-        id INTEGER PRIMARY KEY,
-        number TEXT,
-        pin TEXT,
-        balance INTEGER DEFAULT 0
-        );
-        """)
+    if args.cache_size:
+        connect.card_cache = CardCache(args.cache_size, args.cache_ttl)
+    if args.card_filter:
+        connect.card_filter = CardFilter.build(connect)
+    if args.pin_iterations:
+        connect.pin_hasher = PinHasher(args.pin_iterations, args.pin_workers)
+    storage = None
+    if args.engine:
+        if args.balances or args.command not in (None, 'issue'):
+            sys.exit("--engine works only with the interactive session and "
+                     "issue, without --balances.")
+        # engine импортирует этот модуль, поэтому подключается
+        # по требованию
+        from engine import LogEngine
+        storage = LogEngine(args.engine)
+        # Фильтр строится по картам базы, а не движка
+        storage.card_cache = connect.card_cache
+        storage.pin_hasher = connect.pin_hasher
+    elif args.balances:
+        if args.command not in (None, 'issue', 'detach'):
+            sys.exit("--balances works only with the interactive session, "
+                     "issue and detach.")
+        # balance_file импортирует этот модуль, поэтому подключается
+        # по требованию
+        from balance_file import MappedStorage
+        try:
+            storage = MappedStorage(connect, args.balances)
+        except SchemaError as e:
+            sys.exit(str(e))
+        if storage.attached:
+            print(f'Moved {storage.attached} balances into {args.balances}',
+                  file=sys.stderr)
+    elif args.command == 'detach':
+        sys.exit("detach needs --balances FILE.")
+    else:
+        # Балансы этих карт в таблице устарели
+        mapped = execute(cursor, 'card_slot_count').fetchone()[0]
+        if mapped:
+            sys.exit(f"Balances of {mapped} cards are kept in a memory-mapped "
+                     f"file: run with --balances FILE, or move them back "
+                     f"with --balances FILE detach.")
 
-    bank = SimpleBankingSystem(connect, cursor)
-    bank.start()
+    if args.command == 'issue':
+        issue_cards(storage or connect, cursor, args)
+    elif args.command == 'batch':
+        process_batch(connect, cursor, args)
+    elif args.command == 'history':
+        print_history(connect, cursor, args)
+    elif args.command == 'reconcile':
+        reconcile_balances(args)
+    elif args.command == 'detach':
+        count = storage.detach()
+        print(f'Moved {count} balances back into the database',
+              file=sys.stderr)
+    elif args.command == 'convert':
+        count = convert_layout(connect, args.layout)
+        print(f'Converted {count} cards to the {args.layout} layout',
+              file=sys.stderr)
+    elif args.command == 'serve':
+        # server импортирует этот модуль, поэтому подключается по требованию
+        from server import run_server
+        run_server(args.db, args.profile, args.host, args.port, args.workers,
+                   connect.card_cache, connect.card_filter,
+                   connect.pin_hasher)
+    else:
+        bank = SimpleBankingSystem(storage or connect, cursor)
+        bank.start()
 
+    if storage is not None:
+        storage.close()
     connect.commit()
     cursor.close()
     connect.close()
+    if connect.pin_hasher is not None:
+        connect.pin_hasher.close()
 
 
 if __name__ == '__main__':
+    # Соседние модули импортируют banking, поэтому скрипт работает
+    # с тем же модулем, а не с __main__: иначе исключения из них
+    # не совпадут с классами, которые ловит меню
+    from banking import main
     main()
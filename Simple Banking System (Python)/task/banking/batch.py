@@ -0,0 +1,275 @@
+"""
+Пакетная обработка операций с картами без интерактивного меню.
+
+Каждая строка входа - операция create, income, transfer или close
+в формате CSV (с заголовком) или JSONL с полями op, number, target,
+amount. Для каждой операции пишется строка результата.
+"""
+import csv
+import json
+from itertools import islice
+
+from banking import (Card, SQLiteStorage, TransactionError, execute,
+                     executemany, immediate_transaction)
+
+FIELDS = ('line', 'op', 'number', 'target', 'amount',
+          'status', 'balance', 'pin', 'error')
+
+
+def read_operations(stream, fmt: str):
+    """
+    Читает операции из потока в формате csv или jsonl. Строки jsonl
+    разбираются при выполнении, чтобы ошибка в одной строке стала
+    результатом этой строки, а не остановила обработку.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield line
+
+
+def _fields(line: int, operation: dict) -> dict:
+    """
+    Результат операции с ее непустыми полями строками: в JSON номер
+    бывает числом.
+    """
+    result = {'line': line}
+    for name in ('op', 'number', 'target', 'amount'):
+        value = operation.get(name)
+        if value is not None and value != '':
+            result[name] = str(value)
+    return result
+
+
+def _amount(value, minimum: int = 1) -> int:
+    """Сумма операции: целое число не меньше minimum, как в server.py."""
+    if isinstance(value, str) and value.strip().isdecimal():
+        value = int(value)
+    if (isinstance(value, bool) or not isinstance(value, int)
+            or value < minimum):
+        raise TransactionError("Amount must be a positive integer."
+                               if minimum > 0 else
+                               "Amount must be a non-negative integer.")
+    return value
+
+
+class ResultWriter:
+    """
+    Пишет результаты операций в формате csv или jsonl. В результатах
+    нет пустых полей, в csv они остаются пустыми колонками.
+    """
+
+    def __init__(self, stream, fmt: str) -> None:
+        self.stream = stream
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(stream, FIELDS,
+                                         extrasaction='ignore')
+            self.writer.writeheader()
+
+    def write(self, result: dict) -> None:
+        if self.fmt == 'csv':
+            self.writer.writerow(result)
+        else:
+            self.stream.write(json.dumps(result) + '\n')
+
+
+class BatchProcessor:
+    """
+    Выполняет операции пачками по batch_size в одной транзакции на
+    пачку. Карты пачки читаются одним вызовом get_many, операции
+    проверяются и применяются к балансам в памяти с теми же
+    сообщениями, что и в Card, а в конце пачки итоговые балансы
+    и журнал ledger записываются через executemany. Новые карты
+    выпускает Card. Результаты пачки выдаются после ее фиксации.
+    """
+
+    def __init__(self, connect, cursor, batch_size: int = 10000) -> None:
+        self.connect = connect
+        self.cursor = cursor if cursor is not None else connect.cursor()
+        self.batch_size = batch_size
+        self.storage = SQLiteStorage(connect, self.cursor)
+        self.operations = {
+            'create': self.__create,
+            'income': self.__income,
+            'transfer': self.__transfer,
+            'close': self.__close,
+        }
+        self.balances = {}
+        self.valid = {}
+        self.changed = set()
+        self.closed = []
+        self.ledger = []
+
+    def process(self, operations):
+        """Выполняет операции и по одной выдает их результаты."""
+        numbered = enumerate(operations, 1)
+        while True:
+            batch = [self.__parse(line, operation)
+                     for line, operation in islice(numbered,
+                                                   self.batch_size)]
+            if not batch:
+                break
+            with immediate_transaction(self.connect):
+                self.__load(batch)
+                for result, amount in batch:
+                    if 'status' not in result:
+                        self.__execute(result, amount)
+                self.__write()
+            self.__forget_changed()
+            yield from (result for result, _ in batch)
+
+    @staticmethod
+    def __parse(line: int, operation) -> tuple:
+        """
+        Результат операции без статуса и ее сумма или результат
+        с ошибкой, если строку нельзя выполнить.
+        """
+        if isinstance(operation, str):
+            try:
+                operation = json.loads(operation)
+            except ValueError as e:
+                return {'line': line, 'status': 'error',
+                        'error': f"Malformed line: {e}"}, None
+        if not isinstance(operation, dict):
+            return {'line': line, 'status': 'error',
+                    'error': "Malformed line: expected an object"}, None
+
+        result = _fields(line, operation)
+        op = result.get('op')
+        amount = None
+        try:
+            if op == 'income' or op == 'transfer':
+                amount = _amount(operation['amount'] if 'amount' in result
+                                 else None)
+            elif op == 'create':
+                # Без суммы карта выпускается с нулевым балансом
+                amount = (_amount(operation['amount'], 0)
+                          if 'amount' in result else 0)
+        except TransactionError as e:
+            result.update(status='error', error=str(e))
+        return result, amount
+
+    def __load(self, batch: list) -> None:
+        """Читает балансы карт пачки и проверяет номера получателей."""
+        numbers = set()
+        targets = set()
+        for result, _ in batch:
+            if 'status' not in result:
+                numbers.add(result.get('number'))
+                if result['op'] == 'transfer':
+                    targets.add(result.get('target'))
+        numbers.discard(None)
+        targets.discard(None)
+        numbers |= targets
+        self.balances = {number: balance for number, (_, balance)
+                         in self.storage.get_many(numbers).items()}
+        targets = list(targets)
+        self.valid = dict(zip(targets, Card.validate_many(targets)))
+
+    def __execute(self, result: dict, amount) -> None:
+        command = self.operations.get(result.get('op'))
+        try:
+            if command is None:
+                raise TransactionError(
+                    f"Unknown operation: {result.get('op')}")
+            command(result, amount)
+        except TransactionError as e:
+            result.update(status='error', error=str(e))
+        else:
+            result['status'] = 'ok'
+
+    def __write(self) -> None:
+        """Записывает балансы и журнал пачки, удаляет закрытые карты."""
+        executemany(self.cursor, 'card_balance_set',
+                    [(self.balances[number], number)
+                     for number in self.changed
+                     if self.balances[number] is not None])
+        executemany(self.cursor, 'ledger_append', self.ledger)
+        for number in self.closed:
+            execute(self.cursor, 'card_delete', (number,)).fetchall()
+        self.ledger.clear()
+
+    def __forget_changed(self) -> None:
+        """
+        После фиксации пачки забывает ее карты в кэше карт и убирает
+        закрытые карты из фильтра, если они подключены.
+        """
+        cache = getattr(self.connect, 'card_cache', None)
+        if cache is not None:
+            for number in self.changed:
+                cache.invalidate(number)
+        card_filter = getattr(self.connect, 'card_filter', None)
+        if card_filter is not None:
+            for number in self.closed:
+                card_filter.remove(number)
+        self.changed.clear()
+        self.closed.clear()
+
+    def __balance(self, number) -> int:
+        balance = self.balances.get(number)
+        if balance is None:
+            raise TransactionError("Such a card does not exist.")
+        return balance
+
+    def __change(self, number: str, money: int, kind: str = 'income',
+                 counterparty: str = None) -> int:
+        """
+        Применяет проверенное изменение баланса в памяти. Пачка
+        держит блокировку записи, поэтому карту до записи никто
+        не изменит.
+        """
+        balance = self.balances[number] + money
+        self.balances[number] = balance
+        self.changed.add(number)
+        self.ledger.append((number, kind, money, balance, counterparty))
+        return balance
+
+    def __create(self, result: dict, amount: int) -> None:
+        card = Card(self.connect, self.cursor, balance=amount)
+        self.balances[card.number] = amount
+        result.update(number=card.number, balance=amount, pin=card.code)
+
+    def __income(self, result: dict, amount: int) -> None:
+        number = result.get('number')
+        self.__balance(number)
+        result['balance'] = self.__change(number, amount)
+
+    def __transfer(self, result: dict, amount: int) -> None:
+        number, target = result.get('number'), result.get('target')
+        # Те же проверки, что и в меню SimpleBankingSystem
+        if number == target:
+            raise TransactionError(
+                "You can't transfer money to the same account!")
+        elif not target or not self.valid[target]:
+            raise TransactionError(
+                "Probably you made a mistake in the card number. "
+                "Please try again!")
+        if self.__balance(number) < amount:
+            raise TransactionError("Not enough money!")
+        self.__balance(target)
+        result['balance'] = self.__change(number, -amount, kind='transfer',
+                                          counterparty=target)
+        self.__change(target, amount, kind='transfer', counterparty=number)
+
+    def __close(self, result: dict, amount) -> None:
+        number = result.get('number')
+        balance = result['balance'] = self.__balance(number)
+        self.ledger.append((number, 'close', -balance, 0, None))
+        self.balances[number] = None
+        self.changed.add(number)
+        self.closed.append(number)
+
+
+def run_batch(connect, cursor, source, sink, fmt: str,
+              batch_size: int = 10000) -> int:
+    """Обрабатывает поток операций, возвращает их количество."""
+    processor = BatchProcessor(connect, cursor, batch_size)
+    writer = ResultWriter(sink, fmt)
+    count = 0
+    for result in processor.process(read_operations(source, fmt)):
+        writer.write(result)
+        count += 1
+    return count
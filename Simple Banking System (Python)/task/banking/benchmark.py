@@ -0,0 +1,830 @@
+"""Замеры производительности банковской системы.
+
+Запуск: python benchmark.py lookup --rows 10000 1000000
+        python benchmark.py luhn --count 1000000
+        python benchmark.py luhn-scalar
+        python benchmark.py profiles --transfers 2000
+        python benchmark.py group-commit --threads 16
+        python benchmark.py statements --operations 10000
+        python benchmark.py cache --capacity 1000
+        python benchmark.py filter --rows 100000
+        python benchmark.py memory --rows 100000
+        python benchmark.py layout --rows 1000000
+        python benchmark.py pins --iterations 0 1000 10000 100000
+        python benchmark.py shards --shards 1 2 4 8 --threads 16
+        python benchmark.py cross-shard --transfers 1000
+        python benchmark.py backends --cards 10000
+        python benchmark.py engine --threads 1 16
+        python benchmark.py balances --cards 100000
+        python benchmark.py batch --operations 50000
+"""
+import argparse
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from random import randrange
+
+from banking import (CONNECTION_PROFILES, QUERY_LAYOUTS, STATEMENT_CACHE_SIZE,
+                     Card, SQLiteStorage, connect_db, convert_layout, execute,
+                     migrate)
+from balance_file import MappedStorage
+from batch import run_batch
+from bloom import CardFilter
+from cache import CardCache
+from engine import LogEngine
+from records import CardRecord, CardTable
+from shards import ShardRouter
+from group_commit import GroupCommitWriter
+from memory_storage import MemoryStorage
+from pins import PinHasher
+from pool import ConnectionPool
+from timing import percentile, timed
+
+INN = '400000'
+
+
+def synthetic_numbers(count: int):
+    """Генерирует различные валидные номера карт без обращения к базе."""
+    for account in range(1, count + 1):
+        account_number = f'{INN}{account:09d}'
+        yield f'{account_number}{Card.calculate_luhn_checksum(account_number)}'
+
+
+def fill_database(connect, rows: int, chunk_size: int = 100000) -> list:
+    """Заполняет базу rows картами и возвращает выборку их номеров."""
+    numbers = synthetic_numbers(rows)
+    sample = []
+    while True:
+        chunk = [(number, '0000', 1000)
+                 for _, number in zip(range(chunk_size), numbers)]
+        if not chunk:
+            break
+        sample.extend(row[0] for row in chunk[::max(1, rows // 1000)])
+        connect.executemany(
+            'INSERT INTO card (number, pin, balance) VALUES (?, ?, ?)', chunk)
+        connect.commit()
+    return sample
+
+
+def bench_lookup(rows: int, lookups: int) -> float:
+    """Возвращает среднюю задержку Card.check_card в микросекундах."""
+    with tempfile.TemporaryDirectory() as directory:
+        connect = sqlite3.connect(os.path.join(directory, 'card.s3db'))
+        migrate(connect)
+        sample = fill_database(connect, rows)
+        cursor = connect.cursor()
+
+        start = time.perf_counter()
+        for _ in range(lookups):
+            Card.check_card(connect, cursor,
+                            sample[randrange(len(sample))], '0000')
+        elapsed = time.perf_counter() - start
+
+        cursor.close()
+        connect.close()
+    return elapsed / lookups * 1e6
+
+
+def bench_transfers(profile: str, cards: int, transfers: int) -> float:
+    """Возвращает число переводов в секунду для профиля соединения."""
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'), profile)
+        migrate(connect)
+        cursor = connect.cursor()
+        accounts = [Card.check_card(connect, cursor, number)
+                    for number in fill_database(connect, cards)]
+
+        start = time.perf_counter()
+        for i in range(transfers):
+            source = accounts[i % len(accounts)]
+            source.transfer_to(accounts[(i + 1) % len(accounts)], 1)
+        elapsed = time.perf_counter() - start
+
+        cursor.close()
+        connect.close()
+    return transfers / elapsed
+
+
+def bench_group_commit(profile: str, threads: int, updates: int) -> dict:
+    """
+    Сравнивает изменения балансов из многих потоков: каждый поток со
+    своим соединением и через общий GroupCommitWriter, изменений в секунду.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'card.s3db')
+        connect = connect_db(path, profile)
+        migrate(connect)
+        numbers = fill_database(connect, threads * 10)
+        connect.close()
+
+        def direct(worker):
+            own = connect_db(path, profile)
+            cursor = own.cursor()
+            card = Card.check_card(own, cursor, numbers[worker])
+            for _ in range(updates):
+                card.update_balance(1)
+            cursor.close()
+            own.close()
+
+        def grouped(worker):
+            for _ in range(updates):
+                writer.update_balance(numbers[worker], 1).result()
+
+        def rate(work):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(work, range(threads)))
+            return threads * updates / (time.perf_counter() - start)
+
+        rates = {'direct': rate(direct)}
+        with GroupCommitWriter(path, profile) as writer:
+            rates['grouped'] = rate(grouped)
+    return rates
+
+
+def bench_statements(operations: int) -> dict:
+    """
+    Выполняет одну и ту же смесь операций с картами с кэшем
+    подготовленных выражений и без него (cached_statements=0) и
+    возвращает операций в секунду и счетчики запросов соединения.
+    """
+    result = {}
+    for name, cache_size in (('cached', STATEMENT_CACHE_SIZE),
+                             ('uncached', 0)):
+        connect = connect_db(':memory:', cached_statements=cache_size)
+        migrate(connect)
+        cursor = connect.cursor()
+        cards = [Card(connect, cursor, balance=1000) for _ in range(100)]
+
+        start = time.perf_counter()
+        for i in range(operations):
+            card = Card.check_card(connect, cursor, cards[i % 100].number,
+                                   cards[i % 100].code)
+            card.update_balance(1)
+            card.transfer_to(cards[(i + 1) % 100], 1)
+        elapsed = time.perf_counter() - start
+
+        result[f'{name} ops/sec'] = round(operations / elapsed)
+        result.update(connect.statement_stats.summary())
+        connect.close()
+    return result
+
+
+def bench_cache(rows: int, capacity: int, lookups: int) -> dict:
+    """
+    Сравнивает задержку входа по карте без кэша и с кэшем карт,
+    обращения сосредоточены на небольшой доле горячих карт.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'))
+        migrate(connect)
+        sample = fill_database(connect, rows)
+        cursor = connect.cursor()
+        # Половина обращений приходится на десять горячих карт
+        hot = sample[:10]
+        numbers = [hot[i % 10] if i % 2 else sample[randrange(len(sample))]
+                   for i in range(lookups)]
+
+        result = {}
+        for name, cache in (('no cache', None),
+                            ('cache', CardCache(capacity))):
+            connect.card_cache = cache
+            start = time.perf_counter()
+            for number in numbers:
+                Card.check_card(connect, cursor, number, '0000')
+            result[name] = (time.perf_counter() - start) / lookups * 1e6
+        result['hit rate'] = cache.stats()['hit_rate']
+
+        cursor.close()
+        connect.close()
+    return result
+
+
+def bench_filter(rows: int, lookups: int) -> dict:
+    """
+    Замеряет отказ по несуществующим номерам карт без фильтра
+    и с фильтром карт, возвращает задержку и статистику фильтра.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'))
+        migrate(connect)
+        fill_database(connect, rows)
+        cursor = connect.cursor()
+        # Номера за пределами выпущенных: валидные, но несуществующие
+        missing = list(synthetic_numbers(rows + lookups))[rows:]
+
+        result = {}
+        start = time.perf_counter()
+        connect.card_filter = CardFilter.build(connect)
+        result['build_sec'] = time.perf_counter() - start
+
+        for name, card_filter in (('no filter', None),
+                                  ('filter', connect.card_filter)):
+            connect.card_filter = card_filter
+            start = time.perf_counter()
+            for number in missing:
+                assert Card.check_card(connect, cursor, number) is None
+            result[name] = (time.perf_counter() - start) / lookups * 1e6
+        result.update(card_filter.stats())
+
+        cursor.close()
+        connect.close()
+    return result
+
+
+def bench_memory(rows: int) -> dict:
+    """Память на одну карту при загрузке всех карт, в байтах."""
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'))
+        migrate(connect)
+        fill_database(connect, rows)
+        cursor = connect.cursor()
+
+        loaders = {
+            'Card': lambda: [Card(connect, cursor, *record)
+                             for record in CardRecord.load_many(connect,
+                                                                cursor)],
+            'CardRecord': lambda: list(CardRecord.load_many(connect, cursor)),
+            'CardTable': lambda: CardTable.load(connect, cursor),
+        }
+        result = {}
+        for name, load in loaders.items():
+            tracemalloc.start()
+            cards = load()
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert len(cards) == rows
+            result[name] = size / rows
+            del cards
+
+        cursor.close()
+        connect.close()
+    return result
+
+
+def bench_layout(rows: int, lookups: int) -> dict:
+    """
+    Для каждой раскладки таблицы card возвращает размер базы в байтах
+    на карту и среднюю задержку Card.check_card в микросекундах.
+    """
+    result = {}
+    for layout in QUERY_LAYOUTS:
+        with tempfile.TemporaryDirectory() as directory:
+            connect = connect_db(os.path.join(directory, 'card.s3db'))
+            migrate(connect)
+            convert_layout(connect, layout)
+            sample = fill_database(connect, rows)
+            connect.execute('VACUUM')
+            pages, = connect.execute('PRAGMA page_count').fetchone()
+            page_size, = connect.execute('PRAGMA page_size').fetchone()
+            cursor = connect.cursor()
+
+            start = time.perf_counter()
+            for _ in range(lookups):
+                Card.check_card(connect, cursor,
+                                sample[randrange(len(sample))], '0000')
+            elapsed = time.perf_counter() - start
+
+            cursor.close()
+            connect.close()
+        result[layout] = (pages * page_size / rows, elapsed / lookups * 1e6)
+    return result
+
+
+def bench_pins(iterations: int, cards: int, logins: int,
+               threads: int) -> dict:
+    """
+    Возвращает входов в секунду с PIN, захешированными с заданной
+    стоимостью (0 - без хеша): из одного потока и из threads потоков
+    через общий пул соединений.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'card.s3db')
+        connect = connect_db(path, 'wal')
+        migrate(connect)
+        if iterations:
+            connect.pin_hasher = PinHasher(iterations, threads)
+        issued = Card.issue_many(connect, None, cards)
+        cursor = connect.cursor()
+
+        start = time.perf_counter()
+        for index in range(logins):
+            number, code = issued[index % cards]
+            if Card.check_card(connect, cursor, number, code) is None:
+                raise RuntimeError(f'login failed for card {number}')
+        rates = {'serial': logins / (time.perf_counter() - start)}
+
+        pool = ConnectionPool(partial(connect_db, path, 'wal',
+                                      check_same_thread=False), threads)
+        pool.pin_hasher = connect.pin_hasher
+
+        def login(index):
+            number, code = issued[index % cards]
+            if Card.check_card(pool, None, number, code) is None:
+                raise RuntimeError(f'login failed for card {number}')
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(login, range(logins)))
+        rates['parallel'] = logins / (time.perf_counter() - start)
+
+        pool.close()
+        cursor.close()
+        connect.close()
+        if connect.pin_hasher is not None:
+            connect.pin_hasher.close()
+    return rates
+
+
+def bench_shards(shards: int, profile: str, threads: int,
+                 updates: int) -> float:
+    """
+    Возвращает изменений баланса в секунду из threads потоков для карт,
+    разложенных по shards файлам.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        router = ShardRouter([os.path.join(directory, f'card{index}.s3db')
+                              for index in range(shards)], profile, threads)
+        cards = [router.check_card(number)
+                 for number, _ in router.issue_many(threads * 10)]
+
+        def work(worker):
+            for update in range(updates):
+                cards[(worker + update * threads) % len(cards)
+                      ].update_balance(1)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(work, range(threads)))
+        elapsed = time.perf_counter() - start
+        router.close()
+    return threads * updates / elapsed
+
+
+def bench_cross_shard(profile: str, transfers: int) -> dict:
+    """
+    Возвращает задержки переводов в миллисекундах (p50, p99) между
+    картами одного файла и разных файлов.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        router = ShardRouter([os.path.join(directory, f'card{index}.s3db')
+                              for index in range(2)], profile)
+        cards = [[], []]
+        while min(map(len, cards)) < 2:
+            card = router.create_card(transfers)
+            cards[router.shard_index(card.number)].append(card)
+        pairs = {'same shard': (cards[0][0], cards[0][1]),
+                 'cross shard': (cards[0][0], cards[1][0])}
+
+        result = {}
+        for name, (card, other) in pairs.items():
+            # Деньги ходят туда и обратно, балансы не кончаются
+            latencies = timed(lambda pair: router.transfer(*pair, 1),
+                              [(card, other), (other, card)]
+                              * (transfers // 2))
+            result[name] = tuple(percentile(latencies, fraction) * 1000
+                                 for fraction in (0.5, 0.99))
+        router.close()
+    return result
+
+
+def sqlite_backend(directory: str):
+    connect = connect_db(os.path.join(directory, 'card.s3db'), 'wal')
+    migrate(connect)
+    return SQLiteStorage(connect, connect.cursor())
+
+
+def sqlite_memory_backend(directory: str):
+    connect = connect_db(':memory:')
+    migrate(connect)
+    return SQLiteStorage(connect, connect.cursor())
+
+
+def mapped_backend(directory: str):
+    connect = connect_db(os.path.join(directory, 'card.s3db'), 'wal')
+    migrate(connect)
+    return MappedStorage(connect, os.path.join(directory, 'balances'))
+
+
+# Хранилища карт, которые замеряет команда backends; одинаковое
+# поведение того же набора из test/backends.py проверяет
+# test/test_backends.py
+BACKENDS = {
+    'sqlite': sqlite_backend,
+    'sqlite-memory': sqlite_memory_backend,
+    'memory': lambda directory: MemoryStorage(),
+    'mapped': mapped_backend,
+    'engine': lambda directory: LogEngine(tempfile.mkdtemp(dir=directory)),
+    'engine-async': lambda directory: LogEngine(
+        tempfile.mkdtemp(dir=directory), durable=False),
+}
+
+
+def bench_backends(cards: int, operations: int) -> dict:
+    """
+    Замеряет каждое хранилище из BACKENDS и возвращает для него
+    операций в секунду: выпуск, чтение, изменение баланса, перевод.
+    """
+    result = {}
+    for name, backend in BACKENDS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            storage = backend(directory)
+            rates = {}
+
+            start = time.perf_counter()
+            issued = Card.issue_many(storage, None, cards)
+            rates['issue'] = cards / (time.perf_counter() - start)
+            numbers = [number for number, _ in issued]
+
+            def rate(work):
+                start = time.perf_counter()
+                for index in range(operations):
+                    work(numbers[index % cards],
+                         numbers[(index * 7 + 1) % cards])
+                return operations / (time.perf_counter() - start)
+
+            rates['get'] = rate(lambda number, _: storage.get(number))
+            rates['apply_delta'] = rate(
+                lambda number, _: storage.apply_delta(number, 10))
+            rates['transfer'] = rate(
+                lambda number, other: storage.transfer(number, other, 1))
+            result[name] = rates
+    return result
+
+
+def bench_engine(profile: str, threads: int, updates: int,
+                 cards: int) -> dict:
+    """
+    Сравнивает изменения балансов из threads потоков в SQLite и в
+    LogEngine с fsync и без него, изменений в секунду. Для LogEngine
+    также время запуска по снимку с cards картами и журналу из всех
+    изменений, в секундах.
+    """
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'card.s3db')
+        connect = connect_db(path, profile)
+        migrate(connect)
+        numbers = fill_database(connect, threads)
+        connect.close()
+
+        def sqlite_updates(worker):
+            own = connect_db(path, profile)
+            storage = SQLiteStorage(own, own.cursor())
+            for _ in range(updates):
+                storage.apply_delta(numbers[worker], 1)
+            own.close()
+
+        def rate(work):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(work, range(threads)))
+            return threads * updates / (time.perf_counter() - start)
+
+        result['sqlite'] = {'updates': rate(sqlite_updates)}
+
+        for name, durable in (('engine', True), ('engine-async', False)):
+            engine_directory = os.path.join(directory, name)
+            engine = LogEngine(engine_directory, durable)
+            issued = [number for number, _ in
+                      Card.issue_many(engine, None, max(cards, threads))]
+            engine.snapshot()
+            result[name] = {'updates': rate(
+                lambda worker: [engine.apply_delta(issued[worker], 1)
+                                for _ in range(updates)])}
+            result[name]['flushes'] = engine.flushes
+            engine.close()
+
+            start = time.perf_counter()
+            engine = LogEngine(engine_directory)
+            result[name]['restart'] = time.perf_counter() - start
+            engine.close()
+    return result
+
+
+def bench_balances(cards: int, operations: int) -> dict:
+    """
+    Сравнивает чтение баланса, изменение баланса и перевод в базе
+    SQLite и в MappedStorage с cards картами, микросекунд на операцию.
+    """
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'), 'wal')
+        migrate(connect)
+        cursor = connect.cursor()
+        numbers = fill_database(connect, cards)
+        sqlite = SQLiteStorage(connect, cursor)
+
+        mapped_connect = connect_db(os.path.join(directory, 'mapped.s3db'),
+                                    'wal')
+        migrate(mapped_connect)
+        mapped = MappedStorage(mapped_connect,
+                               os.path.join(directory, 'balances'), cards)
+        mapped.insert_many((number, '0000', 1000)
+                           for number in synthetic_numbers(cards))
+
+        def latency(work):
+            start = time.perf_counter()
+            for index in range(operations):
+                work(numbers[index % len(numbers)],
+                     numbers[(index * 7 + 1) % len(numbers)])
+            return (time.perf_counter() - start) / operations * 1e6
+
+        result['sqlite'] = {
+            'balance': latency(lambda number, _: execute(
+                cursor, 'card_balance', (number,)).fetchone()),
+            'apply_delta': latency(
+                lambda number, _: sqlite.apply_delta(number, 10)),
+            'transfer': latency(
+                lambda number, other: sqlite.transfer(number, other, 1)),
+        }
+        result['mapped'] = {
+            'balance': latency(lambda number, _: mapped.balance(number)),
+            'apply_delta': latency(
+                lambda number, _: mapped.apply_delta(number, 10)),
+            'transfer': latency(
+                lambda number, other: mapped.transfer(number, other, 1)),
+        }
+        mapped.close()
+        mapped_connect.close()
+        cursor.close()
+        connect.close()
+    return result
+
+
+def batch_operations(numbers: list, operations: int) -> str:
+    """
+    Поток JSONL для команды batch: пополнения и переводы между
+    numbers, выпуск и закрытие карт.
+    """
+    lines = []
+    closing = numbers[len(numbers) // 2:]
+    for index in range(operations):
+        number = numbers[index % len(numbers)]
+        kind = index % 20
+        if kind < 9:
+            operation = {'op': 'income', 'number': number, 'amount': 5}
+        elif kind < 18:
+            operation = {'op': 'transfer', 'number': number, 'amount': 1,
+                         'target': numbers[(index * 7 + 1) % len(numbers)]}
+        elif kind == 18 or not closing:
+            operation = {'op': 'create', 'amount': 10}
+        else:
+            operation = {'op': 'close', 'number': closing.pop()}
+        lines.append(json.dumps(operation) + '\n')
+    return ''.join(lines)
+
+
+def bench_batch(profile: str, cards: int, operations: int,
+                batch_size: int) -> float:
+    """Возвращает число операций команды batch в секунду."""
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'), profile)
+        migrate(connect)
+        cursor = connect.cursor()
+        source = io.StringIO(batch_operations(fill_database(connect, cards),
+                                              operations))
+
+        start = time.perf_counter()
+        run_batch(connect, cursor, source, io.StringIO(), 'jsonl',
+                  batch_size)
+        elapsed = time.perf_counter() - start
+
+        cursor.close()
+        connect.close()
+    return operations / elapsed
+
+
+def legacy_luhn_checksum(account_number: str) -> int:
+    """Прежняя реализация Card.calculate_luhn_checksum для сравнения."""
+    digits = [int(digit) for digit in account_number]
+    for i in range(len(digits) - 1, -1, -2):
+        digits[i] = digits[i] * 2
+        if digits[i] > 9:
+            digits[i] -= 9
+    return (10 - sum(digits) % 10) % 10
+
+
+def bench_luhn_scalar(calls: int) -> dict:
+    """Замеряет один вызов контрольной суммы до и после, ns на вызов."""
+    account_number = '400000123456789'
+    assert (legacy_luhn_checksum(account_number)
+            == Card.calculate_luhn_checksum(account_number))
+    functions = {
+        'legacy': legacy_luhn_checksum,
+        'table': Card.calculate_luhn_checksum,
+    }
+    return {name: min(timeit.repeat(lambda: function(account_number),
+                                    number=calls, repeat=5)) / calls * 1e9
+            for name, function in functions.items()}
+
+
+def bench_luhn(count: int) -> dict:
+    """Сравнивает поштучную и пакетную проверку номеров, ns на номер."""
+    numbers = list(synthetic_numbers(count))
+    timings = {}
+
+    start = time.perf_counter()
+    scalar = [Card.is_valid_card_number(number) for number in numbers]
+    timings['scalar'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = Card.validate_many(numbers)
+    timings['batch'] = time.perf_counter() - start
+
+    assert scalar == batch
+    return {name: elapsed / count * 1e9 for name, elapsed in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    lookup = commands.add_parser('lookup', help='Card lookup latency')
+    lookup.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 1000000, 10000000])
+    lookup.add_argument('--lookups', type=int, default=10000)
+
+    luhn = commands.add_parser('luhn', help='Luhn validation throughput')
+    luhn.add_argument('--count', type=int, default=1000000)
+
+    luhn_scalar = commands.add_parser('luhn-scalar',
+                                      help='Single Luhn checksum call')
+    luhn_scalar.add_argument('--calls', type=int, default=200000)
+
+    profiles = commands.add_parser('profiles',
+                                   help='Transfer throughput per profile')
+    profiles.add_argument('--profile', nargs='+', choices=CONNECTION_PROFILES,
+                          default=list(CONNECTION_PROFILES))
+    profiles.add_argument('--cards', type=int, default=100000)
+    profiles.add_argument('--transfers', type=int, default=5000)
+
+    group = commands.add_parser('group-commit',
+                                help='Concurrent balance updates')
+    group.add_argument('--profile', choices=CONNECTION_PROFILES,
+                       default='safe')
+    group.add_argument('--threads', type=int, default=16)
+    group.add_argument('--updates', type=int, default=200)
+
+    statements = commands.add_parser('statements',
+                                     help='Prepared statement reuse')
+    statements.add_argument('--operations', type=int, default=10000)
+
+    cache = commands.add_parser('cache', help='Card cache lookup latency')
+    cache.add_argument('--rows', type=int, default=100000)
+    cache.add_argument('--capacity', type=int, default=1000)
+    cache.add_argument('--lookups', type=int, default=20000)
+
+    card_filter = commands.add_parser('filter',
+                                      help='Unknown card rejection')
+    card_filter.add_argument('--rows', type=int, default=100000)
+    card_filter.add_argument('--lookups', type=int, default=20000)
+
+    memory = commands.add_parser('memory', help='Memory per loaded card')
+    memory.add_argument('--rows', type=int, default=100000)
+
+    layout = commands.add_parser('layout',
+                                 help='Card table size and lookup latency')
+    layout.add_argument('--rows', type=int, default=1000000)
+    layout.add_argument('--lookups', type=int, default=20000)
+
+    pins = commands.add_parser('pins', help='Logins per second by PIN cost')
+    pins.add_argument('--iterations', type=int, nargs='+',
+                      default=[0, 1000, 10000, 100000])
+    pins.add_argument('--cards', type=int, default=1000)
+    pins.add_argument('--logins', type=int, default=2000)
+    pins.add_argument('--threads', type=int, default=os.cpu_count())
+
+    shards = commands.add_parser('shards',
+                                 help='Write throughput by shard count')
+    shards.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    shards.add_argument('--profile', choices=CONNECTION_PROFILES,
+                        default='safe')
+    shards.add_argument('--threads', type=int, default=16)
+    shards.add_argument('--updates', type=int, default=100)
+
+    cross_shard = commands.add_parser(
+        'cross-shard', help='Same-shard versus cross-shard transfers')
+    cross_shard.add_argument('--profile', choices=CONNECTION_PROFILES,
+                             default='safe')
+    cross_shard.add_argument('--transfers', type=int, default=1000)
+
+    backends = commands.add_parser(
+        'backends', help='Compare card storage backends')
+    backends.add_argument('--cards', type=int, default=10000)
+    backends.add_argument('--operations', type=int, default=20000)
+
+    engine = commands.add_parser(
+        'engine', help='In-memory engine versus SQLite balance updates')
+    engine.add_argument('--profile', choices=CONNECTION_PROFILES,
+                        default='safe')
+    engine.add_argument('--threads', type=int, nargs='+', default=[1, 16])
+    engine.add_argument('--updates', type=int, default=500)
+    engine.add_argument('--cards', type=int, default=100000)
+
+    balances = commands.add_parser(
+        'balances', help='Memory-mapped balances versus SQLite')
+    balances.add_argument('--cards', type=int, default=100000)
+    balances.add_argument('--operations', type=int, default=20000)
+
+    batch = commands.add_parser('batch', help='Batch operation throughput')
+    batch.add_argument('--profile', nargs='+', choices=CONNECTION_PROFILES,
+                       default=list(CONNECTION_PROFILES))
+    batch.add_argument('--cards', type=int, default=1000)
+    batch.add_argument('--operations', type=int, default=50000)
+    batch.add_argument('--batch-size', type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.command == 'lookup':
+        for rows in args.rows:
+            latency = bench_lookup(rows, args.lookups)
+            print(f'{rows:>10} rows: {latency:8.2f} us/lookup')
+    elif args.command == 'luhn':
+        for name, latency in bench_luhn(args.count).items():
+            print(f'{name:>10}: {latency:8.1f} ns/number')
+    elif args.command == 'luhn-scalar':
+        for name, latency in bench_luhn_scalar(args.calls).items():
+            print(f'{name:>10}: {latency:8.1f} ns/call')
+    elif args.command == 'profiles':
+        for profile in args.profile:
+            rate = bench_transfers(profile, args.cards, args.transfers)
+            print(f'{profile:>10}: {rate:10.0f} transfers/sec')
+    elif args.command == 'group-commit':
+        rates = bench_group_commit(args.profile, args.threads, args.updates)
+        for name, rate in rates.items():
+            print(f'{name:>10}: {rate:10.0f} updates/sec')
+    elif args.command == 'statements':
+        for name, value in bench_statements(args.operations).items():
+            print(f'{name:>10}: {value}')
+    elif args.command == 'cache':
+        result = bench_cache(args.rows, args.capacity, args.lookups)
+        print(f"  no cache: {result['no cache']:8.2f} us/lookup")
+        print(f"     cache: {result['cache']:8.2f} us/lookup")
+        print(f"  hit rate: {result['hit rate']:8.2%}")
+    elif args.command == 'filter':
+        for name, value in bench_filter(args.rows, args.lookups).items():
+            print(f'{name:>18}: {value}')
+    elif args.command == 'memory':
+        for name, size in bench_memory(args.rows).items():
+            print(f'{name:>10}: {size:8.1f} bytes/card')
+    elif args.command == 'layout':
+        for name, (size, latency) in bench_layout(args.rows,
+                                                  args.lookups).items():
+            print(f'{name:>10}: {size:8.1f} bytes/card, '
+                  f'{latency:8.2f} us/lookup')
+    elif args.command == 'shards':
+        for count in args.shards:
+            rate = bench_shards(count, args.profile, args.threads,
+                                args.updates)
+            print(f'{count:>10} shards: {rate:10.0f} updates/sec')
+    elif args.command == 'cross-shard':
+        for name, (p50, p99) in bench_cross_shard(args.profile,
+                                                  args.transfers).items():
+            print(f'{name:>12}: p50 {p50:7.3f} ms, p99 {p99:7.3f} ms')
+    elif args.command == 'backends':
+        for name, rates in bench_backends(args.cards,
+                                          args.operations).items():
+            print(f'{name:>14}: ' + ', '.join(
+                f'{operation} {value:.0f}/sec'
+                for operation, value in rates.items()))
+    elif args.command == 'engine':
+        for threads in args.threads:
+            print(f'{threads} threads:')
+            for name, values in bench_engine(args.profile, threads,
+                                             args.updates,
+                                             args.cards).items():
+                line = f"{name:>14}: {values['updates']:10.0f} updates/sec"
+                if 'restart' in values:
+                    line += (f", {values['flushes']} log writes, "
+                             f"restart {values['restart']:.3f} sec")
+                print(line)
+    elif args.command == 'balances':
+        for name, latencies in bench_balances(args.cards,
+                                              args.operations).items():
+            print(f'{name:>10}: ' + ', '.join(
+                f'{operation} {value:.2f} us'
+                for operation, value in latencies.items()))
+    elif args.command == 'batch':
+        for profile in args.profile:
+            rate = bench_batch(profile, args.cards, args.operations,
+                               args.batch_size)
+            print(f'{profile:>10}: {rate:10.0f} ops/sec')
+    elif args.command == 'pins':
+        for iterations in args.iterations:
+            rates = bench_pins(iterations, args.cards, args.logins,
+                               args.threads)
+            print(f'{iterations:>10} iterations: '
+                  f"{rates['serial']:10.0f} logins/sec serial, "
+                  f"{rates['parallel']:10.0f} logins/sec in "
+                  f'{args.threads} threads')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import math
+import threading
+
+_MASK = (1 << 64) - 1
+
+
+class CardFilter:
+    """
+    Считающий фильтр Блума по номерам карт. Отвечает "карты точно нет"
+    или "карта, возможно, есть"; в отличие от обычного фильтра Блума
+    поддерживает удаление. Фильтр знает только о картах, выпущенных
+    и удаленных через этот процесс после его построения.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = math.ceil(-capacity * math.log(error_rate)
+                              / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self.negatives = 0
+        self.positives = 0
+        self.false_positives = 0
+        # Счетчики по байту на позицию, насыщаются на 255 и больше
+        # не уменьшаются, чтобы удаление не дало ложного "нет"
+        self.__counters = bytearray(self.size)
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def build(cls, connect, error_rate: float = 0.01,
+              headroom: float = 2.0, chunk_size: int = 10000):
+        """Строит фильтр по таблице card с запасом на выпуск новых карт."""
+        rows = connect.execute('SELECT count(*) FROM card').fetchone()[0]
+        card_filter = cls(max(int(rows * headroom), 100000), error_rate)
+        cursor = connect.execute('SELECT number FROM card')
+        while chunk := cursor.fetchmany(chunk_size):
+            for number, in chunk:
+                card_filter.add(number)
+        cursor.close()
+        return card_filter
+
+    def __positions(self, number: str):
+        # Фильтр живет только в памяти процесса и строится заново при
+        # запуске, поэтому подходит быстрый встроенный hash строки
+        first = hash(str(number)) & _MASK
+        second = (first * 0x9E3779B97F4A7C15 & _MASK) >> 11 | 1
+        size = self.size
+        return [(first + i * second) % size for i in range(self.hashes)]
+
+    def add(self, number: str) -> None:
+        positions = self.__positions(number)
+        counters = self.__counters
+        with self.__lock:
+            for position in positions:
+                if counters[position] < 255:
+                    counters[position] += 1
+            self.count += 1
+
+    def remove(self, number: str) -> None:
+        """Удаляет номер, который был добавлен в фильтр."""
+        positions = self.__positions(number)
+        counters = self.__counters
+        with self.__lock:
+            for position in positions:
+                if 0 < counters[position] < 255:
+                    counters[position] -= 1
+            self.count -= 1
+
+    def might_contain(self, number: str) -> bool:
+        counters = self.__counters
+        result = all(counters[position]
+                     for position in self.__positions(number))
+        with self.__lock:
+            if result:
+                self.positives += 1
+            else:
+                self.negatives += 1
+        return result
+
+    def false_positive(self) -> None:
+        """Отмечает, что карта, пропущенная фильтром, не нашлась в базе."""
+        with self.__lock:
+            self.false_positives += 1
+
+    def stats(self) -> dict:
+        with self.__lock:
+            # Ожидаемая доля ложных срабатываний при текущем заполнении
+            expected = (1 - math.exp(-self.hashes * self.count / self.size)
+                        ) ** self.hashes
+            absent = self.negatives + self.false_positives
+            return {
+                'cards': self.count,
+                'capacity': self.capacity,
+                'hashes': self.hashes,
+                'memory_bytes': self.size,
+                'expected_fp_rate': expected,
+                'negatives': self.negatives,
+                'positives': self.positives,
+                'false_positives': self.false_positives,
+                'observed_fp_rate':
+                    self.false_positives / absent if absent else 0.0,
+            }
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+# Запись об удаленной карте: не дает вернуть в кэш карту,
+# прочитанную из базы до ее удаления
+DELETED = object()
+
+# Число блокировок изменений карт: карты делят их по номеру
+WRITE_STRIPES = 64
+
+
+class CardCache:
+    """
+    LRU-кэш карт: номер -> (PIN, баланс, версия), PIN может быть
+    неизвестен (None). Изменения балансов записываются в кэш сразу
+    после записи в базу, версия карты растет с каждым изменением.
+    Прочитанные из базы карты добавляются только если кэш еще ничего
+    не знает о карте, поэтому медленное чтение не затрет более новую
+    запись. ttl ограничивает время жизни записи, если базу меняют
+    и другие процессы.
+
+    Изменение карты записывается в базу и в кэш под блокировкой
+    writing: иначе два потока, изменившие одну карту, могли бы записать
+    балансы в кэш не в том порядке, в каком их зафиксировала база.
+    """
+
+    def __init__(self, capacity: int = 100000, ttl: float = None) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__stripes = [threading.Lock() for _ in range(WRITE_STRIPES)]
+
+    def __expires(self) -> float:
+        return time.monotonic() + self.ttl if self.ttl else None
+
+    def __store(self, number: str, entry: tuple) -> None:
+        self.__entries[number] = entry
+        self.__entries.move_to_end(number)
+        while len(self.__entries) > self.capacity:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    @contextmanager
+    def writing(self, *numbers: str):
+        """
+        Блокирует изменения карт numbers в других потоках. Блокировки
+        берутся по порядку, поэтому встречные переводы между двумя
+        картами не ждут друг друга вечно.
+        """
+        stripes = sorted({hash(number) % WRITE_STRIPES
+                          for number in numbers})
+        with ExitStack() as stack:
+            for stripe in stripes:
+                stack.enter_context(self.__stripes[stripe])
+            yield
+
+    def get(self, number: str):
+        """
+        Возвращает (PIN, баланс, версия), DELETED для удаленной карты
+        или None, если карты нет в кэше.
+        """
+        with self.__lock:
+            entry = self.__entries.get(number)
+            if entry is not None and entry[3] and entry[3] < time.monotonic():
+                del self.__entries[number]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries.move_to_end(number)
+            return DELETED if entry[0] is DELETED else entry[:3]
+
+    def fill(self, number: str, code: str, balance: int) -> None:
+        """
+        Добавляет прочитанную из базы карту, если ее нет в кэше,
+        или дополняет PIN, если он был неизвестен.
+        """
+        with self.__lock:
+            entry = self.__entries.get(number)
+            if entry is None:
+                self.__store(number, (code, balance, 0, self.__expires()))
+            elif entry[0] is None:
+                self.__entries[number] = (code,) + entry[1:]
+
+    def write(self, number: str, code, balance) -> None:
+        """
+        Записывает новый баланс карты после фиксации в базе.
+        code None означает, что PIN неизвестен, тогда сохраняется
+        уже известный кэшу PIN.
+        """
+        with self.__lock:
+            entry = self.__entries.get(number)
+            version = 1
+            if entry is not None:
+                version = entry[2] + 1
+                if code is None:
+                    code = entry[0]
+            self.__store(number, (code, balance, version, self.__expires()))
+
+    def delete(self, number: str) -> None:
+        """Отмечает карту удаленной."""
+        self.write(number, DELETED, None)
+
+    def invalidate(self, number: str) -> None:
+        """Забывает карту, следующее чтение пойдет в базу."""
+        with self.__lock:
+            self.__entries.pop(number, None)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.__entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,394 @@
+"""
+Хранилище карт в памяти с журналом операций на диске.
+
+Каждое изменение применяется к словарю карт и дописывается строкой
+в журнал log.<поколение>. Фоновый поток записывает накопившиеся
+строки одним fsync, а изменение возвращается только после того, как
+его строка дошла до диска (групповая фиксация). Снимок snapshot.<N>
+сохраняет все карты и открывает журнал поколения N, поэтому при
+запуске читается последний снимок и только журналы после него.
+
+Строки журнала, поля разделены табуляцией:
+    A  счетчик    - выданы номера счетов до значения счетчика
+    J  номер PIN баланс ...   - добавлены карты
+    M  номер сумма ...        - изменены балансы
+    X  номер                  - удалена карта
+    P  номер PIN              - заменен PIN
+
+В интерактивной сессии и выпуске карт движок включает
+banking.py --engine DIR.
+"""
+import os
+import threading
+from collections import deque
+
+from memory_storage import MemoryStorage
+
+
+class LogEngine(MemoryStorage):
+    """
+    MemoryStorage, переживающее перезапуск: подходит вместо соединения
+    для Card. durable=False не ждет fsync, изменения могут потеряться
+    при сбое системы. Снимок делается в фоне каждые snapshot_every
+    изменений. Изменение видно другим потокам сразу, еще до fsync.
+
+    Если записать журнал не удалось, изменения, не дошедшие до диска,
+    откатываются, вызывающие получают OSError, а новые изменения
+    и снимки отклоняются с той же ошибкой: в памяти остается только
+    то, что переживет перезапуск.
+    """
+
+    def __init__(self, directory: str, durable: bool = True,
+                 snapshot_every: int = 1000000) -> None:
+        self.directory = directory
+        self.durable = durable
+        self.snapshot_every = snapshot_every
+        self.flushes = 0
+        self.records = 0
+        self.__lock = threading.Lock()
+        self.__snapshot_lock = threading.Lock()
+        log_lock = threading.Lock()
+        self.__pending = threading.Condition(log_lock)
+        self.__synced = threading.Condition(log_lock)
+        self.__buffer = []
+        # Прежнее состояние карт для каждой строки, еще не дошедшей
+        # до диска: (номер строки, (счетчик, {номер: запись}))
+        self.__undo = deque()
+        self.__written = 0
+        self.__flushed = 0
+        self.__error = None
+        self.__closing = False
+        self.__since_snapshot = 0
+        self.__snapshotting = False
+        self.__snapshotter = None
+        self.__closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.generation = self.__recover()
+        self.__file = open(self.__path('log', self.generation), 'ab',
+                           buffering=0)
+        # Размер журнала, дошедшего до диска
+        self.__size = os.fstat(self.__file.fileno()).st_size
+        self.__flusher = threading.Thread(target=self.__flush_loop,
+                                          name='engine-log', daemon=True)
+        self.__flusher.start()
+
+    def __path(self, kind: str, generation: int) -> str:
+        return os.path.join(self.directory, f'{kind}.{generation}')
+
+    def __generations(self, kind: str) -> list:
+        prefix = kind + '.'
+        return sorted(int(name[len(prefix):])
+                      for name in os.listdir(self.directory)
+                      if name.startswith(prefix)
+                      and name[len(prefix):].isdecimal())
+
+    def __recover(self) -> int:
+        """
+        Загружает последний снимок и журналы после него, возвращает
+        поколение журнала для новых записей.
+        """
+        snapshots = self.__generations('snapshot')
+        if not snapshots:
+            super().__init__()
+            self.__write_snapshot(0, self.key, 0, {})
+            return 0
+        generation = snapshots[-1]
+        with open(self.__path('snapshot', generation),
+                  encoding='ascii') as snapshot:
+            key, next_value = map(int, snapshot.readline().split())
+            super().__init__(key)
+            self.next_value = next_value
+            cards = self.cards
+            for line in snapshot:
+                number, code, balance = line.split()
+                cards[number] = (code, int(balance))
+
+        logs = [log for log in self.__generations('log') if log >= generation]
+        for log in logs:
+            self.__replay(self.__path('log', log))
+        return max(logs, default=generation)
+
+    def __replay(self, path: str) -> None:
+        """
+        Применяет строки журнала. Недописанная при сбое последняя
+        строка отрезается, чтобы к ней не приклеилась следующая.
+        """
+        cards = self.cards
+        with open(path, 'r+', encoding='ascii', newline='\n') as log:
+            valid = 0
+            for line in log:
+                if not line.endswith('\n'):
+                    break
+                valid += len(line)
+                kind, *fields = line.split('\t')
+                if kind == 'A':
+                    self.next_value = int(fields[0])
+                elif kind == 'J':
+                    for row in fields:
+                        number, code, balance = row.split()
+                        cards[number] = (code, int(balance))
+                elif kind == 'M':
+                    for change in fields:
+                        number, money = change.split()
+                        code, balance = cards[number]
+                        cards[number] = (code, balance + int(money))
+                elif kind == 'X':
+                    del cards[fields[0].rstrip()]
+                elif kind == 'P':
+                    number, code = fields[0].split()
+                    cards[number] = (code, cards[number][1])
+            log.truncate(valid)
+
+    def __write_snapshot(self, generation: int, key: int, next_value: int,
+                         cards: dict) -> None:
+        path = self.__path('snapshot', generation)
+        with open(path + '.tmp', 'w', encoding='ascii') as snapshot:
+            snapshot.write(f'{key} {next_value}\n')
+            snapshot.writelines(f'{number} {code} {balance}\n'
+                                for number, (code, balance) in cards.items())
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(path + '.tmp', path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def snapshot(self) -> int:
+        """
+        Сохраняет все карты в снимок и начинает новый журнал, старые
+        журналы и снимки удаляются. Возвращает поколение снимка.
+        """
+        with self.__snapshot_lock:
+            with self.__lock:
+                with self.__synced:
+                    # В снимок попадает только то, что дошло до диска
+                    while (self.__error is None
+                           and self.__flushed < self.__written):
+                        self.__synced.wait()
+                    if self.__error is not None:
+                        raise self.__error
+                generation = self.generation + 1
+                cards = dict(self.cards)
+                key, next_value = self.key, self.next_value
+                with self.__pending:
+                    old, self.__file = self.__file, open(
+                        self.__path('log', generation), 'ab', buffering=0)
+                    self.__size = 0
+                old.close()
+                self.generation = generation
+                self.__since_snapshot = 0
+
+            # Пока снимок не записан, при запуске читаются старый
+            # снимок и оба журнала
+            self.__write_snapshot(generation, key, next_value, cards)
+            for kind in ('log', 'snapshot'):
+                for old_generation in self.__generations(kind):
+                    if old_generation < generation:
+                        os.remove(self.__path(kind, old_generation))
+            self.__snapshotting = False
+        return generation
+
+    def __begin(self, numbers) -> tuple:
+        """
+        Вызывается под блокировкой изменений до изменения: отклоняет
+        его, если журнал больше не пишется, и возвращает прежнее
+        состояние карт numbers для отката.
+        """
+        if self.__error is not None:
+            raise self.__error
+        cards = self.cards
+        return self.next_value, {number: cards.get(number)
+                                 for number in numbers}
+
+    def __append(self, line: str, undo: tuple) -> int:
+        """
+        Передает строку фоновому потоку, возвращает ее номер. Вызывается
+        под блокировкой изменений, поэтому порядок строк совпадает
+        с порядком изменений. undo - состояние из __begin.
+        """
+        with self.__pending:
+            self.__buffer.append(line)
+            self.__written += 1
+            seq = self.__written
+            self.__undo.append((seq, undo))
+            self.__pending.notify()
+        self.records += 1
+        self.__since_snapshot += 1
+        if (self.__since_snapshot >= self.snapshot_every
+                and not self.__snapshotting and not self.__closed):
+            self.__snapshotting = True
+            self.__snapshotter = threading.Thread(
+                target=self.snapshot, name='engine-snapshot', daemon=True)
+            self.__snapshotter.start()
+        return seq
+
+    def __wait(self, seq: int) -> None:
+        """Ждет, пока строка seq дойдет до диска."""
+        if not seq or not self.durable:
+            return
+        with self.__synced:
+            while self.__flushed < seq:
+                if self.__error is not None:
+                    raise self.__error
+                self.__synced.wait()
+
+    def __flush_loop(self) -> None:
+        while True:
+            with self.__pending:
+                while not self.__buffer and not self.__closing:
+                    self.__pending.wait()
+                if not self.__buffer:
+                    return
+                data = memoryview(''.join(self.__buffer).encode('ascii'))
+                self.__buffer.clear()
+                seq = self.__written
+                log = self.__file
+                size = self.__size
+            try:
+                written = 0
+                while written < len(data):
+                    written += log.write(data[written:])
+                if self.durable:
+                    os.fsync(log.fileno())
+            except OSError as e:
+                self.__fail(log, size, e)
+                return
+            with self.__synced:
+                self.__flushed = seq
+                self.__size = size + len(data)
+                while self.__undo and self.__undo[0][0] <= seq:
+                    self.__undo.popleft()
+                self.flushes += 1
+                self.__synced.notify_all()
+
+    def __fail(self, log, size: int, error: OSError) -> None:
+        """
+        Останавливает журнал после ошибки записи: обрезает недописанную
+        пачку строк и откатывает в памяти все изменения, не дошедшие
+        до диска, в обратном порядке.
+        """
+        try:
+            os.ftruncate(log.fileno(), size)
+        except OSError:
+            pass
+        with self.__synced:
+            self.__error = error
+            self.__synced.notify_all()
+        with self.__lock:
+            with self.__pending:
+                undo = list(self.__undo)
+                self.__undo.clear()
+                self.__buffer.clear()
+            cards = self.cards
+            for _, (next_value, entries) in reversed(undo):
+                self.next_value = next_value
+                for number, entry in entries.items():
+                    if entry is None:
+                        cards.pop(number, None)
+                    else:
+                        cards[number] = entry
+
+    def accounts(self, count: int) -> list:
+        with self.__lock:
+            undo = self.__begin(())
+            result = super().accounts(count)
+            seq = self.__append(f'A\t{self.next_value}\n', undo)
+        self.__wait(seq)
+        return result
+
+    def insert(self, number: str, code: str, balance: int) -> bool:
+        seq = 0
+        with self.__lock:
+            undo = self.__begin((number,))
+            inserted = super().insert(number, code, balance)
+            if inserted:
+                seq = self.__append(f'J\t{number} {code} {balance}\n', undo)
+        self.__wait(seq)
+        return inserted
+
+    def insert_many(self, rows) -> list:
+        rows = list(rows)
+        seq = 0
+        with self.__lock:
+            undo = self.__begin(number for number, _, _ in rows)
+            inserted = super().insert_many(rows)
+            if inserted:
+                seq = self.__append('J\t' + '\t'.join(
+                    f'{number} {code} {balance}'
+                    for number, code, balance in inserted) + '\n', undo)
+        self.__wait(seq)
+        return inserted
+
+    def apply_delta(self, number: str, money: int,
+                    check_funds: bool = False):
+        seq = 0
+        with self.__lock:
+            undo = self.__begin((number,))
+            balance = super().apply_delta(number, money, check_funds)
+            if balance is not None:
+                seq = self.__append(f'M\t{number} {money}\n', undo)
+        self.__wait(seq)
+        return balance
+
+    def apply_many(self, changes) -> list:
+        changes = list(changes)
+        seq = 0
+        with self.__lock:
+            undo = self.__begin(number for number, _, _ in changes)
+            balances = super().apply_many(changes)
+            applied = [f'{number} {money}'
+                       for (number, money, _), balance
+                       in zip(changes, balances) if balance is not None]
+            if applied:
+                seq = self.__append('M\t' + '\t'.join(applied) + '\n',
+                                    undo)
+        self.__wait(seq)
+        return balances
+
+    def transfer(self, source: str, target: str, money: int) -> tuple:
+        with self.__lock:
+            undo = self.__begin((source, target))
+            balances = super().transfer(source, target, money)
+            seq = self.__append(f'M\t{source} {-money}\t{target} {money}\n',
+                                undo)
+        self.__wait(seq)
+        return balances
+
+    def delete(self, number: str):
+        seq = 0
+        with self.__lock:
+            undo = self.__begin((number,))
+            balance = super().delete(number)
+            if balance is not None:
+                seq = self.__append(f'X\t{number}\n', undo)
+        self.__wait(seq)
+        return balance
+
+    def replace_pin(self, number: str, old: str, new: str) -> bool:
+        seq = 0
+        with self.__lock:
+            undo = self.__begin((number,))
+            replaced = super().replace_pin(number, old, new)
+            if replaced:
+                seq = self.__append(f'P\t{number} {new}\n', undo)
+        self.__wait(seq)
+        return replaced
+
+    def close(self) -> None:
+        """
+        Дожидается фонового снимка, дописывает журнал и останавливает
+        фоновый поток. Новых снимков после close не начинается.
+        """
+        with self.__lock:
+            self.__closed = True
+            snapshotter = self.__snapshotter
+        if snapshotter is not None:
+            snapshotter.join()
+        with self.__pending:
+            self.__closing = True
+            self.__pending.notify()
+        self.__flusher.join()
+        self.__file.close()
@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from banking import (TransactionError, change_balance, connect_db,
+                     immediate_transaction)
+
+# Сигнал фоновому потоку о завершении работы
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Применяет изменения балансов от многих вызывающих общими
+    транзакциями. Изменения копятся, пока не наберется max_batch
+    или не пройдет max_delay секунд от первого из них, и фиксируются
+    одним commit. Future каждого изменения завершается только после
+    этого commit. Если фоновый поток остановился, в том числе не открыв
+    базу, Future оставшихся в очереди изменений завершаются ошибкой,
+    а новые изменения не принимаются.
+    """
+
+    def __init__(self, path: str = 'card.s3db', profile: str = 'safe',
+                 max_batch: int = 512, max_delay: float = 0.002) -> None:
+        self.path = path
+        self.profile = profile
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.commits = 0
+        self.updates = 0
+        self.__queue = queue.SimpleQueue()
+        # Проверка __closed и постановка в очередь идут под одной
+        # блокировкой: после _STOP в очередь ничего не попадает
+        self.__lock = threading.Lock()
+        self.__closed = False
+        self.__error = None
+        # Соединение SQLite принадлежит потоку, который его открыл,
+        # поэтому вся работа с базой идет в одном фоновом потоке.
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='group-commit', daemon=True)
+        self.__thread.start()
+
+    def __enter__(self) -> 'GroupCommitWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update_balance(self, number: str, money: int,
+                       check_funds: bool = False) -> Future:
+        """
+        Ставит изменение баланса в очередь. Future вернет новый баланс
+        или TransactionError, если карты нет или не хватает денег.
+        """
+        future = Future()
+        with self.__lock:
+            if self.__closed:
+                raise RuntimeError(
+                    'GroupCommitWriter is closed') from self.__error
+            self.__queue.put((number, money, check_funds, future))
+        return future
+
+    def close(self) -> None:
+        """Дожидается фиксации всех изменений из очереди и закрывается."""
+        with self.__lock:
+            if not self.__closed:
+                self.__closed = True
+                self.__queue.put(_STOP)
+        self.__thread.join()
+
+    def __collect(self, first) -> tuple:
+        """Собирает пачку изменений, возвращает ее и признак остановки."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.__queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def __run(self) -> None:
+        error = None
+        try:
+            connect = connect_db(self.path, self.profile)
+            try:
+                cursor = connect.cursor()
+                stopping = False
+                while not stopping:
+                    first = self.__queue.get()
+                    if first is _STOP:
+                        break
+                    batch, stopping = self.__collect(first)
+                    self.__apply(connect, cursor, batch)
+                cursor.close()
+            finally:
+                connect.close()
+        except Exception as e:
+            error = e
+        finally:
+            self.__fail_pending(error)
+
+    def __fail_pending(self, error) -> None:
+        """
+        Перестает принимать изменения и завершает ошибкой Future всех
+        изменений, оставшихся в очереди.
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__error = error
+        while True:
+            try:
+                item = self.__queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                item[-1].set_exception(
+                    error or RuntimeError('GroupCommitWriter is closed'))
+
+    def __apply(self, connect, cursor, batch) -> None:
+        results = []
+        try:
+            with immediate_transaction(connect):
+                for number, money, check_funds, _ in batch:
+                    results.append(change_balance(cursor, number, money,
+                                                  check_funds))
+        except Exception as e:
+            for *_, future in batch:
+                future.set_exception(e)
+            return
+
+        self.commits += 1
+        self.updates += len(batch)
+        for (number, money, check_funds, future), balance in zip(batch,
+                                                                 results):
+            if balance is not None:
+                future.set_result(balance)
+            elif check_funds:
+                future.set_exception(TransactionError("Not enough money!"))
+            else:
+                future.set_exception(
+                    TransactionError("Such a card does not exist."))
@@ -0,0 +1,204 @@
+"""
+Замеры операций банковской системы на базах разного размера:
+выпуск карты, вход, чтение баланса, пополнение, перевод и закрытие
+счета. Замер повторяется несколько раз; для каждой операции в JSON
+сохраняются медианы операций в секунду и задержек p50, p90, p99 и
+значения всех повторов, а compare сравнивает два таких файла и находит
+замедления.
+
+Запуск: python harness.py run --sizes 1000 100000 --repeat 5 --output new.json
+        python harness.py compare old.json new.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from banking import CONNECTION_PROFILES, Card, connect_db, migrate
+from timing import PERCENTILES, percentile, timed
+
+METRICS = ('ops_per_sec',) + tuple(f'{name}_us' for name, _ in PERCENTILES)
+
+
+def measure(work, arguments) -> dict:
+    """Вызывает work для каждого аргумента и возвращает его замеры."""
+    latencies = timed(work, arguments)
+    result = {'ops_per_sec': len(latencies) / sum(latencies)}
+    for name, fraction in PERCENTILES:
+        result[f'{name}_us'] = percentile(latencies, fraction) * 1e6
+    return result
+
+
+def run_size(size: int, operations: int, profile: str, seed: int) -> dict:
+    """
+    Выпускает size карт в новой базе и замеряет operations вызовов
+    каждой операции. Баланс читается, как при входе, - заново из базы;
+    закрываются карты, выпущенные замером create.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        connect = connect_db(os.path.join(directory, 'card.s3db'), profile)
+        migrate(connect)
+        cursor = connect.cursor()
+        issued = Card.issue_many(connect, cursor, size)
+
+        def sample():
+            return [issued[rng.randrange(size)] for _ in range(operations)]
+
+        created = []
+        result = {
+            'create': measure(lambda _: created.append(Card(connect, cursor)),
+                              range(operations)),
+            'login': measure(lambda card: Card.check_card(connect, cursor,
+                                                          *card), sample()),
+            'balance': measure(lambda card: Card.check_card(
+                connect, cursor, card[0]).balance, sample()),
+        }
+        cards = [Card.check_card(connect, cursor, number)
+                 for number, _ in sample()]
+        result['income'] = measure(lambda card: card.update_balance(10),
+                                   cards)
+        # Пополнение уже положило на каждую карту больше, чем спишет
+        # перевод
+        result['transfer'] = measure(
+            lambda pair: pair[0].transfer_to(pair[1], 1),
+            list(zip(cards, reversed(cards))))
+        result['close'] = measure(Card.delete_card, created)
+        cursor.close()
+        connect.close()
+    return result
+
+
+def combine(runs: list) -> dict:
+    """
+    Сводит повторы замера: у каждой операции медианы замеров и в runs
+    значения всех повторов.
+    """
+    result = {}
+    for operation in runs[0]:
+        values = {metric: [run[operation][metric] for run in runs]
+                  for metric in METRICS}
+        result[operation] = {metric: statistics.median(samples)
+                             for metric, samples in values.items()}
+        result[operation]['runs'] = values
+    return result
+
+
+def run(sizes: list, operations: int, profile: str, seed: int,
+        repeat: int) -> dict:
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'profile': profile,
+        'operations': operations,
+        'repeat': repeat,
+        'sizes': {},
+    }
+    for size in sizes:
+        report['sizes'][str(size)] = combine(
+            [run_size(size, operations, profile, seed)
+             for _ in range(repeat)])
+    return report
+
+
+def print_report(report: dict) -> None:
+    for size, results in report['sizes'].items():
+        print(f'{size} cards:')
+        for operation, values in results.items():
+            print(f"{operation:>10}: {values['ops_per_sec']:10.0f} ops/sec, "
+                  + ', '.join(f'{name} {values[name + "_us"]:8.1f} us'
+                              for name, _ in PERCENTILES))
+
+
+def samples(values: dict, metric: str) -> list:
+    """Значения замера во всех повторах; в отчете без повторов - одно."""
+    return values.get('runs', {}).get(metric, [values[metric]])
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """
+    Сравнивает операции, замеренные в обоих отчетах на базах одного
+    размера, печатает отношения медиан и возвращает замедления. Замедление -
+    это медиана операций в секунду меньше или медиана p99 больше чем
+    на threshold, причем повторы не пересекаются: лучший повтор нового
+    отчета хуже худшего повтора старого. Иначе разница - шум.
+    """
+    for key in ('profile', 'python', 'sqlite'):
+        if old.get(key) != new.get(key):
+            print(f'warning: {key} differs: {old.get(key)} -> {new.get(key)}',
+                  file=sys.stderr)
+    regressions = []
+    for size, results in new['sizes'].items():
+        baseline = old['sizes'].get(size)
+        if baseline is None:
+            continue
+        print(f'{size} cards:')
+        for operation, values in results.items():
+            before = baseline.get(operation)
+            if before is None:
+                continue
+            rate = values['ops_per_sec'] / before['ops_per_sec']
+            tail = values['p99_us'] / before['p99_us']
+            slower = (
+                rate < 1 - threshold
+                and max(samples(values, 'ops_per_sec'))
+                < min(samples(before, 'ops_per_sec'))
+                or tail > 1 + threshold
+                and min(samples(values, 'p99_us'))
+                > max(samples(before, 'p99_us')))
+            if slower:
+                regressions.append((size, operation, rate, tail))
+            print(f'{operation:>10}: ops/sec x{rate:5.2f}, p99 x{tail:5.2f}'
+                  + ('  REGRESSION' if slower else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    measure_runs = commands.add_parser('run', help='Measure every operation')
+    measure_runs.add_argument('--sizes', type=int, nargs='+',
+                              default=[1000, 100000])
+    measure_runs.add_argument('--operations', type=int, default=1000)
+    measure_runs.add_argument('--profile', choices=CONNECTION_PROFILES,
+                              default='safe')
+    measure_runs.add_argument('--seed', type=int, default=0)
+    measure_runs.add_argument('--repeat', type=int, default=5,
+                              help='runs per size, the report keeps medians')
+    measure_runs.add_argument('--output', default=None,
+                              help='write the results to this JSON file')
+
+    check = commands.add_parser('compare',
+                                help='Compare two result files')
+    check.add_argument('old')
+    check.add_argument('new')
+    check.add_argument('--threshold', type=float, default=0.1,
+                       help='allowed slowdown, 0.1 is 10%%')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run(args.sizes, args.operations, args.profile, args.seed,
+                     args.repeat)
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+    elif args.command == 'compare':
+        with open(args.old) as old, open(args.new) as new:
+            regressions = compare(json.load(old), json.load(new),
+                                  args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Нагрузочный клиент для server.py: открывает много сессий и замеряет
+задержку запросов.
+
+Запуск: python loadgen.py --sessions 1000 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from timing import PERCENTILES, percentile
+
+
+class Client:
+    """Одна сессия с сервером, запоминает задержку каждого запроса."""
+
+    def __init__(self, reader, writer, latencies: list) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.latencies = latencies
+
+    async def request(self, command: str, **params) -> dict:
+        start = time.perf_counter()
+        self.writer.write(json.dumps(dict(params, command=command)).encode()
+                          + b'\n')
+        response = json.loads(await self.reader.readline())
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+
+async def run_session(host: str, port: int, requests: int, numbers: list,
+                      latencies: list) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    client = Client(reader, writer, latencies)
+
+    card = await client.request('create')
+    numbers.append(card['number'])
+    await client.request('login', number=card['number'], pin=card['pin'])
+    await client.request('income', amount=1000)
+    for _ in range(requests):
+        choice = random.random()
+        if choice < 0.5:
+            await client.request('balance')
+        elif choice < 0.75:
+            await client.request('income', amount=10)
+        else:
+            await client.request('transfer', target=random.choice(numbers),
+                                 amount=1)
+
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run(host: str, port: int, sessions: int, requests: int) -> None:
+    latencies = []
+    numbers = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_session(host, port, requests, numbers,
+                                       latencies)
+                           for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f'{len(latencies)} requests from {sessions} sessions '
+          f'in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/sec)')
+    for name, fraction in PERCENTILES:
+        print(f'{name}: {percentile(latencies, fraction) * 1000:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.host, args.port, args.sessions, args.requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import threading
+from secrets import randbits
+
+from banking import (AccountPermutation, TransactionError,
+                     check_transfer_amount)
+
+
+class MemoryStorage:
+    """
+    Хранилище карт в словаре процесса: номер -> (PIN, баланс). Данные
+    живут до завершения процесса, журнала изменений нет. Операции
+    выполняются под одной блокировкой, пакетные - целиком, поэтому
+    внешних транзакций не бывает.
+
+    Хранилище передается в Card вместо соединения, поэтому у него есть
+    и настройки карт: кэш, фильтр и хешер PIN.
+    """
+
+    in_transaction = False
+
+    def __init__(self, key: int = None) -> None:
+        self.cards = {}
+        self.card_cache = None
+        self.card_filter = None
+        self.pin_hasher = None
+        # Ключ перестановки и счетчик выданных номеров счетов
+        self.key = randbits(62) if key is None else key
+        self.next_value = 0
+        self.__permutation = AccountPermutation(self.key)
+        self.__lock = threading.Lock()
+
+    def accounts(self, count: int) -> list:
+        with self.__lock:
+            start = self.next_value
+            self.next_value += count
+        return list(map(self.__permutation.account,
+                        range(start, start + count)))
+
+    def get(self, number: str):
+        return self.cards.get(number)
+
+    def get_many(self, numbers) -> dict:
+        cards = self.cards
+        return {number: cards[number] for number in numbers
+                if number in cards}
+
+    def verify_pin(self, number: str, code: str):
+        entry = self.cards.get(number)
+        return entry if entry is not None and entry[0] == code else None
+
+    def insert(self, number: str, code: str, balance: int) -> bool:
+        with self.__lock:
+            if number in self.cards:
+                return False
+            self.cards[number] = (code, balance)
+            return True
+
+    def insert_many(self, rows) -> list:
+        inserted = []
+        with self.__lock:
+            for number, code, balance in rows:
+                if number not in self.cards:
+                    self.cards[number] = (code, balance)
+                    inserted.append((number, code, balance))
+        return inserted
+
+    def __apply(self, number: str, money: int, check_funds: bool):
+        entry = self.cards.get(number)
+        if entry is None:
+            return None
+        balance = entry[1] + money
+        if check_funds and balance < 0:
+            return None
+        self.cards[number] = (entry[0], balance)
+        return balance
+
+    def apply_delta(self, number: str, money: int,
+                    check_funds: bool = False):
+        with self.__lock:
+            return self.__apply(number, money, check_funds)
+
+    def apply_many(self, changes) -> list:
+        with self.__lock:
+            return [self.__apply(number, money, check_funds)
+                    for number, money, check_funds in changes]
+
+    def transfer(self, source: str, target: str, money: int) -> tuple:
+        check_transfer_amount(money)
+        with self.__lock:
+            entry = self.cards.get(source)
+            if entry is None or entry[1] < money:
+                raise TransactionError("Not enough money!")
+            if target not in self.cards:
+                raise TransactionError("Such a card does not exist.")
+            return (self.__apply(source, -money, False),
+                    self.__apply(target, money, False))
+
+    def delete(self, number: str):
+        with self.__lock:
+            entry = self.cards.pop(number, None)
+        return None if entry is None else entry[1]
+
+    def replace_pin(self, number: str, old: str, new: str) -> bool:
+        with self.__lock:
+            entry = self.cards.get(number)
+            if entry is None or entry[0] != old:
+                return False
+            self.cards[number] = (new, entry[1])
+            return True
@@ -0,0 +1,87 @@
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHM = 'pbkdf2_sha256'
+
+
+def _encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+
+def _digest(code: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', code.encode(), salt, iterations)
+
+
+def pin_matches(code: str, stored: str) -> bool:
+    """
+    Проверяет PIN по хешу или по PIN, записанному без хеша. Стоимость
+    и соль записаны в самом хеше, поэтому хешер для проверки не нужен.
+    """
+    if not PinHasher.is_hashed(stored):
+        return hmac.compare_digest(code.encode(), stored.encode())
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        expected = base64.b64decode(digest, validate=True)
+        actual = _digest(code, base64.b64decode(salt, validate=True),
+                         int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+class PinHasher:
+    """
+    Хеширует PIN с солью через PBKDF2-SHA256. Стоимость задает
+    iterations, она сохраняется в самом хеше, поэтому хеши с прежней
+    стоимостью продолжают проверяться. PIN без хеша, записанные до
+    появления хешера, сравниваются как есть.
+
+    hashlib считает PBKDF2 без GIL, поэтому hash_many и методы *_async
+    раскладывают вычисления по потокам workers на разные ядра.
+    """
+
+    def __init__(self, iterations: int = 100000, workers: int = None,
+                 salt_size: int = 16) -> None:
+        if iterations < 1:
+            raise ValueError(f"iterations must be positive: {iterations}")
+        self.iterations = iterations
+        self.salt_size = salt_size
+        self.executor = ThreadPoolExecutor(workers or os.cpu_count(),
+                                           thread_name_prefix='pin-kdf')
+
+    @staticmethod
+    def is_hashed(stored: str) -> bool:
+        return stored.startswith(ALGORITHM + '$')
+
+    def hash(self, code: str) -> str:
+        """Возвращает хеш PIN в виде pbkdf2_sha256$стоимость$соль$хеш."""
+        salt = os.urandom(self.salt_size)
+        digest = _digest(code, salt, self.iterations)
+        return f'{ALGORITHM}${self.iterations}${_encode(salt)}${_encode(digest)}'
+
+    def hash_many(self, codes) -> list:
+        """Хеширует набор PIN параллельно в потоках хешера."""
+        return list(self.executor.map(self.hash, codes))
+
+    def verify(self, code: str, stored: str) -> bool:
+        """Проверяет PIN по хешу или по PIN, записанному без хеша."""
+        return pin_matches(code, stored)
+
+    def verify_async(self, code: str, stored: str):
+        """Проверяет PIN в потоке хешера, возвращает Future с результатом."""
+        return self.executor.submit(self.verify, code, stored)
+
+    def hash_async(self, code: str):
+        """Хеширует PIN в потоке хешера, возвращает Future с хешем."""
+        return self.executor.submit(self.hash, code)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """PIN записан без хеша или с другой стоимостью."""
+        return (not self.is_hashed(stored)
+                or stored.split('$')[1] != str(self.iterations))
+
+    def close(self) -> None:
+        self.executor.shutdown()
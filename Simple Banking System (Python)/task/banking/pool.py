@@ -0,0 +1,135 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    Пул соединений для нескольких потоков: до readers соединений для
+    чтения и одно соединение для записи, которое выдается по очереди.
+    В режиме WAL чтение идет параллельно с записью. factory открывает
+    соединение и должна разрешать его использование из других потоков
+    (check_same_thread=False): пул выдает соединение только одному
+    потоку за раз. timeout - сколько секунд ждать свободного
+    соединения до TimeoutError, None - без ограничения.
+    """
+
+    def __init__(self, factory, readers: int = 4,
+                 timeout: float = None) -> None:
+        self.factory = factory
+        self.readers = readers
+        self.timeout = timeout
+        # Свободные соединения для чтения, последнее возвращенное
+        # выдается первым
+        self.__idle = []
+        self.__created = 0
+        self.__available = threading.Condition()
+        self.__writer = None
+        self.__writer_lock = threading.Lock()
+        # Кэш и фильтр карт и хешер PIN, общие для всех соединений пула
+        self.card_cache = None
+        self.card_filter = None
+        self.pin_hasher = None
+        self.__stats_lock = threading.Lock()
+        self.__stats = {
+            'reader_checkouts': 0,
+            'reader_waits': 0,
+            'reader_wait_time': 0.0,
+            'readers_in_use': 0,
+            'readers_peak': 0,
+            'writer_checkouts': 0,
+            'writer_waits': 0,
+            'writer_wait_time': 0.0,
+        }
+
+    def __acquire_reader(self):
+        start = None
+        with self.__available:
+            while not self.__idle and self.__created >= self.readers:
+                # Все соединения заняты: пул насыщен, ждем возврата
+                # соединения или освобождения места
+                if start is None:
+                    start = time.perf_counter()
+                remaining = (None if self.timeout is None else
+                             self.timeout - (time.perf_counter() - start))
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No free connection in the pool.")
+                self.__available.wait(remaining)
+            waited = 0.0 if start is None else time.perf_counter() - start
+            if self.__idle:
+                return self.__idle.pop(), waited
+            self.__created += 1
+        try:
+            return self.factory(), waited
+        except BaseException:
+            # Место несозданного соединения снова свободно
+            with self.__available:
+                self.__created -= 1
+                self.__available.notify()
+            raise
+
+    def __release_reader(self, connect) -> None:
+        with self.__available:
+            self.__idle.append(connect)
+            self.__available.notify()
+
+    @contextmanager
+    def reader(self):
+        """Выдает соединение для чтения и возвращает его в пул."""
+        connect, waited = self.__acquire_reader()
+        with self.__stats_lock:
+            stats = self.__stats
+            stats['reader_checkouts'] += 1
+            stats['reader_waits'] += waited > 0
+            stats['reader_wait_time'] += waited
+            stats['readers_in_use'] += 1
+            stats['readers_peak'] = max(stats['readers_peak'],
+                                        stats['readers_in_use'])
+        try:
+            yield connect
+        finally:
+            if connect.in_transaction:
+                connect.rollback()
+            with self.__stats_lock:
+                self.__stats['readers_in_use'] -= 1
+            self.__release_reader(connect)
+
+    @contextmanager
+    def writer(self):
+        """Выдает единственное соединение для записи на время блока."""
+        waited = 0.0
+        if not self.__writer_lock.acquire(blocking=False):
+            start = time.perf_counter()
+            if not self.__writer_lock.acquire(
+                    timeout=-1 if self.timeout is None else self.timeout):
+                raise TimeoutError("No free connection in the pool.")
+            waited = time.perf_counter() - start
+        try:
+            if self.__writer is None:
+                self.__writer = self.factory()
+            with self.__stats_lock:
+                stats = self.__stats
+                stats['writer_checkouts'] += 1
+                stats['writer_waits'] += waited > 0
+                stats['writer_wait_time'] += waited
+            yield self.__writer
+        finally:
+            self.__writer_lock.release()
+
+    def stats(self) -> dict:
+        """Счетчики выдачи соединений, ожиданий и занятости пула."""
+        with self.__stats_lock:
+            stats = dict(self.__stats)
+        stats['readers_open'] = self.__created
+        stats['saturation'] = stats['readers_peak'] / self.readers
+        return stats
+
+    def close(self) -> None:
+        """Закрывает свободные соединения и соединение для записи."""
+        with self.__available:
+            while self.__idle:
+                self.__idle.pop().close()
+        with self.__writer_lock:
+            if self.__writer is not None:
+                self.__writer.close()
+                self.__writer = None
@@ -0,0 +1,144 @@
+"""
+Сверка балансов карт с журналом ledger: баланс каждой карты должен
+быть равен сумме ее записей в журнале, а у удаленных карт сумма
+записей равна нулю.
+
+Карты и журнал читаются параллельно по возрастанию номера пачками
+fetchmany и сливаются, как отсортированные списки, поэтому память
+не зависит от размера базы. Диапазоны номеров можно сверять
+в отдельных процессах.
+"""
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import groupby
+from urllib.parse import quote
+
+from banking import BankConnection, STATEMENT_CACHE_SIZE, execute
+
+
+def connect_readonly(path: str) -> BankConnection:
+    """
+    Открывает базу только для чтения и без PRAGMA профилей, которые
+    меняют файл: сверка не мешает серверу и другим процессам, какой
+    бы режим журнала ни был у базы.
+    """
+    connect = sqlite3.connect(
+        f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True,
+        factory=BankConnection, cached_statements=STATEMENT_CACHE_SIZE)
+    connect.execute('PRAGMA busy_timeout = 5000')
+    return connect
+
+
+def _stream(cursor, query: str, parameters: tuple, chunk_size: int):
+    """Строки запроса из реестра с номером карты в виде числа."""
+    execute(cursor, query, parameters)
+    while chunk := cursor.fetchmany(chunk_size):
+        for number, value in chunk:
+            yield int(number), value
+
+
+def _ledger_totals(cursor, low: int, high: int, chunk_size: int):
+    """Сумма записей журнала по каждой карте диапазона."""
+    entries = _stream(cursor, 'ledger_range_scan', (low, high), chunk_size)
+    for number, group in groupby(entries, key=lambda entry: entry[0]):
+        yield number, sum(amount for _, amount in group)
+
+
+def reconcile_range(path: str, low: int, high: int,
+                    chunk_size: int = 10000, limit: int = 100) -> dict:
+    """
+    Сверяет карты с номерами [low, high), возвращает счетчики и не
+    больше limit расхождений (номер, баланс, сумма по журналу);
+    баланс None - карты нет, а сумма ее записей не нулевая.
+    Номера карт должны быть одной длины, как у выпущенных системой:
+    в раскладке text карты упорядочены как строки.
+    """
+    connect = connect_readonly(path)
+    card_cursor = connect.cursor()
+    ledger_cursor = connect.cursor()
+    result = {'cards': 0, 'entries_total': 0, 'mismatches': 0,
+              'examples': []}
+
+    def mismatch(number, balance, total) -> None:
+        result['mismatches'] += 1
+        if len(result['examples']) < limit:
+            result['examples'].append((str(number), balance, total))
+
+    # Оба курсора читают один снимок базы
+    connect.execute('BEGIN')
+    try:
+        cards = _stream(card_cursor, 'card_range_scan', (low, high),
+                        chunk_size)
+        totals = _ledger_totals(ledger_cursor, low, high, chunk_size)
+        card = next(cards, None)
+        total = next(totals, None)
+        while card is not None or total is not None:
+            if total is None or card is not None and card[0] < total[0]:
+                result['cards'] += 1
+                if card[1] != 0:
+                    mismatch(card[0], card[1], 0)
+                card = next(cards, None)
+            elif card is None or total[0] < card[0]:
+                result['entries_total'] += total[1]
+                if total[1] != 0:
+                    mismatch(total[0], None, total[1])
+                total = next(totals, None)
+            else:
+                result['cards'] += 1
+                result['entries_total'] += total[1]
+                if card[1] != total[1]:
+                    mismatch(card[0], card[1], total[1])
+                card = next(cards, None)
+                total = next(totals, None)
+    finally:
+        connect.rollback()
+        card_cursor.close()
+        ledger_cursor.close()
+        connect.close()
+    return result
+
+
+def number_ranges(path: str, parts: int) -> list:
+    """Делит номера карт и записей журнала на parts равных диапазонов."""
+    connect = connect_readonly(path)
+    bounds = [int(value)
+              for table in ('card', 'ledger')
+              for value in connect.execute(
+                  f'SELECT min(number), max(number) FROM {table}').fetchone()
+              if value is not None]
+    connect.close()
+    if not bounds:
+        return []
+    low, high = min(bounds), max(bounds) + 1
+    edges = [low + (high - low) * part // parts for part in range(parts + 1)]
+    return [(start, end) for start, end in zip(edges, edges[1:])
+            if start < end]
+
+
+def reconcile(path: str, workers: int = 1, parts: int = None,
+              chunk_size: int = 10000, limit: int = 100) -> dict:
+    """
+    Сверяет всю базу по parts диапазонам номеров в workers процессах
+    и объединяет результаты.
+    """
+    ranges = number_ranges(path, parts or workers)
+    lows = [low for low, _ in ranges]
+    highs = [high for _, high in ranges]
+    check = partial(reconcile_range, path, chunk_size=chunk_size,
+                    limit=limit)
+    if workers > 1 and len(ranges) > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(check, lows, highs))
+    else:
+        results = list(map(check, lows, highs))
+
+    report = {'cards': 0, 'entries_total': 0, 'mismatches': 0,
+              'examples': []}
+    for result in results:
+        for key in ('cards', 'entries_total', 'mismatches'):
+            report[key] += result[key]
+        report['examples'].extend(result['examples'])
+    del report['examples'][limit:]
+    return report
@@ -0,0 +1,115 @@
+"""
+Компактные представления карт для массовой обработки, без ссылок
+на соединение с базой.
+"""
+from array import array
+from bisect import bisect_left
+from typing import NamedTuple
+
+from banking import checkout, execute
+
+
+class CardRecord(NamedTuple):
+    """Неизменяемая запись о карте без __dict__ и ссылок на базу."""
+
+    number: str
+    pin: str
+    balance: int
+
+    @classmethod
+    def load_many(cls, connect, cursor=None, chunk_size: int = 10000):
+        """Читает все карты в порядке номеров пачками по chunk_size."""
+        with checkout(connect, cursor) as (reader, reader_cursor):
+            execute(reader_cursor, 'card_scan')
+            while chunk := reader_cursor.fetchmany(chunk_size):
+                yield from map(cls._make, chunk)
+
+
+class LedgerEntry(NamedTuple):
+    """
+    Запись журнала ledger: kind - open, income, transfer или close,
+    amount - изменение баланса, balance - баланс после изменения,
+    counterparty - вторая карта перевода, created - время в секундах.
+    """
+
+    id: int
+    kind: str
+    amount: int
+    balance: int
+    counterparty: str
+    created: int
+
+    @classmethod
+    def page(cls, connect, number: str, before: int = None,
+             limit: int = 100, cursor=None) -> list:
+        """
+        Возвращает до limit записей по карте от новых к старым. Следующая
+        страница начинается с before=id последней записи: поиск по
+        индексу (number, id) не перебирает пропущенные записи, как
+        OFFSET, и не зависит от длины истории.
+        """
+        with checkout(connect, cursor) as (reader, reader_cursor):
+            if before is None:
+                execute(reader_cursor, 'ledger_first_page', (number, limit))
+            else:
+                execute(reader_cursor, 'ledger_page', (number, before, limit))
+            return list(map(cls._make, reader_cursor.fetchall()))
+
+    @classmethod
+    def history(cls, connect, number: str, page_size: int = 1000,
+                cursor=None):
+        """Перебирает всю историю карты от новых записей к старым."""
+        before = None
+        while entries := cls.page(connect, number, before, page_size, cursor):
+            yield from entries
+            before = entries[-1].id
+
+
+class CardTable:
+    """
+    Карты в колонках array: номера и балансы хранятся как 64-битные
+    числа, без отдельного объекта на карту. Строки упорядочены по
+    номеру, если добавлялись по возрастанию, как при load.
+    """
+
+    def __init__(self) -> None:
+        self.numbers = array('q')
+        self.balances = array('q')
+
+    @classmethod
+    def load(cls, connect, cursor=None, chunk_size: int = 10000):
+        """Загружает номера и балансы всех карт."""
+        table = cls()
+        with checkout(connect, cursor) as (reader, reader_cursor):
+            execute(reader_cursor, 'card_scan')
+            while chunk := reader_cursor.fetchmany(chunk_size):
+                table.numbers.extend(int(row[0]) for row in chunk)
+                table.balances.extend(row[2] for row in chunk)
+        return table
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def __getitem__(self, index: int) -> CardRecord:
+        return CardRecord(str(self.numbers[index]), None,
+                          self.balances[index])
+
+    def append(self, number: str, balance: int) -> None:
+        self.numbers.append(int(number))
+        self.balances.append(balance)
+
+    def find(self, number: str):
+        """Ищет карту двоичным поиском, возвращает ее индекс или None."""
+        value = int(number)
+        index = bisect_left(self.numbers, value)
+        if index < len(self.numbers) and self.numbers[index] == value:
+            return index
+        return None
+
+    def total_balance(self) -> int:
+        return sum(self.balances)
+
+    def memory_bytes(self) -> int:
+        """Память под данные колонок."""
+        return sum(column.itemsize * len(column)
+                   for column in (self.numbers, self.balances))
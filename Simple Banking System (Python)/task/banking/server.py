@@ -0,0 +1,245 @@
+"""
+Сетевой интерфейс банковской системы на asyncio.
+
+Протокол: по одному JSON-объекту в строке в обе стороны. Запрос
+содержит поле command (create, login, balance, income, transfer,
+close, logout, stats) и параметры команды, ответ - поле ok и результат
+или текст ошибки в поле error. Каждое TCP-соединение - отдельная
+сессия со своей картой.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from banking import Card, TransactionError, connect_db
+from pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая длина строки запроса в байтах
+REQUEST_LIMIT = 1 << 16
+
+
+class Session:
+    """Состояние одного клиента: номер карты после входа."""
+
+    def __init__(self) -> None:
+        self.number = None
+
+
+class BankServer:
+    """
+    Обслуживает сессии в одном процессе. Работа с базой выполняется
+    в пуле из workers потоков, соединения берутся из общего пула.
+    """
+
+    def __init__(self, path: str = 'card.s3db', profile: str = 'wal',
+                 workers: int = 8, cache=None, card_filter=None,
+                 pin_hasher=None) -> None:
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='bank-db')
+        self.pool = ConnectionPool(
+            partial(connect_db, path, profile, check_same_thread=False),
+            readers=workers)
+        self.pool.card_cache = cache
+        self.pool.card_filter = card_filter
+        self.pool.pin_hasher = pin_hasher
+        self.commands = {
+            'create': self.__create,
+            'balance': self.__balance,
+            'income': self.__add_income,
+            'transfer': self.__do_transfer,
+            'close': self.__close_account,
+            'logout': self.__logout,
+            'stats': self.__stats,
+        }
+
+    def __card(self, session: Session) -> Card:
+        if session.number is None:
+            raise TransactionError("You are not logged in!")
+        card = Card.check_card(self.pool, None, session.number)
+        if card is None:
+            session.number = None
+            raise TransactionError("Such a card does not exist.")
+        return card
+
+    def __create(self, session: Session, request: dict) -> dict:
+        card = Card(self.pool, None)
+        return {'number': card.number, 'pin': card.code}
+
+    def __logout(self, session: Session, request: dict) -> dict:
+        session.number = None
+        return {}
+
+    def __balance(self, session: Session, request: dict) -> dict:
+        return {'balance': self.__card(session).balance}
+
+    @staticmethod
+    def __amount(request: dict) -> int:
+        """Сумма из запроса: целое число больше нуля."""
+        amount = request.get('amount')
+        if isinstance(amount, str) and amount.strip().isdecimal():
+            amount = int(amount)
+        if (isinstance(amount, bool) or not isinstance(amount, int)
+                or amount <= 0):
+            raise TransactionError("Amount must be a positive integer.")
+        return amount
+
+    def __add_income(self, session: Session, request: dict) -> dict:
+        amount = self.__amount(request)
+        card = self.__card(session)
+        card.update_balance(amount)
+        return {'balance': card.balance}
+
+    def __do_transfer(self, session: Session, request: dict) -> dict:
+        amount = self.__amount(request)
+        card = self.__card(session)
+        number = str(request.get('target', ''))
+        # Те же проверки, что и в меню SimpleBankingSystem
+        if number == card.number:
+            raise TransactionError(
+                "You can't transfer money to the same account!")
+        elif not Card.validate_many([number])[0]:
+            raise TransactionError(
+                "Probably you made a mistake in the card number. "
+                "Please try again!")
+        transfer_card = Card.check_card(self.pool, None, number)
+        if transfer_card is None:
+            raise TransactionError("Such a card does not exist.")
+        card.transfer_to(transfer_card, amount)
+        return {'balance': card.balance}
+
+    def __close_account(self, session: Session, request: dict) -> dict:
+        self.__card(session).delete_card()
+        session.number = None
+        return {}
+
+    def __stats(self, session: Session, request: dict) -> dict:
+        stats = {'pool': self.pool.stats()}
+        if self.pool.card_cache is not None:
+            stats['cache'] = self.pool.card_cache.stats()
+        if self.pool.card_filter is not None:
+            stats['filter'] = self.pool.card_filter.stats()
+        return stats
+
+    def execute(self, session: Session, request: dict) -> dict:
+        """Выполняет запрос в потоке пула и формирует ответ."""
+        command = self.commands.get(request.get('command'))
+        try:
+            if command is None:
+                raise TransactionError(
+                    f"Unknown command: {request.get('command')}")
+            response = command(session, request)
+        except (TransactionError, KeyError, TypeError, ValueError) as e:
+            return {'ok': False, 'error': str(e)}
+        response['ok'] = True
+        return response
+
+    async def login(self, session: Session, request: dict) -> dict:
+        """
+        Вход в сессию. Карта ищется в потоке пула, а хеш PIN считается
+        в потоках хешера, чтобы вход не занимал ни цикл событий, ни
+        потоки, которые работают с базой.
+        """
+        loop = asyncio.get_running_loop()
+        number, code = request.get('number'), request.get('pin')
+        card = None
+        if code and number is not None:
+            number = str(number)
+            code = str(code)
+            card = await loop.run_in_executor(
+                self.executor, Card.check_card, self.pool, None, number)
+
+        hasher = self.pool.pin_hasher
+        if card is None:
+            valid = False
+        elif hasher is None:
+            valid = card.verify_pin(code)
+        else:
+            valid = await asyncio.wrap_future(
+                hasher.verify_async(code, card.stored_code))
+            if valid and hasher.needs_rehash(card.stored_code):
+                stored_code = await asyncio.wrap_future(
+                    hasher.hash_async(code))
+                await loop.run_in_executor(self.executor, card.store_pin,
+                                           stored_code)
+
+        if not valid:
+            return {'ok': False, 'error': "Wrong card number or PIN!"}
+        session.number = card.number
+        return {'ok': True}
+
+    async def respond(self, session: Session, line: bytes) -> dict:
+        """Ответ на одну строку запроса."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request = None
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'Malformed request'}
+        try:
+            if request.get('command') == 'login':
+                return await self.login(session, request)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.execute, session, request)
+        except sqlite3.Error as e:
+            # Например, database is locked: сессия продолжает работу
+            logger.warning('Database error: %s', e)
+            return {'ok': False, 'error': f'Database error: {e}'}
+
+    @staticmethod
+    async def __send(writer, response: dict) -> None:
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer) -> None:
+        """Обслуживает одно TCP-соединение до его закрытия."""
+        session = Session()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Строка длиннее REQUEST_LIMIT: ее остаток не отделить
+                    # от следующих запросов, поэтому соединение закрывается
+                    await self.__send(writer, {
+                        'ok': False, 'error': 'Request is too long'})
+                    break
+                if not line:
+                    break
+                await self.__send(writer, await self.respond(session, line))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765) -> None:
+        """Принимает соединения, пока задачу не отменят."""
+        server = await asyncio.start_server(self.handle, host, port,
+                                            limit=REQUEST_LIMIT,
+                                            backlog=4096)
+        logger.info('Serving on %s:%s', host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        logger.info('Connection pool stats: %s', self.pool.stats())
+        self.pool.close()
+
+
+def run_server(path: str, profile: str, host: str, port: int,
+               workers: int, cache=None, card_filter=None,
+               pin_hasher=None) -> None:
+    """Запускает сервер до прерывания с клавиатуры."""
+    bank = BankServer(path, profile, workers, cache, card_filter, pin_hasher)
+    print(f'Serving on {host}:{port}')
+    try:
+        asyncio.run(bank.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bank.close()
@@ -0,0 +1,291 @@
+"""
+Хранение карт в нескольких файлах базы. Номера счетов делятся на
+равные диапазоны, у каждого диапазона свой файл со своей блокировкой
+записи, поэтому записи в разные файлы идут параллельно.
+"""
+import itertools
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from banking import (AccountPermutation, Card, CardNumberAllocator,
+                     TransactionError, change_balance, check_transfer_amount,
+                     checkout, connect_db, execute, immediate_transaction,
+                     migrate)
+from pool import ConnectionPool
+
+INN = '400000'
+
+# Сколько раз выполняется шаг перевода между файлами, пока файл занят,
+# и пауза перед повтором в секундах (растет с каждой попыткой)
+STEP_ATTEMPTS = 3
+STEP_DELAY = 0.05
+
+
+def connect_shard(path: str, profile: str, account_range: tuple,
+                  **kwargs):
+    """
+    Открывает файл одного диапазона: распределитель соединения выдает
+    только номера счетов из account_range.
+    """
+    connect = connect_db(path, profile, **kwargs)
+    connect.number_allocator = CardNumberAllocator(
+        connect, account_range=account_range)
+    return connect
+
+
+class ShardRouter:
+    """
+    Направляет операции с картами в файл, которому принадлежит номер
+    счета карты. Каждый файл открыт через свой ConnectionPool, карты
+    из check_card и create_card работают со своим пулом, поэтому
+    update_balance и delete_card сами попадают в нужный файл.
+
+    Перевод между файлами выполняется по журналу transfer_log в первом
+    файле: перевод записывается в журнал как prepared, затем деньги
+    списываются в одном файле и зачисляются в другом, каждая запись
+    ledger помечается номером перевода. Шаг, упавший на занятом файле,
+    повторяется; если файл получателя так и не освободился или его
+    нет, перевод отмечается refunding и деньги возвращаются
+    отправителю. Перевод, оставшийся prepared или refunding после сбоя
+    процесса или ошибки на последних шагах, recover доводит до конца
+    или отменяет: он выполняется при открытии, и его можно вызвать
+    в любой момент - переводы, которые еще выполняются, он пропускает.
+    Переводы координирует только один процесс.
+
+    Card.transfer_to у карт из файлов маршрутизатора сам передает
+    перевод в другой файл маршрутизатору.
+    """
+
+    def __init__(self, paths: list, profile: str = 'wal',
+                 readers: int = 4) -> None:
+        self.paths = list(paths)
+        # Начала диапазонов номеров счетов всех файлов по порядку
+        self.__starts = [self.account_range(index)[0]
+                         for index in range(len(self.paths))]
+        self.shards = []
+        for index, path in enumerate(self.paths):
+            shard = ConnectionPool(
+                partial(connect_shard, path, profile,
+                        self.account_range(index), check_same_thread=False),
+                readers)
+            with shard.writer() as connect:
+                migrate(connect)
+            shard.transfer_router = self
+            self.shards.append(shard)
+        self.__next_shard = itertools.count()
+        # Номера переводов между файлами, которые выполняются сейчас
+        self.__active = set()
+        self.__active_lock = threading.Lock()
+        self.recover()
+
+    def account_range(self, index: int) -> tuple:
+        """Номера счетов [начало, конец) файла с номером index."""
+        size = AccountPermutation.SIZE
+        count = len(self.paths)
+        return (size * index // count + 1, size * (index + 1) // count + 1)
+
+    def shard_index(self, number: str):
+        """Номер файла для карты или None, если номер не этой системы."""
+        if (not isinstance(number, str) or len(number) != 16
+                or not number.startswith(INN) or not number.isdecimal()):
+            return None
+        account = int(number[len(INN):-1])
+        if not 1 <= account <= AccountPermutation.SIZE:
+            return None
+        # Те же границы, что и в account_range: обратная формула
+        # ошибается на границах, когда SIZE не делится на число файлов
+        return bisect_right(self.__starts, account) - 1
+
+    def shard_for(self, number: str):
+        """Пул соединений файла, которому принадлежит карта."""
+        index = self.shard_index(number)
+        return None if index is None else self.shards[index]
+
+    def check_card(self, number: str, code=None):
+        shard = self.shard_for(number)
+        if shard is None:
+            return None
+        return Card.check_card(shard, None, number, code)
+
+    def create_card(self, balance: int = 0) -> Card:
+        """Выпускает карту в файлах по очереди."""
+        index = next(self.__next_shard) % len(self.shards)
+        return Card(self.shards[index], None, balance=balance)
+
+    def issue_many(self, count: int, chunk_size: int = 10000) -> list:
+        """
+        Выпускает count карт поровну во все файлы параллельно,
+        возвращает список пар (номер, PIN).
+        """
+        shares = [count // len(self.shards)
+                  + (index < count % len(self.shards))
+                  for index in range(len(self.shards))]
+        with ThreadPoolExecutor(len(self.shards)) as executor:
+            issued = executor.map(
+                lambda shard, share: Card.issue_many(shard, None, share,
+                                                     chunk_size),
+                self.shards, shares)
+            return list(itertools.chain.from_iterable(issued))
+
+    def transfer(self, card: Card, other: Card, money: int) -> None:
+        """
+        Переводит деньги между картами: в одном файле - одной
+        транзакцией, между файлами - через журнал переводов.
+        """
+        check_transfer_amount(money)
+        other_shard = self.shard_for(other.number)
+        if other_shard is None:
+            raise TransactionError("Such a card does not exist.")
+        if self.shard_for(card.number) is other_shard:
+            card.transfer_to(other, money)
+            return
+
+        # recover, прочитавший перевод из журнала, увидит его номер
+        # в __active: номер добавляется под той же блокировкой
+        with self.__active_lock:
+            ref = self.__step(self.__prepare, card.number, other.number,
+                              money)
+            self.__active.add(ref)
+        try:
+            self.__transfer(ref, card, other, money)
+        finally:
+            with self.__active_lock:
+                self.__active.discard(ref)
+
+    def __transfer(self, ref: int, card: Card, other: Card,
+                   money: int) -> None:
+        try:
+            balance = self.__step(self.__apply, card.number, -money, ref,
+                                  'transfer', other.number, check_funds=True)
+        except sqlite3.OperationalError:
+            # Транзакция списания откатилась, денег никто не трогал
+            self.__step(self.__finish, ref, 'aborted')
+            raise
+        if balance is None:
+            self.__step(self.__finish, ref, 'aborted')
+            raise TransactionError("Not enough money!")
+
+        try:
+            other_balance = self.__step(self.__apply, other.number, money,
+                                        ref, 'transfer', card.number)
+        except sqlite3.OperationalError as error:
+            # Файл получателя занят: возврат идет в файл отправителя
+            card.balance = self.__refund(ref, card.number, other.number,
+                                         money)
+            raise TransactionError(
+                "The transfer failed, the money was returned.") from error
+        if other_balance is None:
+            card.balance = self.__refund(ref, card.number, other.number,
+                                         money)
+            raise TransactionError("Such a card does not exist.")
+
+        self.__step(self.__finish, ref, 'committed')
+        card.balance = balance
+        other.balance = other_balance
+
+    def recover(self) -> int:
+        """
+        Завершает переводы между файлами, прерванные сбоем, возвращает
+        их количество. Перевод без списания отменяется, списанный -
+        зачисляется или, если получателя нет, возвращается. Перевод,
+        возврат которого начат, только возвращается: зачисление после
+        возврата создало бы деньги. Выполняющиеся сейчас переводы
+        пропускаются.
+        """
+        with self.shards[0].reader() as connect:
+            pending = execute(connect.cursor(),
+                              'transfer_log_pending').fetchall()
+        # Журнал прочитан раньше: перевод, подготовленный после чтения,
+        # в него не попал, а завершенные с тех пор шаги повторять
+        # безопасно
+        with self.__active_lock:
+            active = set(self.__active)
+        recovered = 0
+        for ref, source, target, amount, state in pending:
+            if ref in active:
+                continue
+            recovered += 1
+            if (state == 'refunding'
+                    or self.__applied(source, ref, 'refund')):
+                self.__refund(ref, source, target, amount)
+            elif not self.__applied(source, ref, 'transfer'):
+                self.__finish(ref, 'aborted')
+            elif self.__apply(target, amount, ref, 'transfer',
+                              source) is not None:
+                self.__finish(ref, 'committed')
+            else:
+                self.__refund(ref, source, target, amount)
+        return recovered
+
+    @staticmethod
+    def __step(step, *args, **kwargs):
+        """
+        Выполняет шаг перевода, повторяя его, пока файл занят. Шаги
+        с номером перевода повторять безопасно: повтор не меняет баланс
+        второй раз.
+        """
+        for attempt in range(1, STEP_ATTEMPTS + 1):
+            try:
+                return step(*args, **kwargs)
+            except sqlite3.OperationalError:
+                if attempt == STEP_ATTEMPTS:
+                    raise
+                time.sleep(STEP_DELAY * attempt)
+
+    def __prepare(self, source: str, target: str, amount: int) -> int:
+        """Записывает перевод в журнал переводов, возвращает его номер."""
+        with checkout(self.shards[0], None, write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                return execute(cursor, 'transfer_log_insert',
+                               (source, target, amount)).lastrowid
+
+    def __refund(self, ref: int, source: str, target: str,
+                 amount: int) -> int:
+        """
+        Возвращает отправителю списанные деньги и отменяет перевод,
+        возвращает баланс отправителя. Состояние refunding записывается
+        до возврата: после сбоя recover перевод только вернет.
+        """
+        self.__step(self.__finish, ref, 'refunding')
+        balance = self.__step(self.__apply, source, amount, ref, 'refund',
+                              target)
+        self.__step(self.__finish, ref, 'aborted')
+        return balance
+
+    def __finish(self, ref: int, state: str) -> None:
+        """Записывает состояние перевода: refunding, committed или aborted."""
+        with checkout(self.shards[0], None, write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                execute(cursor, 'transfer_log_state', (state, ref))
+
+    def __applied(self, number: str, ref: int, kind: str) -> bool:
+        with checkout(self.shard_for(number), None) as (connect, cursor):
+            return execute(cursor, 'ledger_by_ref',
+                           (ref, kind, number)).fetchone() is not None
+
+    def __apply(self, number: str, money: int, ref: int, kind: str,
+                counterparty: str, check_funds: bool = False):
+        """
+        Изменяет баланс в файле карты с записью ledger под номером
+        перевода ref. Повторный вызов не меняет баланс, поэтому шаг
+        можно безопасно повторить при восстановлении.
+        """
+        with checkout(self.shard_for(number), None,
+                      write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                if execute(cursor, 'ledger_by_ref',
+                           (ref, kind, number)).fetchone() is not None:
+                    # Шаг уже выполнен; карту могли удалить после него
+                    row = execute(cursor, 'card_balance',
+                                  (number,)).fetchone()
+                    return row[0] if row else 0
+                return change_balance(cursor, number, money, check_funds,
+                                      kind, counterparty, ref)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
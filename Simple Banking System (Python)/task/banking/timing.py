@@ -0,0 +1,26 @@
+"""
+Замер задержек операций, общий для benchmark.py, harness.py
+и loadgen.py.
+"""
+import time
+
+PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Значение доли fraction в отсортированном списке values."""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(work, arguments) -> list:
+    """
+    Вызывает work для каждого аргумента и возвращает задержки вызовов
+    в секундах по возрастанию.
+    """
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        work(argument)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies
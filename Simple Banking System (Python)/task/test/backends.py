@@ -0,0 +1,47 @@
+"""Хранилища карт и номера для тестов без импорта benchmark.py."""
+import os
+import tempfile
+
+from banking import Card, SQLiteStorage, connect_db, migrate
+from balance_file import MappedStorage
+from engine import LogEngine
+from memory_storage import MemoryStorage
+
+INN = '400000'
+
+
+def synthetic_numbers(count: int):
+    """Генерирует различные валидные номера карт без обращения к базе."""
+    for account in range(1, count + 1):
+        account_number = f'{INN}{account:09d}'
+        yield f'{account_number}{Card.calculate_luhn_checksum(account_number)}'
+
+
+def sqlite_backend(directory: str):
+    connect = connect_db(os.path.join(directory, 'card.s3db'), 'wal')
+    migrate(connect)
+    return SQLiteStorage(connect, connect.cursor())
+
+
+def sqlite_memory_backend(directory: str):
+    connect = connect_db(':memory:')
+    migrate(connect)
+    return SQLiteStorage(connect, connect.cursor())
+
+
+def mapped_backend(directory: str):
+    connect = connect_db(os.path.join(directory, 'card.s3db'), 'wal')
+    migrate(connect)
+    return MappedStorage(connect, os.path.join(directory, 'balances'))
+
+
+# Те же хранилища, что замеряет команда backends в benchmark.py
+BACKENDS = {
+    'sqlite': sqlite_backend,
+    'sqlite-memory': sqlite_memory_backend,
+    'memory': lambda directory: MemoryStorage(),
+    'mapped': mapped_backend,
+    'engine': lambda directory: LogEngine(tempfile.mkdtemp(dir=directory)),
+    'engine-async': lambda directory: LogEngine(
+        tempfile.mkdtemp(dir=directory), durable=False),
+}
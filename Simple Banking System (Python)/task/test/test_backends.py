@@ -0,0 +1,113 @@
+import tempfile
+import unittest
+
+from banking import Card, TransactionError
+
+from .backends import BACKENDS, synthetic_numbers
+
+
+class BackendContractTest(unittest.TestCase):
+    """Все хранилища из BACKENDS ведут себя как SQLiteStorage."""
+
+    def open(self, backend):
+        """Новое хранилище вида backend, закрываемое после теста."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = backend(directory.name)
+        close = getattr(storage, 'close', None)
+        if close is not None:
+            self.addCleanup(close)
+        return storage
+
+    def setUp(self) -> None:
+        self.first, self.second, self.missing = synthetic_numbers(3)
+
+    def test_accounts_are_unique(self):
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                self.assertEqual(len(set(storage.accounts(100))), 100)
+
+    def test_insert_and_get(self):
+        first, second, missing = self.first, self.second, self.missing
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                self.assertTrue(storage.insert(first, '1111', 100))
+                self.assertFalse(storage.insert(first, '2222', 0))
+                self.assertEqual(storage.get(first), ('1111', 100))
+                self.assertIsNone(storage.get(missing))
+                self.assertEqual(storage.verify_pin(first, '1111'),
+                                 ('1111', 100))
+                self.assertFalse(storage.verify_pin(first, '2222'))
+                self.assertEqual(
+                    storage.insert_many([(first, '3333', 0),
+                                         (second, '4444', 0)]),
+                    [(second, '4444', 0)])
+                self.assertEqual(storage.get_many([first, second, missing]),
+                                 {first: ('1111', 100), second: ('4444', 0)})
+
+    def test_balance_changes(self):
+        first, second, missing = self.first, self.second, self.missing
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                storage.insert_many([(first, '1111', 100),
+                                     (second, '4444', 0)])
+                self.assertEqual(storage.apply_delta(first, 50), 150)
+                self.assertIsNone(storage.apply_delta(missing, 50))
+                self.assertIsNone(storage.apply_delta(second, -1,
+                                                      check_funds=True))
+                self.assertEqual(
+                    storage.apply_many([(first, -10, False),
+                                        (second, -1, True),
+                                        (second, 5, False)]),
+                    [140, None, 5])
+
+    def test_transfer(self):
+        first, second, missing = self.first, self.second, self.missing
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                storage.insert_many([(first, '1111', 140),
+                                     (second, '4444', 5)])
+                self.assertEqual(storage.transfer(first, second, 40),
+                                 (100, 45))
+                for target, amount in ((second, 1000), (missing, 10),
+                                       (second, 0), (second, -5)):
+                    with self.assertRaises(TransactionError):
+                        storage.transfer(first, target, amount)
+                self.assertEqual(storage.get(first), ('1111', 100))
+                self.assertEqual(storage.get(second), ('4444', 45))
+
+    def test_replace_pin_and_delete(self):
+        first = self.first
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                storage.insert(first, '1111', 100)
+                self.assertTrue(storage.replace_pin(first, '1111', '5555'))
+                self.assertFalse(storage.replace_pin(first, '1111', '6666'))
+                self.assertEqual(storage.delete(first), 100)
+                self.assertIsNone(storage.delete(first))
+                self.assertIsNone(storage.get(first))
+
+    def test_card_over_storage(self):
+        for name, backend in BACKENDS.items():
+            with self.subTest(backend=name):
+                storage = self.open(backend)
+                other = Card(storage, None)
+                card = Card(storage, None, balance=10)
+                found = Card.check_card(storage, None, card.number, card.code)
+                self.assertIsNotNone(found)
+                self.assertEqual(found.balance, 10)
+                found.transfer_to(Card.check_card(storage, None, other.number),
+                                  3)
+                self.assertEqual(found.balance, 7)
+                self.assertEqual(storage.get(other.number)[1], 3)
+                found.delete_card()
+                self.assertIsNone(Card.check_card(storage, None, card.number))
+
+
+if __name__ == '__main__':
+    unittest.main()
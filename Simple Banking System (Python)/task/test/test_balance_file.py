@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+
+from balance_file import MappedStorage
+from banking import Card, SchemaError, connect_db, execute, migrate
+
+
+class MappedStorageTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'balances')
+        self.other_path = os.path.join(directory.name, 'other')
+        self.connect = connect_db(os.path.join(directory.name, 'card.s3db'))
+        migrate(self.connect)
+        self.addCleanup(self.connect.close)
+
+    def open(self, path=None) -> MappedStorage:
+        storage = MappedStorage(self.connect, path or self.path, capacity=4)
+        self.addCleanup(storage.close)
+        return storage
+
+    def ledger_total(self, number: str) -> int:
+        return self.connect.execute(
+            'SELECT sum(amount) FROM ledger WHERE number = ?',
+            (number,)).fetchone()[0]
+
+    def test_existing_cards_are_attached(self):
+        card = Card(self.connect, None, balance=40)
+        storage = self.open()
+        self.assertEqual(storage.attached, 1)
+        found = Card.check_card(storage, None, card.number, card.code)
+        self.assertIsNotNone(found)
+        self.assertEqual(found.balance, 40)
+
+    def test_cards_survive_reopen_and_growth(self):
+        storage = self.open()
+        cards = [Card(storage, None, balance=index) for index in range(10)]
+        cards[0].update_balance(5)
+        storage.close()
+        storage = self.open()
+        self.assertEqual(storage.attached, 0)
+        self.assertEqual([storage.balance(card.number) for card in cards],
+                         [5] + list(range(1, 10)))
+
+    def test_other_file_is_refused(self):
+        storage = self.open()
+        Card(storage, None, balance=1)
+        with self.assertRaises(SchemaError):
+            MappedStorage(self.connect, self.other_path)
+
+    def test_detach_writes_balances_and_ledger(self):
+        card = Card(self.connect, None, balance=40)
+        storage = self.open()
+        other = Card(storage, None, balance=0)
+        Card.check_card(storage, None, card.number).transfer_to(other, 15)
+        self.assertEqual(storage.detach(), 2)
+        cursor = self.connect.cursor()
+        self.assertEqual(execute(cursor, 'card_slot_count').fetchone()[0], 0)
+        self.assertEqual(Card.check_card(self.connect, cursor,
+                                         card.number).balance, 25)
+        self.assertEqual(self.ledger_total(card.number), 25)
+        self.assertEqual(self.ledger_total(other.number), 15)
+
+    def test_delete_keeps_ledger_balanced(self):
+        card = Card(self.connect, None, balance=40)
+        storage = self.open()
+        found = Card.check_card(storage, None, card.number)
+        found.update_balance(10)
+        found.delete_card()
+        self.assertIsNone(storage.get(card.number))
+        self.assertEqual(self.ledger_total(card.number), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
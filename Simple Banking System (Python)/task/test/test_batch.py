@@ -0,0 +1,114 @@
+import io
+import json
+import unittest
+
+from banking import Card, connect_db, migrate
+from batch import run_batch
+from cache import CardCache
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.connect = connect_db(':memory:')
+        migrate(self.connect)
+        self.cursor = self.connect.cursor()
+        self.addCleanup(self.connect.close)
+
+    def run_lines(self, *lines) -> list:
+        sink = io.StringIO()
+        run_batch(self.connect, self.cursor, io.StringIO(''.join(
+            line + '\n' for line in lines)), sink, 'jsonl', batch_size=10)
+        return [json.loads(line) for line in sink.getvalue().splitlines()]
+
+    def test_bad_lines_fail_alone(self):
+        card = Card(self.connect, self.cursor, balance=100)
+        results = self.run_lines(
+            json.dumps({'op': 'income', 'number': card.number,
+                        'amount': 5}),
+            'not json',
+            '[1, 2]',
+            json.dumps({'op': 'income', 'number': int(card.number),
+                        'amount': 5}),
+            json.dumps({'op': 'transfer', 'number': card.number,
+                        'target': 4000000000000002, 'amount': 1}))
+        self.assertEqual([result['status'] for result in results],
+                         ['ok', 'error', 'error', 'ok', 'error'])
+        self.assertEqual(results[3]['balance'], 110)
+
+    def test_failed_operation_rolls_back_only_itself(self):
+        card = Card(self.connect, self.cursor, balance=100)
+        other = Card(self.connect, self.cursor, balance=0)
+        other.delete_card()
+        results = self.run_lines(
+            json.dumps({'op': 'income', 'number': card.number,
+                        'amount': 5}),
+            json.dumps({'op': 'transfer', 'number': card.number,
+                        'target': other.number, 'amount': 50}))
+        self.assertEqual([result['status'] for result in results],
+                         ['ok', 'error'])
+        self.assertEqual(Card.check_card(self.connect, self.cursor,
+                                         card.number).balance, 105)
+
+    def balance(self, number: str):
+        card = Card.check_card(self.connect, self.cursor, number)
+        return None if card is None else card.balance
+
+    def test_amounts_are_validated(self):
+        card = Card(self.connect, self.cursor, balance=100)
+        results = self.run_lines(*(
+            json.dumps({'op': op, 'number': card.number, 'amount': amount})
+            for op, amount in (('income', -5), ('income', 0),
+                               ('income', 'abc'), ('income', True),
+                               ('income', 1.5), ('income', None),
+                               ('create', -1), ('income', '5'),
+                               ('create', 7))),
+            json.dumps({'op': 'create'}))
+        self.assertEqual([result['status'] for result in results],
+                         ['error'] * 7 + ['ok'] * 3)
+        self.assertEqual(results[0]['error'],
+                         'Amount must be a positive integer.')
+        self.assertEqual(results[8]['balance'], 7)
+        self.assertEqual(results[9]['balance'], 0)
+        self.assertEqual(self.balance(card.number), 105)
+        self.assertEqual(self.balance(results[8]['number']), 7)
+
+    def test_operations_see_earlier_changes_of_batch(self):
+        card = Card(self.connect, self.cursor, balance=10)
+        other = Card(self.connect, self.cursor, balance=0)
+        results = self.run_lines(
+            json.dumps({'op': 'transfer', 'number': card.number,
+                        'target': other.number, 'amount': 8}),
+            json.dumps({'op': 'transfer', 'number': card.number,
+                        'target': other.number, 'amount': 8}),
+            json.dumps({'op': 'close', 'number': other.number}),
+            json.dumps({'op': 'income', 'number': other.number,
+                        'amount': 1}),
+            json.dumps({'op': 'transfer', 'number': card.number,
+                        'target': other.number, 'amount': 1}))
+        self.assertEqual([result.get('error') for result in results],
+                         [None, 'Not enough money!', None,
+                          'Such a card does not exist.',
+                          'Such a card does not exist.'])
+        self.assertEqual(results[0]['balance'], 2)
+        self.assertEqual(results[2]['balance'], 8)
+        self.assertEqual(self.balance(card.number), 2)
+        self.assertIsNone(self.balance(other.number))
+        self.assertEqual(self.connect.execute(
+            'SELECT kind, amount, balance, CAST(counterparty AS TEXT) '
+            'FROM ledger WHERE number = ? ORDER BY id',
+            (other.number,)).fetchall(),
+            [('open', 0, 0, None), ('transfer', 8, 8, card.number),
+             ('close', -8, 0, None)])
+
+    def test_cached_cards_are_refreshed(self):
+        self.connect.card_cache = CardCache()
+        card = Card(self.connect, self.cursor, balance=100)
+        self.assertEqual(self.balance(card.number), 100)
+        self.run_lines(json.dumps({'op': 'income', 'number': card.number,
+                                   'amount': 5}))
+        self.assertEqual(self.balance(card.number), 105)
+
+
+if __name__ == '__main__':
+    unittest.main()
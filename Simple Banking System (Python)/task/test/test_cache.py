@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from functools import partial
+
+from banking import Card, connect_db, migrate
+from cache import CardCache
+from pool import ConnectionPool
+
+
+class CardCacheOrderTest(unittest.TestCase):
+    """Кэш получает балансы в порядке фиксации в базе."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pool = ConnectionPool(
+            partial(connect_db, os.path.join(directory.name, 'card.s3db'),
+                    'wal', check_same_thread=False), 2)
+        self.addCleanup(self.pool.close)
+        with self.pool.writer() as connect:
+            migrate(connect)
+        self.cache = self.pool.card_cache = CardCache()
+        self.card = Card(self.pool, None, balance=100)
+        self.other = Card(self.pool, None)
+
+    def slow_first_write(self, started: threading.Event) -> None:
+        """Первая запись в кэш ждет, пока другой поток изменит карту."""
+        write = self.cache.write
+        calls = []
+
+        def slow_write(*args):
+            if not calls:
+                calls.append(args)
+                started.set()
+                time.sleep(0.2)
+            write(*args)
+
+        self.cache.write = slow_write
+
+    def stored_balance(self, number: str) -> int:
+        self.cache.invalidate(number)
+        return Card.check_card(self.pool, None, number).balance
+
+    def assert_cache_matches_database(self, number: str) -> None:
+        cached = self.cache.get(number)[1]
+        self.assertEqual(cached, self.stored_balance(number))
+
+    def test_concurrent_updates_keep_commit_order(self):
+        started = threading.Event()
+        self.slow_first_write(started)
+        first = threading.Thread(target=self.card.update_balance, args=(1,))
+        first.start()
+        started.wait(5)
+        Card.check_card(self.pool, None, self.card.number).update_balance(2)
+        first.join()
+        self.assertEqual(self.cache.get(self.card.number)[1], 103)
+        self.assert_cache_matches_database(self.card.number)
+
+    def test_concurrent_transfers_keep_commit_order(self):
+        started = threading.Event()
+        self.slow_first_write(started)
+        first = threading.Thread(target=self.card.transfer_to,
+                                 args=(self.other, 10))
+        first.start()
+        started.wait(5)
+        other = Card.check_card(self.pool, None, self.other.number)
+        other.transfer_to(Card.check_card(self.pool, None, self.card.number),
+                          5)
+        first.join()
+        for number in (self.card.number, self.other.number):
+            self.assert_cache_matches_database(number)
+
+    def test_update_racing_delete_does_not_revive_card(self):
+        started = threading.Event()
+        self.slow_first_write(started)
+        first = threading.Thread(target=self.card.update_balance, args=(1,))
+        first.start()
+        started.wait(5)
+        Card.check_card(self.pool, None, self.card.number).delete_card()
+        first.join()
+        self.assertIsNone(Card.check_card(self.pool, None, self.card.number))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from banking import Card, connect_db, migrate
+from bloom import CardFilter
+
+
+class CardFilterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.connect = connect_db(':memory:')
+        migrate(self.connect)
+        self.connect.card_filter = CardFilter.build(self.connect)
+        self.addCleanup(self.connect.close)
+
+    def test_second_delete_leaves_filter_alone(self):
+        card = Card(self.connect, None)
+        same = Card.check_card(self.connect, None, card.number)
+        other = Card(self.connect, None)
+        card.delete_card()
+        same.delete_card()
+        self.assertEqual(self.connect.card_filter.count, 1)
+        self.assertIsNotNone(Card.check_card(self.connect, None, other.number))
+
+    def test_wrong_pin_is_not_a_false_positive(self):
+        card = Card(self.connect, None)
+        wrong = '0000' if card.code != '0000' else '1111'
+        for _ in range(10):
+            self.assertIsNone(
+                Card.check_card(self.connect, None, card.number, wrong))
+        self.assertEqual(self.connect.card_filter.false_positives, 0)
+        self.assertEqual(
+            self.connect.card_filter.stats()['observed_fp_rate'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import errno
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from engine import LogEngine
+
+from .backends import synthetic_numbers
+
+
+class LogEngineRecoveryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.first, self.second = synthetic_numbers(2)
+
+    def open(self, **kwargs) -> LogEngine:
+        engine = LogEngine(self.directory, **kwargs)
+        self.addCleanup(engine.close)
+        return engine
+
+    def fill(self, engine: LogEngine) -> None:
+        engine.accounts(10)
+        engine.insert_many([(self.first, '1111', 100),
+                            (self.second, '2222', 0)])
+        engine.apply_delta(self.first, 20)
+        engine.transfer(self.first, self.second, 30)
+        engine.replace_pin(self.second, '2222', '3333')
+
+    def assert_filled(self, engine: LogEngine) -> None:
+        self.assertEqual(engine.get(self.first), ('1111', 90))
+        self.assertEqual(engine.get(self.second), ('3333', 30))
+
+    def test_log_is_replayed(self):
+        engine = self.open()
+        self.fill(engine)
+        next_value = engine.next_value
+        engine.close()
+
+        engine = self.open()
+        self.assert_filled(engine)
+        self.assertEqual(engine.next_value, next_value)
+        self.assertEqual(engine.delete(self.first), 90)
+        engine.close()
+        self.assertIsNone(self.open().get(self.first))
+
+    def test_snapshot_and_later_log_are_loaded(self):
+        engine = self.open()
+        self.fill(engine)
+        generation = engine.snapshot()
+        engine.apply_delta(self.second, 5)
+        engine.close()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f'log.{generation}', f'snapshot.{generation}'])
+
+        engine = self.open()
+        self.assertEqual(engine.generation, generation)
+        self.assertEqual(engine.get(self.second), ('3333', 35))
+
+    def test_torn_tail_is_truncated(self):
+        engine = self.open()
+        self.fill(engine)
+        engine.close()
+        path = os.path.join(self.directory, 'log.0')
+        size = os.path.getsize(path)
+        with open(path, 'a', encoding='ascii') as log:
+            log.write(f'M\t{self.first} 10')
+
+        engine = self.open()
+        self.assert_filled(engine)
+        self.assertEqual(os.path.getsize(path), size)
+        # Новая строка не приклеивается к отрезанному хвосту
+        engine.apply_delta(self.first, 1)
+        engine.close()
+        self.assertEqual(self.open().get(self.first), ('1111', 91))
+
+    def test_close_waits_for_background_snapshot(self):
+        engine = self.open(snapshot_every=2)
+        self.fill(engine)
+        engine.close()
+        self.assertNotIn('engine-snapshot',
+                         [thread.name for thread in threading.enumerate()])
+        generation = engine.generation
+        self.assertGreater(generation, 0)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [f'log.{generation}', f'snapshot.{generation}'])
+        self.assert_filled(self.open())
+
+    def test_failed_fsync_rolls_back_and_stops(self):
+        engine = self.open()
+        self.fill(engine)
+        with mock.patch.object(os, 'fsync',
+                               side_effect=OSError(errno.ENOSPC, 'full')):
+            with self.assertRaises(OSError):
+                engine.apply_delta(self.first, 5)
+            self.assert_filled(engine)
+            with self.assertRaises(OSError):
+                engine.apply_delta(self.second, 1)
+            with self.assertRaises(OSError):
+                engine.accounts(1)
+            with self.assertRaises(OSError):
+                engine.snapshot()
+            engine.close()
+        self.assert_filled(engine)
+        self.assert_filled(self.open())
+
+    def test_close_writes_buffered_log(self):
+        engine = self.open(durable=False)
+        self.fill(engine)
+        engine.close()
+        self.assert_filled(self.open())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from banking import Card, TransactionError, connect_db, migrate
+from group_commit import GroupCommitWriter
+
+
+class GroupCommitWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(directory.name, 'card.s3db')
+        connect = connect_db(self.path)
+        migrate(connect)
+        self.card = Card(connect, connect.cursor(), balance=10)
+        connect.commit()
+        connect.close()
+
+    def test_updates_are_committed(self):
+        with GroupCommitWriter(self.path) as writer:
+            futures = [writer.update_balance(self.card.number, 1)
+                       for _ in range(5)]
+            missing = writer.update_balance('4000000000000000', 1)
+            self.assertEqual(sorted(future.result(5) for future in futures),
+                             [11, 12, 13, 14, 15])
+            with self.assertRaises(TransactionError):
+                missing.result(5)
+        with self.assertRaises(RuntimeError):
+            writer.update_balance(self.card.number, 1)
+
+    def test_updates_racing_close_are_resolved(self):
+        writer = GroupCommitWriter(self.path)
+        futures = []
+        start = threading.Barrier(5)
+
+        def update():
+            start.wait()
+            for _ in range(200):
+                try:
+                    futures.append(writer.update_balance(self.card.number, 1))
+                except RuntimeError:
+                    return
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        writer.close()
+        for thread in threads:
+            thread.join()
+        for future in futures:
+            self.assertIsNotNone(future.result(5))
+
+    def test_failed_open_fails_pending_updates(self):
+        writer = GroupCommitWriter(
+            os.path.join(self.directory, 'missing', 'card.s3db'))
+        try:
+            future = writer.update_balance(self.card.number, 1)
+        except RuntimeError as e:
+            self.assertIsInstance(e.__cause__, sqlite3.OperationalError)
+        else:
+            with self.assertRaises(sqlite3.OperationalError):
+                future.result(5)
+        writer.close()
+        with self.assertRaises(RuntimeError):
+            writer.update_balance(self.card.number, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+from banking import (Card, SchemaError, connect_db, convert_layout, migrate,
+                     storage_layout)
+from cache import CardCache
+
+
+class LayoutTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'card.s3db')
+        self.connect = connect_db(self.path)
+        migrate(self.connect)
+        self.addCleanup(lambda: self.connect.close())
+        self.cards = [Card(self.connect, None, balance=index * 10)
+                      for index in range(5)]
+        # Переводы в ledger тоже должны пережить перестройку
+        self.cards[1].transfer_to(self.cards[4], 5)
+
+    def state(self) -> list:
+        return [(number, pin, balance) for number, pin, balance
+                in self.connect.execute(
+                    'SELECT CAST(number AS TEXT), pin, balance FROM card '
+                    'ORDER BY CAST(number AS TEXT)')]
+
+    def ledger(self) -> list:
+        return self.connect.execute(
+            'SELECT CAST(number AS TEXT), kind, amount, balance FROM ledger '
+            'ORDER BY id').fetchall()
+
+    def test_round_trip_keeps_cards_and_ledger(self):
+        state, ledger = self.state(), self.ledger()
+        self.assertEqual(convert_layout(self.connect, 'integer'), 5)
+        self.assertEqual(storage_layout(self.connect), 'integer')
+        self.assertEqual(self.state(), state)
+        self.assertEqual(self.ledger(), ledger)
+        self.assertEqual(convert_layout(self.connect, 'integer'), 0)
+        self.assertEqual(convert_layout(self.connect, 'text'), 5)
+        self.assertEqual(storage_layout(self.connect), 'text')
+        self.assertEqual(self.state(), state)
+
+    def test_cards_work_after_conversion(self):
+        convert_layout(self.connect, 'integer')
+        card = Card.check_card(self.connect, None, self.cards[2].number,
+                               self.cards[2].code)
+        self.assertIsNotNone(card)
+        self.assertEqual(card.balance, 20)
+        card.transfer_to(Card.check_card(self.connect, None,
+                                         self.cards[3].number), 5)
+        card.update_balance(1)
+        self.assertEqual(Card.check_card(self.connect, None,
+                                         card.number).balance, 16)
+        new = Card(self.connect, None, balance=7)
+        self.assertEqual(Card.check_card(self.connect, None,
+                                         new.number).balance, 7)
+        new.delete_card()
+        self.assertIsNone(Card.check_card(self.connect, None, new.number))
+
+    def test_non_canonical_numbers_find_no_card(self):
+        number, code = self.cards[2].number, self.cards[2].code
+        for layout in ('text', 'integer'):
+            convert_layout(self.connect, layout)
+            for cache in (None, CardCache()):
+                self.connect.card_cache = cache
+                for spelling in ('0' + number, number + ' ', number + '.0',
+                                 ' ' + number, int(number)):
+                    with self.subTest(layout=layout, cache=cache is not None,
+                                      spelling=spelling):
+                        self.assertIsNone(Card.check_card(
+                            self.connect, None, spelling))
+                        self.assertIsNone(Card.check_card(
+                            self.connect, None, spelling, code))
+                card = Card.check_card(self.connect, None, number, code)
+                self.assertEqual(card.number, number)
+
+    def test_invalid_numbers_block_integer_layout(self):
+        self.connect.execute("INSERT INTO card (number, pin, balance) "
+                             "VALUES ('0400000000000001', '1111', 0)")
+        self.connect.commit()
+        with self.assertRaises(SchemaError):
+            convert_layout(self.connect, 'integer')
+        self.assertEqual(storage_layout(self.connect), 'text')
+
+    def test_unknown_layout_and_missing_table(self):
+        with self.assertRaises(ValueError):
+            convert_layout(self.connect, 'columnar')
+        empty = connect_db(':memory:')
+        self.addCleanup(empty.close)
+        with self.assertRaises(SchemaError):
+            convert_layout(empty, 'integer')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import sqlite3
+import unittest
+
+from banking import Card, TransactionError, connect_db, migrate
+from records import LedgerEntry
+
+
+class LedgerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.connect = connect_db(':memory:')
+        migrate(self.connect)
+        self.addCleanup(self.connect.close)
+        self.card = Card(self.connect, None, balance=10)
+        self.other = Card(self.connect, None)
+        for money in range(1, 6):
+            self.card.update_balance(money)
+        self.card.transfer_to(self.other, 7)
+
+    def ledger_ids(self, number: str) -> list:
+        return [row[0] for row in self.connect.execute(
+            'SELECT id FROM ledger WHERE number = ? ORDER BY id DESC',
+            (number,))]
+
+    def test_pages_follow_keyset(self):
+        pages = []
+        before = None
+        while entries := LedgerEntry.page(self.connect, self.card.number,
+                                          before, limit=3):
+            self.assertLessEqual(len(entries), 3)
+            pages.append(entries)
+            before = entries[-1].id
+        self.assertEqual([len(entries) for entries in pages], [3, 3, 1])
+        entries = [entry for page in pages for entry in page]
+        self.assertEqual([entry.id for entry in entries],
+                         self.ledger_ids(self.card.number))
+        self.assertEqual(entries, list(LedgerEntry.history(
+            self.connect, self.card.number, page_size=2)))
+
+        newest, oldest = entries[0], entries[-1]
+        self.assertEqual((newest.kind, newest.amount, newest.balance,
+                          newest.counterparty),
+                         ('transfer', -7, 18, self.other.number))
+        self.assertEqual((oldest.kind, oldest.amount, oldest.balance),
+                         ('open', 10, 10))
+        self.assertEqual([entry.amount for entry in entries[1:-1]],
+                         [5, 4, 3, 2, 1])
+
+    def test_page_of_other_card_and_missing_card(self):
+        entries = LedgerEntry.page(self.connect, self.other.number)
+        self.assertEqual([(entry.kind, entry.amount, entry.counterparty)
+                          for entry in entries],
+                         [('transfer', 7, self.card.number),
+                          ('open', 0, None)])
+        self.assertEqual(LedgerEntry.page(self.connect, '4000000000000002'),
+                         [])
+
+    def test_failed_change_writes_no_entry(self):
+        count = len(self.ledger_ids(self.card.number))
+        with self.assertRaises(TransactionError):
+            self.card.transfer_to(self.other, 1000)
+        self.assertEqual(len(self.ledger_ids(self.card.number)), count)
+        self.assertEqual(len(self.ledger_ids(self.other.number)), 2)
+
+    def test_ledger_is_append_only(self):
+        for statement in ('UPDATE ledger SET amount = 0',
+                          'DELETE FROM ledger'):
+            with self.subTest(statement=statement):
+                with self.assertRaises(sqlite3.IntegrityError):
+                    self.connect.execute(statement)
+                self.connect.rollback()
+        self.assertEqual(len(self.ledger_ids(self.card.number)), 7)
+        # Закрытие карты оставляет ее историю
+        self.other.delete_card()
+        self.assertEqual(
+            LedgerEntry.page(self.connect, self.other.number, limit=1)[0][1:4],
+            ('close', -7, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
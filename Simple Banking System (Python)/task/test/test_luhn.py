@@ -0,0 +1,86 @@
+import random
+import unittest
+
+from banking import Card
+
+
+def legacy_luhn_checksum(account_number: str) -> int:
+    """Прежняя реализация Card.calculate_luhn_checksum."""
+    digits = [int(digit) for digit in account_number]
+    for i in range(len(digits) - 1, -1, -2):
+        digits[i] = digits[i] * 2
+        if digits[i] > 9:
+            digits[i] -= 9
+    return (10 - sum(digits) % 10) % 10
+
+
+def legacy_is_valid(number: str) -> bool:
+    return legacy_luhn_checksum(number[:-1]) == int(number[-1])
+
+
+def sample_numbers(count: int, seed: int = 1) -> list:
+    """Номера разной длины, в том числе с ведущими нулями."""
+    generator = random.Random(seed)
+    numbers = ['', '0', '9', '0000', '00000000000000000000', '4' * 19]
+    for _ in range(count):
+        length = generator.randint(1, 20)
+        numbers.append(''.join(generator.choice('0123456789')
+                               for _ in range(length)))
+    return numbers
+
+
+class LuhnBatchTest(unittest.TestCase):
+
+    def test_checksums_match_legacy(self):
+        numbers = sample_numbers(5000)
+        self.assertEqual(Card.luhn_checksums(numbers),
+                         [legacy_luhn_checksum(number)
+                          for number in numbers])
+
+    def test_validate_many_matches_legacy(self):
+        numbers = [number for number in sample_numbers(5000) if number]
+        # Половина номеров получает верную контрольную цифру
+        numbers += [number + str(legacy_luhn_checksum(number))
+                    for number in numbers]
+        self.assertEqual(Card.validate_many(numbers),
+                         [legacy_is_valid(number) for number in numbers])
+
+    def test_validate_many_rejects_non_digits(self):
+        account_number = '400000493832089'
+        valid = account_number + str(legacy_luhn_checksum(account_number))
+        self.assertEqual(Card.validate_many([valid, '', ' ' + valid,
+                                             valid[:-1] + 'x', '-18']),
+                         [True, False, False, False, False])
+
+    def test_checksums_reject_non_digits(self):
+        for number in ('12a4', ' 123', '-1'):
+            with self.subTest(number=number):
+                with self.assertRaises(ValueError):
+                    Card.luhn_checksums(['123', number])
+
+
+class LuhnScalarTest(unittest.TestCase):
+
+    def test_checksum_matches_legacy(self):
+        for number in sample_numbers(5000, seed=2):
+            self.assertEqual(Card.calculate_luhn_checksum(number),
+                             legacy_luhn_checksum(number), number)
+
+    def test_is_valid_card_number_matches_legacy(self):
+        for number in sample_numbers(2000, seed=3):
+            if not number:
+                continue
+            card = number + str(legacy_luhn_checksum(number))
+            self.assertTrue(Card.is_valid_card_number(card), card)
+            self.assertEqual(Card.is_valid_card_number(number),
+                             legacy_is_valid(number), number)
+
+    def test_checksum_rejects_non_digits(self):
+        for number in ('12a4', ' 123', '-1', '1.5'):
+            with self.subTest(number=number):
+                with self.assertRaises(ValueError):
+                    Card.calculate_luhn_checksum(number)
+
+
+if __name__ == '__main__':
+    unittest.main()
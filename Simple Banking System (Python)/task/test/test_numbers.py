@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+from banking import (AccountPermutation, Card, CardNumberAllocator,
+                     TransactionError, connect_db, migrate)
+
+
+class AccountPermutationTest(unittest.TestCase):
+
+    def test_counters_map_to_distinct_accounts(self):
+        permutation = AccountPermutation(12345)
+        accounts = [permutation.account(counter)
+                    for counter in range(100000)]
+        self.assertEqual(len(set(accounts)), len(accounts))
+        self.assertTrue(all(1 <= account <= AccountPermutation.SIZE
+                            for account in accounts))
+        # Последние значения счетчика тоже дают номера из диапазона
+        self.assertLessEqual(permutation.account(AccountPermutation.SIZE - 1),
+                             AccountPermutation.SIZE)
+
+    def test_key_selects_permutation(self):
+        first, second = AccountPermutation(1), AccountPermutation(2)
+        self.assertEqual([first.account(counter) for counter in range(10)],
+                         [AccountPermutation(1).account(counter)
+                          for counter in range(10)])
+        self.assertNotEqual([first.account(counter) for counter in range(10)],
+                            [second.account(counter)
+                             for counter in range(10)])
+
+    def test_counter_out_of_range(self):
+        permutation = AccountPermutation(1)
+        for counter in (-1, AccountPermutation.SIZE):
+            with self.subTest(counter=counter):
+                with self.assertRaises(TransactionError):
+                    permutation.account(counter)
+
+
+class CardNumberAllocatorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'card.s3db')
+
+    def connect(self):
+        connect = connect_db(self.path)
+        migrate(connect)
+        self.addCleanup(connect.close)
+        return connect
+
+    def test_accounts_are_unique_across_blocks(self):
+        allocator = CardNumberAllocator(self.connect(), block_size=100)
+        accounts = []
+        for count in (1, 99, 250, 7, 100, 43):
+            chunk = allocator.accounts(count)
+            self.assertEqual(len(chunk), count)
+            accounts.extend(chunk)
+        self.assertEqual(len(set(accounts)), len(accounts))
+
+    def test_connections_reserve_separate_blocks(self):
+        first = CardNumberAllocator(self.connect(), block_size=50)
+        second = CardNumberAllocator(self.connect(), block_size=50)
+        accounts = []
+        for _ in range(5):
+            accounts.extend(first.accounts(30))
+            accounts.extend(second.accounts(30))
+        self.assertEqual(len(set(accounts)), len(accounts))
+
+    def test_account_range_limits_accounts(self):
+        low, high = 1, AccountPermutation.SIZE // 4
+        allocator = CardNumberAllocator(self.connect(), block_size=10,
+                                        account_range=(low, high))
+        accounts = allocator.accounts(500)
+        self.assertEqual(len(set(accounts)), 500)
+        self.assertTrue(all(low <= account < high for account in accounts))
+
+    def test_issued_cards_are_unique_and_valid(self):
+        connect = self.connect()
+        numbers = [number for number, _ in Card.issue_many(connect, None,
+                                                           2000, 300)]
+        numbers.append(Card(connect, None).number)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertTrue(all(Card.validate_many(numbers)))
+
+
+if __name__ == '__main__':
+    unittest.main()
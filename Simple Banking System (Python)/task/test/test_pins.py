@@ -0,0 +1,97 @@
+import unittest
+
+from banking import Card, connect_db, migrate
+from cache import CardCache
+from pins import PinHasher, pin_matches
+
+
+class PinHasherTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.hasher = PinHasher(iterations=10, workers=1)
+        self.addCleanup(self.hasher.close)
+
+    def test_hash_verifies_only_its_pin(self):
+        stored = self.hasher.hash('1234')
+        self.assertTrue(PinHasher.is_hashed(stored))
+        self.assertTrue(stored.startswith('pbkdf2_sha256$10$'))
+        self.assertNotEqual(stored, self.hasher.hash('1234'))
+        self.assertTrue(self.hasher.verify('1234', stored))
+        self.assertFalse(self.hasher.verify('4321', stored))
+
+    def test_plain_pin_is_compared_as_is(self):
+        self.assertFalse(PinHasher.is_hashed('1234'))
+        self.assertTrue(self.hasher.verify('1234', '1234'))
+        self.assertFalse(self.hasher.verify('4321', '1234'))
+
+    def test_malformed_hash_does_not_verify(self):
+        for stored in ('pbkdf2_sha256$', 'pbkdf2_sha256$10$!!$!!',
+                       'pbkdf2_sha256$ten$AAAA$AAAA'):
+            with self.subTest(stored=stored):
+                self.assertFalse(pin_matches('1234', stored))
+
+    def test_needs_rehash(self):
+        self.assertTrue(self.hasher.needs_rehash('1234'))
+        self.assertFalse(self.hasher.needs_rehash(self.hasher.hash('1234')))
+        stronger = PinHasher(iterations=20, workers=1)
+        self.addCleanup(stronger.close)
+        self.assertTrue(stronger.needs_rehash(self.hasher.hash('1234')))
+
+
+class MixedPinLoginTest(unittest.TestCase):
+    """Вход по PIN с хешером и без него на одной базе."""
+
+    def setUp(self) -> None:
+        self.connect = connect_db(':memory:')
+        migrate(self.connect)
+        self.addCleanup(self.connect.close)
+        self.hasher = PinHasher(iterations=10, workers=1)
+        self.addCleanup(self.hasher.close)
+
+    def stored_pin(self, number: str) -> str:
+        return self.connect.execute('SELECT pin FROM card WHERE number = ?',
+                                    (number,)).fetchone()[0]
+
+    def test_plain_pin_is_rehashed_on_login(self):
+        card = Card(self.connect, None)
+        self.connect.pin_hasher = self.hasher
+        self.assertIsNotNone(Card.check_card(self.connect, None, card.number,
+                                             card.code))
+        self.assertTrue(PinHasher.is_hashed(self.stored_pin(card.number)))
+
+    def test_hashed_pin_is_rehashed_with_new_cost(self):
+        self.connect.pin_hasher = self.hasher
+        card = Card(self.connect, None)
+        old = self.stored_pin(card.number)
+        self.connect.pin_hasher = PinHasher(iterations=20, workers=1)
+        self.addCleanup(self.connect.pin_hasher.close)
+        self.assertIsNotNone(Card.check_card(self.connect, None, card.number,
+                                             card.code))
+        stored = self.stored_pin(card.number)
+        self.assertNotEqual(stored, old)
+        self.assertTrue(stored.startswith('pbkdf2_sha256$20$'))
+
+    def test_hashed_pin_logs_in_without_hasher(self):
+        plain = Card(self.connect, None)
+        self.connect.pin_hasher = self.hasher
+        card = Card(self.connect, None, balance=5)
+        self.connect.pin_hasher = None
+        wrong = '0000' if card.code != '0000' else '1111'
+        for cache in (None, CardCache()):
+            self.connect.card_cache = cache
+            with self.subTest(cache=cache is not None):
+                found = Card.check_card(self.connect, None, card.number,
+                                        card.code)
+                self.assertIsNotNone(found)
+                self.assertEqual(found.balance, 5)
+                self.assertIsNone(Card.check_card(self.connect, None,
+                                                  card.number, wrong))
+                self.assertIsNotNone(Card.check_card(
+                    self.connect, None, plain.number, plain.code))
+                # Сам хеш не подходит вместо PIN
+                self.assertIsNone(Card.check_card(
+                    self.connect, None, card.number, card.stored_code))
+
+
+if __name__ == '__main__':
+    unittest.main()
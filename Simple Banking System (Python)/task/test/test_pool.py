@@ -0,0 +1,88 @@
+import sqlite3
+import threading
+import unittest
+
+from pool import ConnectionPool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.failures = 0
+        self.opening = None
+
+    def factory(self):
+        """Открывает соединение, первые self.failures раз - с ошибкой."""
+        if self.opening is not None:
+            self.opening.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError('unable to open database file')
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def open(self, **kwargs) -> ConnectionPool:
+        pool = ConnectionPool(self.factory, **kwargs)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_failed_open_frees_its_slot(self):
+        pool = self.open(readers=2)
+        self.failures = 3
+        for _ in range(3):
+            with self.assertRaises(sqlite3.OperationalError):
+                with pool.reader():
+                    pass
+        with pool.reader() as first, pool.reader() as second:
+            self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['readers_open'], 2)
+
+    def test_waiting_reader_opens_slot_after_failed_open(self):
+        pool = self.open(readers=1)
+        self.failures = 1
+        self.opening = threading.Event()
+        results = []
+
+        def reader():
+            try:
+                with pool.reader():
+                    results.append('ok')
+            except sqlite3.OperationalError:
+                results.append('error')
+
+        # Один поток открывает единственное соединение, другой ждет
+        threads = [threading.Thread(target=reader, daemon=True)
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        self.opening.set()
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(results), ['error', 'ok'])
+
+    def test_checkout_timeout(self):
+        pool = self.open(readers=1, timeout=0.05)
+        with pool.reader():
+            with self.assertRaises(TimeoutError):
+                with pool.reader():
+                    pass
+        with pool.writer():
+            errors = []
+
+            def writer():
+                try:
+                    with pool.writer():
+                        pass
+                except TimeoutError as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=writer, daemon=True)
+            thread.start()
+            thread.join(5)
+        self.assertEqual(len(errors), 1)
+        with pool.reader(), pool.writer():
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
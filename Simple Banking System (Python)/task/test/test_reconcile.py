@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+from banking import Card, connect_db, convert_layout, migrate
+from reconcile import number_ranges, reconcile, reconcile_range
+
+# Все номера с INN 400000
+WHOLE = (4000000000000000, 4000010000000000)
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'card.s3db')
+        self.connect = connect_db(self.path)
+        migrate(self.connect)
+        self.addCleanup(self.connect.close)
+        self.cards = [Card(self.connect, None, balance=index * 10)
+                      for index in range(20)]
+        self.cards[1].transfer_to(self.cards[2], 5)
+        self.cards[3].update_balance(7)
+        # Удаленная карта: сумма ее записей нулевая
+        self.cards[4].delete_card()
+
+    def sorted_numbers(self) -> list:
+        return sorted(card.number for card in self.cards)
+
+    def damage(self) -> set:
+        """Расхождения трех видов, возвращает ожидаемые примеры."""
+        changed, deleted = self.cards[5], self.cards[6]
+        self.connect.execute('UPDATE card SET balance = balance + 1 '
+                             'WHERE number = ?', (changed.number,))
+        # Карта исчезла без записи close в журнале
+        self.connect.execute('DELETE FROM card WHERE number = ?',
+                             (deleted.number,))
+        unlogged = '4000000000000002'
+        self.connect.execute("INSERT INTO card (number, pin, balance) "
+                             "VALUES (?, '0000', 3)", (unlogged,))
+        self.connect.commit()
+        return {(changed.number, 51, 50), (deleted.number, None, 60),
+                (unlogged, 3, 0)}
+
+    def test_consistent_database_has_no_mismatches(self):
+        result = reconcile_range(self.path, *WHOLE)
+        self.assertEqual(result['mismatches'], 0)
+        self.assertEqual(result['cards'], 19)
+        self.assertEqual(result['entries_total'],
+                         sum(index * 10 for index in range(20)) + 7 - 40)
+
+    def test_mismatches_are_found_in_both_layouts(self):
+        expected = self.damage()
+        for layout in ('text', 'integer'):
+            convert_layout(self.connect, layout)
+            with self.subTest(layout=layout):
+                result = reconcile_range(self.path, *WHOLE)
+                self.assertEqual(result['mismatches'], 3)
+                self.assertEqual(set(result['examples']), expected)
+                self.assertEqual(result['cards'], 19)
+
+    def test_range_limits_cards(self):
+        numbers = self.sorted_numbers()
+        low, high = int(numbers[3]), int(numbers[10])
+        deleted = low <= int(self.cards[4].number) < high
+        result = reconcile_range(self.path, low, high)
+        self.assertEqual(result['cards'], 7 - deleted)
+        self.assertEqual(result['mismatches'], 0)
+
+    def test_example_limit(self):
+        self.damage()
+        result = reconcile_range(self.path, *WHOLE, limit=2)
+        self.assertEqual(result['mismatches'], 3)
+        self.assertEqual(len(result['examples']), 2)
+
+    def test_parts_give_the_same_report(self):
+        expected = self.damage()
+        single = reconcile(self.path)
+        self.assertEqual(set(single['examples']), expected)
+        for workers, parts in ((1, 3), (1, 7), (2, 4)):
+            with self.subTest(workers=workers, parts=parts):
+                report = reconcile(self.path, workers, parts, chunk_size=2)
+                self.assertEqual(
+                    {key: report[key] for key in
+                     ('cards', 'entries_total', 'mismatches')},
+                    {key: single[key] for key in
+                     ('cards', 'entries_total', 'mismatches')})
+                self.assertEqual(set(report['examples']), expected)
+
+    def test_number_ranges_cover_cards_and_ledger(self):
+        self.damage()
+        numbers = [int(number) for number in self.sorted_numbers()]
+        numbers.append(4000000000000002)
+        for parts in (1, 2, 5, 100):
+            with self.subTest(parts=parts):
+                ranges = number_ranges(self.path, parts)
+                self.assertEqual(ranges[0][0], min(numbers))
+                self.assertEqual(ranges[-1][1], max(numbers) + 1)
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                self.assertLessEqual(len(ranges), parts)
+
+    def test_empty_database(self):
+        empty = os.path.join(os.path.dirname(self.path), 'empty.s3db')
+        connect = connect_db(empty)
+        migrate(connect)
+        connect.close()
+        self.assertEqual(number_ranges(empty, 4), [])
+        self.assertEqual(reconcile(empty, parts=4)['cards'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from banking import Card, SQLiteStorage, connect_db, migrate
+from server import REQUEST_LIMIT, BankServer
+
+
+class BankServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'card.s3db')
+        connect = connect_db(path)
+        migrate(connect)
+        connect.close()
+        self.bank = BankServer(path, workers=2)
+        self.addCleanup(self.bank.close)
+        self.server = await asyncio.start_server(
+            self.bank.handle, '127.0.0.1', 0, limit=REQUEST_LIMIT)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def client(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                       self.port)
+        self.addCleanup(writer.close)
+        return reader, writer
+
+    @staticmethod
+    async def request(reader, writer, line: bytes) -> dict:
+        writer.write(line + b'\n')
+        await writer.drain()
+        return json.loads(await asyncio.wait_for(reader.readline(), 5))
+
+    async def test_database_error_is_a_response(self):
+        reader, writer = await self.client()
+        created = await self.request(reader, writer, b'{"command": "create"}')
+        login = json.dumps({'command': 'login', 'number': created['number'],
+                            'pin': created['pin']}).encode()
+        locked = sqlite3.OperationalError('database is locked')
+        for target, name, line in (
+                (Card, 'check_card', login),
+                (SQLiteStorage, 'accounts', b'{"command": "create"}')):
+            with self.subTest(line=line), mock.patch.object(
+                    target, name, side_effect=locked):
+                response = await self.request(reader, writer, line)
+                self.assertFalse(response['ok'])
+                self.assertIn('database is locked', response['error'])
+        # Сессия продолжает работу
+        self.assertTrue((await self.request(reader, writer, login))['ok'])
+        response = await self.request(reader, writer,
+                                      b'{"command": "balance"}')
+        self.assertEqual(response, {'balance': 0, 'ok': True})
+
+    async def test_too_long_request_is_rejected(self):
+        reader, writer = await self.client()
+        response = await self.request(reader, writer,
+                                      b'x' * (REQUEST_LIMIT + 1))
+        self.assertEqual(response, {'ok': False,
+                                    'error': 'Request is too long'})
+        self.assertEqual(await asyncio.wait_for(reader.read(), 5), b'')
+
+        reader, writer = await self.client()
+        response = await self.request(reader, writer, b'[]')
+        self.assertEqual(response, {'ok': False,
+                                    'error': 'Malformed request'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import shards
+from banking import (AccountPermutation, Card, SQLiteStorage,
+                     TransactionError, change_balance, checkout, execute,
+                     immediate_transaction)
+from shards import INN, ShardRouter
+
+
+def card_number(account: int) -> str:
+    account_number = f'{INN}{account:09d}'
+    return account_number + str(Card.calculate_luhn_checksum(account_number))
+
+
+class ShardRoutingTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def router(self, count: int) -> ShardRouter:
+        paths = [os.path.join(self.directory.name, f'{count}-{index}.s3db')
+                 for index in range(count)]
+        router = ShardRouter(paths, readers=1)
+        self.addCleanup(router.close)
+        return router
+
+    def test_boundary_accounts_route_to_allocating_shard(self):
+        for count in (2, 3, 5, 8):
+            router = self.router(count)
+            for index in range(count):
+                low, high = router.account_range(index)
+                for account in (low, high - 1):
+                    with self.subTest(count=count, account=account):
+                        self.assertEqual(
+                            router.shard_index(card_number(account)), index)
+
+    def test_boundary_card_is_found(self):
+        router = self.router(2)
+        number = card_number(router.account_range(1)[0])
+        SQLiteStorage(router.shards[1]).insert(number, '1234', 10)
+        card = router.check_card(number, '1234')
+        self.assertIsNotNone(card)
+        self.assertEqual(card.balance, 10)
+
+    def test_account_ranges_cover_all_accounts(self):
+        for count in (1, 2, 3, 7):
+            router = self.router(count)
+            ranges = [router.account_range(index) for index in range(count)]
+            with self.subTest(count=count):
+                self.assertEqual(ranges[0][0], 1)
+                self.assertEqual(ranges[-1][1], AccountPermutation.SIZE + 1)
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+
+    def test_cards_are_issued_in_own_shard(self):
+        router = self.router(3)
+        for index, shard in enumerate(router.shards):
+            with self.subTest(shard=index):
+                numbers = [number for number, _
+                           in Card.issue_many(shard, None, 50)]
+                self.assertEqual(len(set(numbers)), 50)
+                self.assertEqual({router.shard_index(number)
+                                  for number in numbers}, {index})
+
+    def test_foreign_numbers_have_no_shard(self):
+        router = self.router(2)
+        self.assertIsNone(router.shard_index(card_number(0)))
+        self.assertIsNone(router.shard_index('5000000000000000'))
+        self.assertIsNone(router.shard_index(4000000000000000))
+
+
+class ShardTransferTest(unittest.TestCase):
+    """Переводы между файлами: ошибки посреди перевода и recover."""
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = [os.path.join(directory.name, f'{index}.s3db')
+                      for index in range(2)]
+        router = ShardRouter(self.paths, readers=1)
+        self.source = router.create_card(balance=100)
+        self.target = router.create_card()
+        self.assertIsNot(router.shard_for(self.source.number),
+                         router.shard_for(self.target.number))
+        self.router = router
+        self.addCleanup(lambda: self.router.close())
+
+    def restart(self) -> ShardRouter:
+        """Закрывает маршрутизатор, как при сбое, и открывает заново."""
+        self.router.close()
+        self.router = ShardRouter(self.paths, readers=1)
+        return self.router
+
+    def prepare(self, amount: int) -> int:
+        with checkout(self.router.shards[0], None,
+                      write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                return execute(cursor, 'transfer_log_insert',
+                               (self.source.number, self.target.number,
+                                amount)).lastrowid
+
+    def change_source(self, ref: int, money: int, kind: str) -> None:
+        with checkout(self.router.shard_for(self.source.number), None,
+                      write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                change_balance(cursor, self.source.number, money, True,
+                               kind, self.target.number, ref)
+
+    def debit(self, ref: int, amount: int) -> None:
+        self.change_source(ref, -amount, 'transfer')
+
+    def set_state(self, ref: int, state: str) -> None:
+        with checkout(self.router.shards[0], None,
+                      write=True) as (connect, cursor):
+            with immediate_transaction(connect):
+                execute(cursor, 'transfer_log_state', (state, ref))
+
+    def balances(self, router: ShardRouter) -> tuple:
+        return tuple(router.check_card(card.number).balance
+                     for card in (self.source, self.target))
+
+    def states(self, router: ShardRouter) -> list:
+        with router.shards[0].reader() as connect:
+            return [state for state, in connect.execute(
+                'SELECT state FROM transfer_log ORDER BY id')]
+
+    def test_prepared_transfer_is_aborted(self):
+        self.prepare(30)
+        router = self.restart()
+        self.assertEqual(self.balances(router), (100, 0))
+        self.assertEqual(self.states(router), ['aborted'])
+
+    def test_debited_transfer_is_credited(self):
+        self.debit(self.prepare(30), 30)
+        router = self.restart()
+        self.assertEqual(self.balances(router), (70, 30))
+        self.assertEqual(self.states(router), ['committed'])
+        self.assertEqual(router.recover(), 0)
+        self.assertEqual(self.balances(router), (70, 30))
+
+    def test_refunded_transfer_is_not_credited(self):
+        # Сбой между возвратом и отметкой aborted
+        ref = self.prepare(30)
+        self.debit(ref, 30)
+        self.set_state(ref, 'refunding')
+        self.change_source(ref, 30, 'refund')
+        router = self.restart()
+        self.assertEqual(self.balances(router), (100, 0))
+        self.assertEqual(self.states(router), ['aborted'])
+
+    def test_refund_without_state_is_not_credited(self):
+        ref = self.prepare(30)
+        self.debit(ref, 30)
+        self.change_source(ref, 30, 'refund')
+        router = self.restart()
+        self.assertEqual(self.balances(router), (100, 0))
+        self.assertEqual(self.states(router), ['aborted'])
+
+    def test_refunding_transfer_is_refunded(self):
+        ref = self.prepare(30)
+        self.debit(ref, 30)
+        self.set_state(ref, 'refunding')
+        router = self.restart()
+        self.assertEqual(self.balances(router), (100, 0))
+        self.assertEqual(self.states(router), ['aborted'])
+
+    def test_recover_skips_running_transfer(self):
+        recovered = []
+        original = shards.change_balance
+
+        def change(cursor, number, *args):
+            if number == self.target.number and not recovered:
+                recovered.append(self.router.recover())
+                raise sqlite3.OperationalError('database is locked')
+            return original(cursor, number, *args)
+
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(shards, 'STEP_DELAY', 0).start()
+        mock.patch.object(shards, 'change_balance', change).start()
+        self.router.transfer(self.source, self.target, 30)
+        self.assertEqual(recovered, [0])
+        self.assertEqual(self.balances(self.router), (70, 30))
+        self.assertEqual(self.states(self.router), ['committed'])
+
+    def test_debited_transfer_to_deleted_card_is_refunded(self):
+        self.debit(self.prepare(30), 30)
+        self.router.check_card(self.target.number).delete_card()
+        router = self.restart()
+        self.assertEqual(router.check_card(self.source.number).balance, 100)
+        self.assertEqual(self.states(router), ['aborted'])
+
+    def busy_target(self, failures: int):
+        """
+        Подменяет change_balance: первые failures зачислений получателю
+        падают, как на занятом файле.
+        """
+        calls = {'failed': 0}
+
+        def change(cursor, number, *args):
+            if number == self.target.number and calls['failed'] < failures:
+                calls['failed'] += 1
+                raise sqlite3.OperationalError('database is locked')
+            return change_balance(cursor, number, *args)
+
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(shards, 'STEP_DELAY', 0).start()
+        mock.patch.object(shards, 'change_balance', change).start()
+
+    def test_busy_target_is_retried(self):
+        self.busy_target(shards.STEP_ATTEMPTS - 1)
+        self.router.transfer(self.source, self.target, 30)
+        self.assertEqual((self.source.balance, self.target.balance), (70, 30))
+        self.assertEqual(self.balances(self.router), (70, 30))
+        self.assertEqual(self.states(self.router), ['committed'])
+
+    def test_busy_target_refunds_source(self):
+        self.busy_target(shards.STEP_ATTEMPTS)
+        with self.assertRaises(TransactionError):
+            self.router.transfer(self.source, self.target, 30)
+        self.assertEqual(self.source.balance, 100)
+        self.assertEqual(self.balances(self.router), (100, 0))
+        self.assertEqual(self.states(self.router), ['aborted'])
+
+    def test_card_transfer_to_other_shard(self):
+        card = self.router.check_card(self.source.number, self.source.code)
+        other = self.router.check_card(self.target.number)
+        card.transfer_to(other, 30)
+        self.assertEqual((card.balance, other.balance), (70, 30))
+        self.assertEqual(self.balances(self.router), (70, 30))
+        self.assertEqual(self.states(self.router), ['committed'])
+        with self.assertRaises(TransactionError):
+            card.transfer_to(other, 1000)
+        self.assertEqual(self.balances(self.router), (70, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()